@@ -0,0 +1,403 @@
+"""Benchmarks for the CLEMM matrix terminal.
+
+Measures rain frame time, typewriter throughput, output append latency as
+the scrollback fills, tool fan-out and end-to-end ASK latency/throughput,
+all against fake crew members and fake tools so no model is needed.
+
+    python clemm_bench.py --output results.json
+    python clemm_bench.py --quick --only ask,tools
+    python clemm_bench.py --baseline old.json    # Compare with an earlier run
+
+Tk benchmarks need a display. Without DISPLAY an Xvfb server is started
+when one is installed (or run the whole thing under xvfb-run -a).
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import clemmui
+
+
+class FakeModel:
+    """Stands in for a loaded model; crew members sharing one share a backend"""
+
+
+class FakeCrewMember:
+    """Crew member whose chat() takes latency seconds and returns output_chars characters"""
+    def __init__(self, latency=0.05, output_chars=400, stream=False, chunk_chars=4, model=None):
+        self.latency = latency
+        self.output_chars = output_chars
+        self.chunk_chars = chunk_chars
+        self.model = model or FakeModel()
+        self.history = []
+        if stream:
+            self.stream_chat = self._stream_chat
+
+    def _text(self, query):
+        line = f"ACK {query} " + "0101 " * 15
+        return (line * (self.output_chars // len(line) + 1))[:self.output_chars]
+
+    def chat(self, query):
+        time.sleep(self.latency)
+        return self._text(query)
+
+    def _stream_chat(self, query):
+        text = self._text(query)
+        chunks = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+        pause = self.latency / max(1, len(chunks))
+        for chunk in chunks:
+            time.sleep(pause)
+            yield chunk
+
+    def reset(self):
+        self.history = []
+
+
+def fake_backend(count=8, latency=0.01, output_chars=200):
+    """An already-loaded Backend exposing count fake tools"""
+    names = [f"tool{i}" for i in range(count)]
+
+    def list_tools():
+        return [{"name": name, "description": "benchmark tool", "args": []} for name in names]
+
+    def run_tool(name, crew_instance=None):
+        time.sleep(latency)
+        return "R" * output_chars
+
+    return clemmui.Backend(list_tools=list_tools, run_tool=run_tool)
+
+
+class CountingSink(clemmui.OutputSink):
+    """Discards output but counts it, so the benchmark does not measure a terminal"""
+    def __init__(self):
+        self.lines = 0
+        self.chars = 0
+        self._lock = threading.Lock()
+
+    def write_raw(self, text):
+        with self._lock:
+            self.lines += 1
+            self.chars += len(text)
+
+    def write(self, text):
+        self.write_raw(text)
+
+
+def summarize(samples):
+    """mean/p50/p95/max of a list of seconds, in milliseconds"""
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {"n": len(ordered), "mean_ms": round(sum(ordered) / len(ordered) * 1000, 4),
+            "p50_ms": round(pick(0.5), 4), "p95_ms": round(pick(0.95), 4),
+            "max_ms": round(ordered[-1] * 1000, 4)}
+
+
+def record(bench, params, metrics):
+    return {"bench": bench, "params": params, "metrics": metrics}
+
+
+def engine_config(**overrides):
+    """Engine settings that keep benchmarks off disk and free of background work"""
+    config = {"response_cache": False, "transcript_dir": None, "session_dir": None, "code_prewarm": False}
+    config.update(overrides)
+    return config
+
+
+# -- Tk benchmarks ---------------------------------------------------------
+
+def bench_rain(root, quick):
+    """MatrixRain.animate cost per frame for several window sizes and stream counts"""
+    sizes = [(640, 480), (1280, 800)] if quick else [(640, 480), (1280, 800), (1920, 1080), (3840, 2160)]
+    counts = [25, 100] if quick else [25, 50, 100, 200, 400]
+    frames = 60 if quick else 200
+    results = []
+    for width, height in sizes:
+        for count in counts:
+            rain = clemmui.MatrixRain(root, max_items=count * clemmui.MatrixRain.MAX_STREAM_LENGTH,
+                                      width=width, height=height)
+            rain.place(x=0, y=0, width=width, height=height)
+            root.update()
+            rain.width, rain.height = width, height
+            rain.active = True
+            # Frames are driven here rather than by the rain's own after() chain
+            rain.after = lambda *args: None
+            rain.streams = [rain._new_stream() for _ in range(min(count, rain.max_streams))]
+            for stream in rain.streams:
+                stream["y"] = clemmui.random.randint(0, height)
+            animate, render = [], []
+            for _ in range(frames):
+                rain.density = 1.0
+                started = time.perf_counter()
+                rain.animate()
+                drawn = time.perf_counter()
+                root.update_idletasks()
+                animate.append(drawn - started)
+                render.append(time.perf_counter() - drawn)
+            results.append(record("rain", {"width": width, "height": height, "streams": len(rain.streams)},
+                                  {"animate": summarize(animate), "render": summarize(render),
+                                   "items": len(rain.find_all())}))
+            rain.destroy()
+    return results
+
+
+def _pump(root, done, timeout):
+    deadline = time.perf_counter() + timeout
+    while not done() and time.perf_counter() < deadline:
+        root.update()
+        time.sleep(0.001)
+
+
+def bench_typewriter(root, quick):
+    """Characters per second the typewriter delivers and how long each frame blocks the loop"""
+    length = 1000 if quick else 4000
+    delays = [1, 0.05] if quick else [2, 1, 0.25, 0.05]
+    results = []
+    text = ("THE QUICK GREEN GLYPH JUMPS OVER THE LAZY DAEMON 0101\n" * (length // 52 + 1))[:length]
+    for delay in delays:
+        widget = clemmui.TypewriterText(root, width=100, height=40)
+        widget.pack()
+        ticks = []
+        tick = widget._tick
+
+        def timed_tick(tick=tick):
+            started = time.perf_counter()
+            tick()
+            ticks.append(time.perf_counter() - started)
+
+        widget._tick = timed_tick
+        finished = []
+        started = time.perf_counter()
+        widget.typewrite(text, delay=delay, callback=lambda: finished.append(time.perf_counter()))
+        _pump(root, lambda: finished, timeout=length * delay / 1000 * 3 + 10)
+        elapsed = (finished[0] if finished else time.perf_counter()) - started
+        results.append(record("typewriter", {"chars": length, "delay_ms": delay},
+                              {"chars_per_sec": round(length / elapsed, 1),
+                               "nominal_chars_per_sec": round(1000 / max(0.05, delay), 1),
+                               "seconds": round(elapsed, 4), "completed": bool(finished),
+                               "frame": summarize(ticks)}))
+        widget.destroy()
+    return results
+
+
+def bench_append(root, quick):
+    """write() latency of the output area as the scrollback fills and starts trimming"""
+    total = 6000 if quick else 30000
+    bucket = total // 10
+    limits = [2000] if quick else [1000, 5000, None]
+    results = []
+    line = "RESULT: " + "0101 " * 14 + "\n"
+    for limit in limits:
+        with tempfile.TemporaryDirectory() as directory:
+            transcript = clemmui.Transcript(os.path.join(directory, "bench.log"))
+            widget = clemmui.TypewriterText(root, scrollback_lines=limit, transcript=transcript,
+                                            width=100, height=40)
+            widget.pack()
+            root.update()
+            samples = []
+            for i in range(1, total + 1):
+                started = time.perf_counter()
+                widget.write(line)
+                samples.append(time.perf_counter() - started)
+                if i % bucket == 0:
+                    root.update_idletasks()
+                    results.append(record("append", {"scrollback_lines": limit, "lines_written": i},
+                                          {"write": summarize(samples),
+                                           "widget_lines": int(widget.index("end-1c").split(".")[0])}))
+                    samples = []
+            widget.destroy()
+            transcript.close()
+    return results
+
+
+# -- Engine benchmarks -----------------------------------------------------
+
+def bench_ask(quick, latency, output_chars):
+    """End-to-end ASK latency and throughput with concurrent clients"""
+    scenarios = [(1, False, False), (4, False, False), (4, True, False), (4, False, True)]
+    if not quick:
+        scenarios += [(16, False, False), (16, True, False), (16, False, True)]
+    asks = 10 if quick else 40
+    results = []
+    for clients, shared, stream in scenarios:
+        model = FakeModel() if shared else None
+        crew = {f"member{i}": FakeCrewMember(latency, output_chars, stream=stream, model=model)
+                for i in range(clients)}
+        sink = CountingSink()
+        engine = clemmui.CommandEngine(sink, crew_instance=crew, config=engine_config(),
+                                       backend=fake_backend())
+        engine.start()
+        lock = threading.Lock()
+        latencies = []
+
+        def client(name):
+            for i in range(asks):
+                started = time.perf_counter()
+                with engine._lock:
+                    # USE and ASK must pair up when several clients share the engine
+                    engine.execute(f"use {name}")
+                    future = engine.execute(f"ask q{i}")
+                future.result()
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=client, args=(name,)) for name in crew]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+        engine.shutdown()
+        results.append(record("ask", {"clients": clients, "shared_backend": shared, "stream": stream,
+                                      "chat_latency_ms": latency * 1000, "output_chars": output_chars},
+                              {"latency": summarize(latencies),
+                               "throughput_per_sec": round(len(latencies) / wall, 2),
+                               "wall_seconds": round(wall, 4), "output_chars": sink.chars}))
+    return results
+
+
+def bench_tools(quick):
+    """RUN_TOOL fan-out wall time against the per-tool latency"""
+    results = []
+    for count in ([1, 4] if quick else [1, 4, 8, 16]):
+        latency = 0.05
+        engine = clemmui.CommandEngine(CountingSink(), config=engine_config(), backend=fake_backend(count, latency))
+        engine.start()
+        engine.backend.ready.wait()
+        while engine.backend_state != "ready":
+            time.sleep(0.001)
+        samples = []
+        for _ in range(3 if quick else 10):
+            started = time.perf_counter()
+            engine.execute("run_tool " + " ".join(f"tool{i}" for i in range(count))).result()
+            samples.append(time.perf_counter() - started)
+        engine.shutdown()
+        results.append(record("tools", {"tools": count, "tool_latency_ms": latency * 1000,
+                                        "threads": engine.settings["tool_threads"]},
+                              {"wall": summarize(samples)}))
+    return results
+
+
+# -- Runner ----------------------------------------------------------------
+
+def start_xvfb():
+    """Start an Xvfb server and point DISPLAY at it; returns the process or None"""
+    if os.environ.get("DISPLAY") or not shutil.which("Xvfb"):
+        return None
+    read_fd, write_fd = os.pipe()
+    process = subprocess.Popen(["Xvfb", "-displayfd", str(write_fd), "-screen", "0", "3840x2160x24", "-nolisten", "tcp"],
+                               pass_fds=(write_fd,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        display = pipe.readline().strip()
+    if not display:
+        process.kill()
+        return None
+    os.environ["DISPLAY"] = f":{display}"
+    return process
+
+
+def environment():
+    source = os.path.abspath(clemmui.__file__)
+    with open(source, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:16]
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(source),
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "tk": clemmui.tk.TkVersion, "cpus": os.cpu_count(),
+            "clemmui_sha256": digest, "commit": commit, "display": os.environ.get("DISPLAY")}
+
+
+def compare(results, baseline_path):
+    """Print the ratio of every numeric metric to the matching baseline record"""
+    with open(baseline_path) as f:
+        baseline = {(r["bench"], json.dumps(r["params"], sort_keys=True)): r["metrics"]
+                    for r in json.load(f)["results"]}
+
+    def flatten(metrics, prefix=""):
+        for key, value in metrics.items():
+            if isinstance(value, dict):
+                yield from flatten(value, f"{prefix}{key}.")
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield prefix + key, value
+
+    for r in results:
+        old = baseline.get((r["bench"], json.dumps(r["params"], sort_keys=True)))
+        if old is None:
+            continue
+        old_values = dict(flatten(old))
+        changes = [f"{key} {old_values[key]:g}->{value:g} (x{value / old_values[key]:.2f})"
+                   for key, value in flatten(r["metrics"]) if old_values.get(key)]
+        print(f"{r['bench']} {r['params']}: " + "; ".join(changes))
+
+
+BENCHES = ("rain", "typewriter", "append", "ask", "tools")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CLEMM matrix terminal benchmarks")
+    parser.add_argument("--output", default="clemm-bench.json", help="where to write the JSON results")
+    parser.add_argument("--only", default=",".join(BENCHES), help="comma-separated subset of " + ",".join(BENCHES))
+    parser.add_argument("--quick", action="store_true", help="fewer sizes and iterations")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake chat() latency in seconds")
+    parser.add_argument("--output-chars", type=int, default=400, help="fake chat() response length")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+    selected = [name.strip() for name in args.only.split(",") if name.strip()]
+
+    xvfb = start_xvfb()
+    results, skipped = [], {}
+    try:
+        tk_benches = [name for name in selected if name in ("rain", "typewriter", "append")]
+        if tk_benches:
+            try:
+                root = clemmui.tk.Tk()
+                root.geometry("3840x2160")
+            except clemmui.tk.TclError as e:
+                for name in tk_benches:
+                    skipped[name] = f"no display: {e}"
+            else:
+                for name in tk_benches:
+                    print(f"running {name}...", file=sys.stderr)
+                    results += globals()[f"bench_{name}"](root, args.quick)
+                root.destroy()
+        if "ask" in selected:
+            print("running ask...", file=sys.stderr)
+            results += bench_ask(args.quick, args.latency, args.output_chars)
+        if "tools" in selected:
+            print("running tools...", file=sys.stderr)
+            results += bench_tools(args.quick)
+    finally:
+        if xvfb:
+            xvfb.terminate()
+
+    report = {"environment": environment(), "quick": args.quick, "results": results, "skipped": skipped}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    for r in results:
+        print(json.dumps({"bench": r["bench"], **r["params"], **r["metrics"]}))
+    for name, reason in skipped.items():
+        print(f"skipped {name}: {reason}", file=sys.stderr)
+    if args.baseline:
+        compare(results, args.baseline)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -3,170 +3,4393 @@ from tkinter import simpledialog, messagebox
 from tkinter.scrolledtext import ScrolledText
 import threading
 import subprocess
+import copy
 import random
 import time
 import os
 import sys
 import string
+import inspect
+import hashlib
+import json
+import uuid
+import importlib
+import tempfile
+import pickle
+import queue
+import re
+import keyword
+import math
+import heapq
+import http.client
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from array import array
+from collections import deque, OrderedDict, Counter
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import List, Dict, Optional, Any
 
 # Add parent directory to path to ensure imports work
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Import backend components
-from bridge.tools.tools import list_tools, run_tool
-import Engine.raven as raven
-import bridge.crew as crew
+# Backend components are imported lazily by Backend.load() so the window can
+# appear before the model/tool import chain has finished
+BACKEND_MODULES = (
+    ("TOOLS", "bridge.tools.tools"),
+    ("ENGINE", "Engine.raven"),
+    ("CREW", "bridge.crew"),
+)
+
+# UI tunables, override any of them with ClemmMatrixUI(config={...})
+DEFAULT_CONFIG = {
+    "rain_target_fps": 20,      # Frame rate the rain aims for when the box is idle
+    "rain_cpu_budget": 0.15,    # Fraction of one core the rain may spend drawing
+    "ui_drain_ms": 30,          # How often worker-thread UI updates are applied
+    "stream_responses": True,   # Render tokens as they arrive when the crew can stream
+    "stream_flush_ms": 50,      # Batch streamed tokens into one insert per interval
+    "scrollback_lines": 5000,   # Lines kept in the output area; older ones live in the transcript
+    "highlight_code": True,     # Syntax-highlight code_expert answers (uses Pygments when installed)
+    "transcript_dir": os.path.join(os.path.expanduser("~"), ".clemm", "transcripts"),  # None disables
+    "transcript_index": True,   # Keep a FIND index of the transcript, saved beside it as .idx
+    "find_results": 10,         # Matches listed by FIND
+    "max_inflight_per_backend": 1,  # Concurrent chat() calls allowed into one model backend
+    "response_cache": True,     # Answer repeated questions from the response cache
+    "response_cache_size": 256,  # Cached answers kept, least recently used evicted first
+    "response_cache_path": os.path.join(os.path.expanduser("~"), ".clemm", "response_cache.json"),  # None keeps it in memory
+    "tool_threads": 4,          # Worker threads for ordinary (I/O-bound) tools
+    "tool_processes": 2,        # Child processes for isolated (CPU-heavy or untrusted) tools
+    "tool_timeout": 120,        # Seconds before a tool run is abandoned
+    "tool_timeouts": {},        # Per-tool timeout overrides, tool name -> seconds
+    "process_tools": (),        # Tools to isolate in a child process besides those the registry marks
+    "tool_preview_lines": 40,   # Lines of a tool result shown before the rest waits for EXPAND
+    "tool_preview_chars": 4000,  # Characters of a tool result shown before the rest waits for EXPAND
+    "tool_expand_chunk": 200,   # Lines per write when EXPAND streams the rest of a result
+    "code_timeout": 30,         # Wall-clock seconds a RUN_CODE sequence may run
+    "code_cpu_seconds": 20,     # CPU-time rlimit for RUN_CODE (POSIX only)
+    "code_memory_mb": 512,      # Address-space rlimit for RUN_CODE (POSIX only)
+    "code_prewarm": True,       # Keep an interpreter started and waiting for the next RUN_CODE
+    "server_url": None,         # llama.cpp server address; default from the model dict or localhost:8080
+    "server_pool_size": 4,      # Keep-alive connections held open to the server
+    "server_ready_timeout": 120,  # Seconds to wait for the server to finish loading
+    "server_health_interval": 5,  # Seconds between server health checks
+    "server_shutdown_timeout": 10,  # Seconds EXIT waits for the server to stop before killing it
+    "context_high_water": 0.8,  # Compact a member's history once its prompt passes this share of the context
+    "context_keep_turns": 4,    # Most recent exchanges that are never compacted
+    "context_reserve_tokens": 512,  # Context left free for the answer
+    "context_summary_tokens": 256,  # Size of the digest that replaces compacted turns
+    "session_dir": os.path.join(os.path.expanduser("~"), ".clemm", "sessions"),  # None disables saving/resuming conversations
+    "session_kv_state": True,   # Also save the llama.cpp state on exit so resuming skips prompt re-evaluation
+    "loop_monitor_ms": 100,     # Heartbeat interval used to measure Tk event-loop lag
+    "stall_threshold_ms": 250,  # Event-loop stalls longer than this are traced and logged; None disables
+    "metrics_path": None,       # JSON file the live metrics are written to periodically; None disables
+    "metrics_interval": 5,      # Seconds between metrics file writes
+    "metrics_port": None,       # Serve the live metrics as JSON on 127.0.0.1:<port>/metrics; None disables
+    "prefill_crew": True,       # Evaluate every crew member's system prompt in the background at startup
+    "warm_set_size": 3,         # Crew members whose model state is kept for a fast switch; 0 disables
+}
+
+# Crew member methods that yield a response piece by piece
+STREAM_METHODS = ("stream_chat", "chat_stream")
+
+
+def stream_method(member):
+    """Return a callable(query) yielding response chunks, or None if member only has blocking chat()"""
+    for name in STREAM_METHODS:
+        func = getattr(member, name, None)
+        if callable(func):
+            return func
+    chat = getattr(member, "chat", None)
+    try:
+        if chat is not None and "stream" in inspect.signature(chat).parameters:
+            return lambda query: chat(query, stream=True)
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def chunk_text(chunk):
+    """Text of one streamed chunk: a plain string or a llama.cpp completion/chat chunk"""
+    if isinstance(chunk, str):
+        return chunk
+    if isinstance(chunk, dict):
+        try:
+            choice = chunk["choices"][0]
+        except (KeyError, IndexError, TypeError):
+            return chunk.get("content", "") or ""
+        if "delta" in choice:
+            return choice["delta"].get("content", "") or ""
+        return choice.get("text", "") or ""
+    return str(chunk) if chunk is not None else ""
+
+
+class Backend:
+    """Backend modules, imported on a worker thread by load().
+
+    list_tools/run_tool stay None until loading finishes. ready is set either
+    way; error holds the exception if the import chain failed. Passing the
+    functions in directly gives an already-loaded backend.
+    """
+    def __init__(self, list_tools=None, run_tool=None):
+        self.list_tools = list_tools
+        self.run_tool = run_tool
+        self.modules = {}
+        self.timings = {}  # Phase label -> seconds
+        self.error = None
+        self.ready = threading.Event()
+        if list_tools is not None and run_tool is not None:
+            self.ready.set()
+
+    def load(self, progress=None):
+        """Import every backend module, reporting each phase to progress(label)"""
+        try:
+            for label, module_name in BACKEND_MODULES:
+                if progress:
+                    progress(label)
+                started = time.perf_counter()
+                self.modules[label] = importlib.import_module(module_name)
+                self.timings[label] = time.perf_counter() - started
+            self._bind_tools()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ready.set()
+
+    def _bind_tools(self):
+        tools = self.modules["TOOLS"]
+        self.list_tools = tools.list_tools
+        self.run_tool = tools.run_tool
+
+    def reload_tools(self):
+        """Re-import the tools module so edited or added tools are picked up"""
+        if "TOOLS" in self.modules:
+            self.modules["TOOLS"] = importlib.reload(self.modules["TOOLS"])
+            self._bind_tools()
+
+    def tool_files(self):
+        """Source files whose modification should trigger a tool reload"""
+        module = self.modules.get("TOOLS")
+        path = getattr(module, "__file__", None)
+        if not path:
+            return []
+        directory = os.path.dirname(path)
+        try:
+            return [directory] + [os.path.join(directory, name) for name in os.listdir(directory)
+                                  if name.endswith(".py")]
+        except OSError:
+            return [path]
+
+
+class ToolRegistry:
+    """Tool list built once from the backend and indexed by lower-case name.
+
+    Each entry holds the tool's name, description and arguments when the
+    backend exposes them. is_stale() compares the tool sources' modification
+    times with those seen at the last build.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.tools = {}
+        self._mtimes = {}
+
+    def build(self):
+        """(Re)build the index from list_tools(); returns the tool names"""
+        tools = {}
+        module = self.backend.modules.get("TOOLS")
+        for entry in self.backend.list_tools():
+            info = self._describe(entry, module)
+            tools[info["name"].lower()] = info
+        self.tools = tools
+        self._mtimes = self._snapshot()
+        return self.names()
+
+    def _describe(self, entry, module):
+        """Normalize a list_tools() entry (name, dict or object) into name/description/args"""
+        if isinstance(entry, dict):
+            name = str(entry.get("name", ""))
+            description = entry.get("description", "")
+            args = entry.get("args", entry.get("parameters", []))
+            isolated = bool(entry.get("isolated") or entry.get("cpu_bound"))
+            timeout = entry.get("timeout")
+        else:
+            name = str(getattr(entry, "name", entry))
+            description = getattr(entry, "description", "")
+            args = getattr(entry, "args", [])
+            isolated = bool(getattr(entry, "isolated", False) or getattr(entry, "cpu_bound", False))
+            timeout = getattr(entry, "timeout", None)
+            # A bare name: look for a same-named function in the tools module
+            func = getattr(module, name, None) if module is not None and isinstance(entry, str) else None
+            if callable(func):
+                description = (inspect.getdoc(func) or "").split("\n")[0]
+                try:
+                    args = [p for p in inspect.signature(func).parameters if p != "crew_instance"]
+                except (TypeError, ValueError):
+                    pass
+        if isinstance(args, dict):
+            args = list(args)
+        return {"name": name, "description": description or "", "args": list(args or []),
+                "isolated": isolated, "timeout": timeout}
+
+    def _snapshot(self):
+        mtimes = {}
+        for path in self.backend.tool_files():
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                pass
+        return mtimes
+
+    def is_stale(self):
+        return bool(self._mtimes) and self._snapshot() != self._mtimes
+
+    def names(self):
+        return [info["name"] for info in self.tools.values()]
+
+    def get(self, name):
+        """Tool entry for name (case-insensitive) or None"""
+        return self.tools.get(name.lower())
+
+    def complete(self, prefix):
+        prefix = prefix.lower()
+        return sorted(info["name"] for key, info in self.tools.items() if key.startswith(prefix))
+
+
+class ToolCancelled(Exception):
+    """A tool run was cancelled or timed out"""
+
+
+# Run by a bare interpreter for isolated tools: argv is (module, tool) and a
+# pickled (status, payload) pair comes back on stdout. Using a fresh
+# interpreter instead of multiprocessing keeps the launcher's __main__ (and
+# its model loading) from being re-imported in the child.
+TOOL_CHILD_SOURCE = """
+import importlib, os, pickle, sys
+sys.path[:0] = [p for p in os.environ.get("CLEMM_SYS_PATH", "").split(os.pathsep) if p]
+channel = sys.stdout.buffer
+sys.stdout = sys.stderr
+try:
+    result = importlib.import_module(sys.argv[1]).run_tool(sys.argv[2], crew_instance=None)
+    if hasattr(result, "__next__"):
+        # A generator can't cross the pipe; send what it yields
+        result = list(result)
+    try:
+        data = pickle.dumps(("ok", result))
+    except Exception:
+        data = pickle.dumps(("ok", str(result)))
+except BaseException as e:
+    data = pickle.dumps(("error", type(e).__name__ + ": " + str(e)))
+channel.write(data)
+channel.flush()
+"""
+
+
+class ToolExecutor:
+    """Bounded worker pools for tool runs, with per-tool timeouts and cancellation.
+
+    Ordinary tools run on a thread pool and get the crew. Isolated tools
+    (marked isolated/cpu_bound by the registry, or listed in process_tools)
+    run in a fresh child process without crew access, at most
+    max_processes at a time, and are killed on timeout or cancel. A thread
+    cannot be killed, so a timed-out thread tool only frees its slot when
+    it returns.
+    """
+    POLL_SECONDS = 0.1
+
+    def __init__(self, backend, registry, max_threads=4, max_processes=2, timeout=120,
+                 timeouts=None, process_tools=()):
+        self.backend = backend
+        self.registry = registry
+        self.timeout = timeout
+        self.timeouts = dict(timeouts or {})
+        self.process_tools = {name.lower() for name in process_tools}
+        self._threads = ThreadPoolExecutor(max_workers=max(1, max_threads), thread_name_prefix="tool")
+        # Each slot here babysits one child process
+        self._processes = ThreadPoolExecutor(max_workers=max(1, max_processes), thread_name_prefix="toolproc")
+        self._batches = set()
+        self._lock = threading.Lock()
+
+    def is_isolated(self, name):
+        tool = self.registry.get(name) or {}
+        return bool(tool.get("isolated")) or name.lower() in self.process_tools
+
+    def timeout_for(self, name):
+        tool = self.registry.get(name) or {}
+        return self.timeouts.get(name, tool.get("timeout") or self.timeout)
+
+    def run(self, names, crew_instance, on_done):
+        """Start tools concurrently; returns a Future resolved with {name: status} when all finish.
+
+        on_done(name, status, result, seconds) is called from a worker thread
+        as each tool finishes; status is "OK", "ERROR", "TIMEOUT" or "CANCELLED".
+        """
+        batch = {"cancel": threading.Event(), "done": Future()}
+        with self._lock:
+            self._batches.add(batch["cancel"])
+        threading.Thread(target=self._coordinate, args=(names, crew_instance, on_done, batch),
+                         daemon=True).start()
+        return batch["done"]
+
+    def cancel_all(self):
+        """Cancel every running batch; returns how many were running"""
+        with self._lock:
+            batches = list(self._batches)
+        for cancel in batches:
+            cancel.set()
+        return len(batches)
+
+    def _coordinate(self, names, crew_instance, on_done, batch):
+        runs = {}
+        for name in names:
+            run = {"name": name, "started": None, "timeout": self.timeout_for(name),
+                   "cancel": threading.Event()}
+            if self.is_isolated(name):
+                future = self._processes.submit(self._timed, run, self._run_in_process, name, run["cancel"])
+            else:
+                future = self._threads.submit(self._timed, run, self.backend.run_tool, name,
+                                              crew_instance=crew_instance)
+            runs[future] = run
+
+        statuses = {}
+        pending = set(runs)
+        while pending:
+            done, _ = wait(pending, timeout=self.POLL_SECONDS, return_when=FIRST_COMPLETED)
+            for future in done:
+                run = runs[future]
+                pending.discard(future)
+                elapsed = time.perf_counter() - (run["started"] or time.perf_counter())
+                if future.cancelled():
+                    status, result = "CANCELLED", None
+                else:
+                    try:
+                        status, result = "OK", future.result()
+                    except ToolCancelled:
+                        status, result = ("CANCELLED" if batch["cancel"].is_set() else "TIMEOUT"), None
+                    except Exception as e:
+                        status, result = "ERROR", e
+                statuses[run["name"]] = status
+                on_done(run["name"], status, result, elapsed)
+
+            now = time.perf_counter()
+            for future in list(pending):
+                run = runs[future]
+                overdue = run["started"] is not None and now - run["started"] > run["timeout"]
+                if not (overdue or batch["cancel"].is_set()):
+                    continue
+                run["cancel"].set()
+                if future.cancel() or not self.is_isolated(run["name"]):
+                    # Not started yet, or a thread we cannot stop: report and move on
+                    pending.discard(future)
+                    status = "CANCELLED" if batch["cancel"].is_set() else "TIMEOUT"
+                    statuses[run["name"]] = status
+                    on_done(run["name"], status, None, now - (run["started"] or now))
+
+        with self._lock:
+            self._batches.discard(batch["cancel"])
+        batch["done"].set_result(statuses)
+
+    @staticmethod
+    def _timed(run, func, *args, **kwargs):
+        run["started"] = time.perf_counter()
+        if run["cancel"].is_set():
+            raise ToolCancelled(run["name"])
+        return func(*args, **kwargs)
+
+    def _run_in_process(self, name, cancel):
+        module_name = dict(BACKEND_MODULES)["TOOLS"]
+        env = dict(os.environ, CLEMM_SYS_PATH=os.pathsep.join(sys.path))
+        process = subprocess.Popen([sys.executable, "-c", TOOL_CHILD_SOURCE, module_name, name],
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, env=env)
+        try:
+            while True:
+                if cancel.is_set():
+                    raise ToolCancelled(name)
+                try:
+                    data, _ = process.communicate(timeout=self.POLL_SECONDS)
+                    break
+                except subprocess.TimeoutExpired:
+                    continue
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        try:
+            status, payload = pickle.loads(data)
+        except Exception:
+            raise RuntimeError(f"TOOL PROCESS EXITED WITH CODE {process.returncode}")
+        if status == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    def shutdown(self):
+        self.cancel_all()
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        self._processes.shutdown(wait=False, cancel_futures=True)
+
+
+def format_size(chars):
+    for unit in ("B", "KB", "MB"):
+        if chars < 1024 or unit == "MB":
+            return f"{chars:.0f} {unit}" if unit == "B" else f"{chars:.1f} {unit}"
+        chars /= 1024
+
+
+class ToolResult:
+    """A tool's return value, taken a page of lines at a time.
+
+    Strings are split into lines; lists, sets and dicts give a line per item;
+    iterators and generators are pulled only as far as the pages asked for,
+    so a tool may yield far more than is ever shown. Totals are known up
+    front except for iterators. Lines longer than MAX_LINE are cut into
+    pieces so no single write gets huge.
+    """
+    MAX_LINE = 2000
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+        self.lazy = hasattr(value, "__next__")
+        self.total_lines = self.total_chars = self.total_items = None
+        if isinstance(value, str):
+            self.total_lines = value.count("\n") + 1
+            self.total_chars = len(value)
+        elif isinstance(value, (list, tuple, set, frozenset, dict)):
+            self.total_items = len(value)
+        self.id = None         # Number EXPAND names it by once it is truncated
+        self.lines_shown = 0   # Lines written, counting each piece of a cut line
+        self.lines_read = 0    # Whole lines of the result taken so far
+        self.chars_shown = 0
+        self.done = False
+        self._lines = self._iter_lines()
+
+    def is_small(self, max_lines, max_chars):
+        """True if the result fits a preview and can be shown in one piece as before"""
+        if self.lazy:
+            return False
+        if self.total_items is not None and self.total_items > max_lines:
+            return False
+        if self.total_lines is None:
+            # Objects and small containers are shown as str(); big reprs become paged text
+            self.value = str(self.value)
+            self.total_lines, self.total_chars = self.value.count("\n") + 1, len(self.value)
+            self.total_items = None
+            self._lines = self._iter_lines()
+        return self.total_lines <= max_lines and self.total_chars <= max_chars
+
+    def _iter_lines(self):
+        value = self.value
+        if isinstance(value, str):
+            items = self._split(value)
+        elif isinstance(value, dict):
+            items = (f"{key}: {item}" for key, item in value.items())
+        else:
+            items = (str(item) for item in value)
+        for text in items:
+            for line in self._split(text):
+                while len(line) > self.MAX_LINE:
+                    yield line[:self.MAX_LINE]
+                    line = line[self.MAX_LINE:]
+                self.lines_read += 1
+                yield line
+
+    @staticmethod
+    def _split(text):
+        start = 0
+        while True:
+            end = text.find("\n", start)
+            if end < 0:
+                yield text[start:]
+                return
+            yield text[start:end]
+            start = end + 1
+
+    def page(self, max_lines, max_chars=None):
+        """Up to max_lines more lines (and about max_chars characters); sets done at the end"""
+        lines = []
+        chars = 0
+        while len(lines) < max_lines and (max_chars is None or chars < max_chars):
+            try:
+                line = next(self._lines)
+            except StopIteration:
+                self.done = True
+                self.close()
+                break
+            lines.append(line)
+            chars += len(line) + 1
+        self.lines_shown += len(lines)
+        self.chars_shown += chars
+        return lines
+
+    def summary(self):
+        """What was shown out of what there is"""
+        shown = f"SHOWING {self.lines_read:,}"
+        if self.total_lines is not None:
+            shown += f" OF {self.total_lines:,} LINES ({format_size(self.chars_shown)} OF {format_size(self.total_chars)})"
+        elif self.total_items is not None:
+            shown += f" LINES OF {self.total_items:,} ITEMS"
+        else:
+            shown += " LINES, MORE PENDING"
+        return shown
+
+    def close(self):
+        close = getattr(self.value, "close", None)
+        if self.lazy and callable(close):
+            try:
+                close()
+            except Exception:
+                pass
+
+
+# Bootstrap for RUN_CODE interpreters: argv is (cpu_seconds, memory_mb), then
+# the code to run arrives on stdin. Limits are applied inside the child so no
+# preexec_fn has to run between fork and exec in this threaded process.
+CODE_CHILD_SOURCE = """
+import sys
+try:
+    import resource
+    cpu, memory = int(sys.argv[1]), int(sys.argv[2])
+    if cpu > 0:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+    if memory > 0:
+        resource.setrlimit(resource.RLIMIT_AS, (memory * 1024 * 1024,) * 2)
+except (ImportError, ValueError, OSError):
+    pass
+source = sys.stdin.read()
+sys.stdin = open(__import__("os").devnull)
+del sys.argv[1:]
+exec(compile(source, "<code_sequence>", "exec"), {"__name__": "__main__"})
+"""
+
+
+class CodeRunner:
+    """Runs generated code in a child interpreter off the Tk thread.
+
+    Output is streamed line by line to on_line(stream_name, line) and
+    on_exit(returncode, seconds, reason) fires when the run ends. Each run is
+    bounded by a wall-clock timeout plus CPU and memory rlimits, and kill()
+    stops it from the UI. With prewarm on, the next interpreter is started
+    in advance and sits blocked on stdin, so a short snippet does not pay
+    interpreter startup.
+    """
+    def __init__(self, timeout=30, cpu_seconds=20, memory_mb=512, prewarm=True):
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.prewarm = prewarm
+        self._lock = threading.Lock()
+        self._warm = None
+        self._running = None
+        self._kill_reason = None
+        if prewarm:
+            threading.Thread(target=self._warm_up, daemon=True).start()
+
+    @property
+    def running(self):
+        return self._running is not None
+
+    def _spawn(self):
+        return subprocess.Popen(
+            [sys.executable, "-u", "-c", CODE_CHILD_SOURCE, str(self.cpu_seconds), str(self.memory_mb)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            text=True, bufsize=1)
+
+    def _warm_up(self):
+        process = self._spawn()
+        with self._lock:
+            if self._warm is None:
+                self._warm = process
+                return
+        process.kill()
+
+    def run(self, code, on_line, on_exit):
+        """Start code; returns False if a sequence is already running"""
+        with self._lock:
+            if self._running is not None:
+                return False
+            process, self._warm = self._warm, None
+            if process is not None and process.poll() is not None:
+                process = None
+            self._kill_reason = None
+            self._running = process = process or self._spawn()
+        if self.prewarm:
+            threading.Thread(target=self._warm_up, daemon=True).start()
+
+        started = time.perf_counter()
+        readers = [threading.Thread(target=self._pump, args=(pipe, name, on_line), daemon=True)
+                   for pipe, name in ((process.stdout, "stdout"), (process.stderr, "stderr"))]
+        for reader in readers:
+            reader.start()
+
+        def _supervise():
+            try:
+                process.stdin.write(code)
+                process.stdin.close()
+            except OSError:
+                pass
+            try:
+                process.wait(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                self.kill("TIMEOUT")
+                process.wait()
+            for reader in readers:
+                reader.join()
+            with self._lock:
+                self._running = None
+            on_exit(process.returncode, time.perf_counter() - started, self._kill_reason)
+
+        threading.Thread(target=_supervise, daemon=True).start()
+        return True
+
+    @staticmethod
+    def _pump(pipe, name, on_line):
+        for line in pipe:
+            on_line(name, line.rstrip("\n"))
+        pipe.close()
+
+    def kill(self, reason="KILLED"):
+        """Kill the running sequence; returns False if nothing was running"""
+        with self._lock:
+            process = self._running
+            if process is None:
+                return False
+            self._kill_reason = reason
+        process.kill()
+        return True
+
+    def shutdown(self):
+        self.kill()
+        with self._lock:
+            warm, self._warm = self._warm, None
+        if warm is not None:
+            warm.kill()
+
+
+class LlamaServerClient:
+    """Client for a llama.cpp server backend over pooled keep-alive connections.
+
+    Connections are reused across requests and threads; a pooled connection
+    the server has since closed is retried once on a fresh one.
+    wait_until_ready() polls /health instead of sleeping a fixed time, and
+    shutdown() stops the owned server process gracefully. Only base_url is
+    needed, so it works just as well against a local stub server.
+    """
+    def __init__(self, base_url="http://127.0.0.1:8080", process=None, pool_size=4, timeout=600):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 8080
+        self.process = process
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=max(1, pool_size))
+        self.slots = None  # Sequences the server decodes in parallel, read from /props once it is up
+        self.requests = 0
+        self.connections_opened = 0
+
+    @classmethod
+    def from_model(cls, model, base_url=None, pool_size=4):
+        """Client for a {"type": "server", "process": ..., "url"/"host"/"port": ...} model dict"""
+        if not base_url:
+            base_url = model.get("url") or f"http://{model.get('host', '127.0.0.1')}:{model.get('port', 8080)}"
+        return cls(base_url, process=model.get("process"), pool_size=pool_size)
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            self.connections_opened += 1
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, method, path, payload=None, timeout=None):
+        """Send a JSON request; returns (status, decoded JSON body or text)"""
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2):
+            conn, reused = self._acquire()
+            conn.timeout = timeout or self.timeout
+            if conn.sock:
+                conn.sock.settimeout(conn.timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if reused and attempt == 0:
+                    continue  # Stale keep-alive connection, try a fresh one
+                raise
+            except Exception:
+                conn.close()
+                raise
+            self.requests += 1
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            try:
+                return response.status, json.loads(data) if data else {}
+            except ValueError:
+                return response.status, data.decode("utf-8", errors="replace")
+
+    def health(self):
+        """(state, latency seconds); state is "ok", "loading", "error" or "down" """
+        started = time.perf_counter()
+        try:
+            status, body = self.request("GET", "/health", timeout=5)
+        except (OSError, http.client.HTTPException):
+            # A garbled or cut-off reply; the other kept-alive connections are suspect too
+            self.close()
+            return "down", time.perf_counter() - started
+        latency = time.perf_counter() - started
+        if status == 200:
+            return "ok", latency
+        if status == 503:
+            return "loading", latency
+        return "error", latency
+
+    def wait_until_ready(self, timeout=120, on_poll=None):
+        """Poll /health with backoff until the server answers ok; returns True if it did"""
+        deadline = time.monotonic() + timeout
+        interval = 0.05
+        while time.monotonic() < deadline:
+            if self.process is not None and self.process.poll() is not None:
+                return False
+            state, latency = self.health()
+            if on_poll:
+                on_poll(state, latency)
+            if state == "ok":
+                return True
+            time.sleep(interval)
+            interval = min(1.0, interval * 2)
+        return False
+
+    def fetch_slots(self):
+        """Ask the server how many requests it batches together; returns the count or None"""
+        try:
+            status, body = self.request("GET", "/props", timeout=5)
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return None
+        if status == 200 and isinstance(body, dict) and isinstance(body.get("total_slots"), int):
+            self.slots = body["total_slots"]
+        return self.slots
+
+    def completion(self, prompt, **params):
+        return self.request("POST", "/completion", dict(params, prompt=prompt))
+
+    def chat(self, messages, **params):
+        return self.request("POST", "/v1/chat/completions", dict(params, messages=messages))
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def shutdown(self, timeout=10):
+        """Close connections, then stop the server process and wait for it to exit"""
+        self.close()
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+# Commands that cannot run until the backend has been imported
+BACKEND_COMMANDS = ("tools", "list tools", "run_tool", "reload tools")
+
+# Command words offered by tab completion
+COMMAND_WORDS = ("help", "exit", "status", "destination", "model_info", "ask", "crew", "tools",
+                 "use", "reset", "run_tool", "run_code", "history", "cancel", "reload tools", "stalls", "source", "expand", "tab", "find")
+
+
+# Crew member methods that abort a generation in progress
+CANCEL_METHODS = ("cancel", "abort", "interrupt")
+
+
+def member_backend(member):
+    """The model object behind a crew member, or None if it does not expose one"""
+    for attr in ("model", "llm", "backend"):
+        backend = getattr(member, attr, None)
+        if backend is not None:
+            return backend
+    return None
+
+
+class CrewJob:
+    """One queued request for a crew member"""
+    def __init__(self, crew_name, member, func, session=None, background=False):
+        self.crew_name = crew_name
+        self.member = member
+        self.func = func                  # Called as func(cancel_event) on a worker thread
+        self.session = session
+        self.key = (session, crew_name)   # Each session has its own queue per crew member
+        self.background = background      # Yields to every waiting foreground job, e.g. a prefill
+        self.cancel_event = threading.Event()
+        self.future = Future()
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.position = 0                 # Place in its crew queue when submitted, 0 if it started at once
+        self.announced = threading.Event()  # Set once the submitter has reported the job
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else None
+
+
+class CrewScheduler:
+    """Runs crew requests from per-crew FIFO queues under a per-backend concurrency limit.
+
+    Requests to one crew member run strictly in order, and at most
+    max_inflight requests run against the same model backend at once.
+    Several sessions (terminal tabs) may share one scheduler; each has its
+    own queue per crew member. Waiting queues are served round-robin, by
+    session first, so a session with many requests cannot starve another.
+    Background jobs only run when no foreground job is waiting for the
+    same backend.
+    Listeners are called as listener(queued, running) from whichever thread
+    changed the counts.
+    """
+    ALL = object()  # Session argument meaning every session
+    STATS_SAMPLES = 256
+
+    def __init__(self, max_inflight=1, on_change=None):
+        self.max_inflight = max(1, max_inflight)
+        self._listeners = [on_change] if on_change else []
+        self._lock = threading.Lock()
+        self._queues = {}     # (session, crew name) -> deque of CrewJob
+        self._running = {}    # (session, crew name) -> CrewJob
+        # Round-robin order: queue keys and sessions -> (turn last served, 0 if never; arrival)
+        self._rank = {}
+        self._session_rank = {}
+        self._turn = 0
+        self._stats = {}      # session -> {"done": n, "wait": deque, "run": deque} in seconds
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    @staticmethod
+    def backend_key(member):
+        """Crew members sharing a model object share a backend"""
+        backend = member_backend(member)
+        return "default" if backend is None else id(backend)
+
+    def limit_for(self, member):
+        """Requests allowed into the member's backend at once.
+
+        A server that decodes several sequences in a batch (its slots) takes
+        that many; anything else gets max_inflight.
+        """
+        backend = member_backend(member)
+        if isinstance(backend, dict):
+            backend = backend.get("client", backend)
+        slots = getattr(backend, "slots", None)
+        return max(self.max_inflight, slots) if isinstance(slots, int) else self.max_inflight
+
+    def submit(self, crew_name, member, func, session=None, announce=None, background=False):
+        """Queue func(cancel_event) for crew_name in session; returns the CrewJob.
+
+        announce(position) is called with the job's place in its queue (0 if
+        it started at once) before func can run, so a header printed there
+        always comes before the job's own output. A foreground job goes ahead
+        of the background jobs already queued.
+        """
+        job = CrewJob(crew_name, member, func, session, background)
+        try:
+            with self._lock:
+                if job.key not in self._queues:
+                    self._queues[job.key] = deque()
+                    self._rank[job.key] = (0, len(self._rank))
+                    self._session_rank.setdefault(job.session, (0, len(self._session_rank)))
+                pending = self._queues[job.key]
+                pending.insert(next((n for n, queued in enumerate(pending) if queued.background and not background),
+                                    len(pending)), job)
+                self._dispatch()
+                job.position = pending.index(job) + 1 if job in pending else 0
+            if announce:
+                announce(job.position)
+        finally:
+            job.announced.set()
+        self._notify()
+        return job
+
+    @classmethod
+    def _matches(cls, key, crew_name, session):
+        return crew_name in (None, key[1]) and (session is cls.ALL or session == key[0])
+
+    def counts(self, session=ALL):
+        """(queued, running) request counts, of one session or all of them"""
+        with self._lock:
+            return (sum(len(q) for key, q in self._queues.items() if self._matches(key, None, session)),
+                    sum(1 for key in self._running if self._matches(key, None, session)))
+
+    def session_stats(self):
+        """Per session: queued, running, done, and p50/p95 queue wait and run time in seconds"""
+        with self._lock:
+            sessions = {key[0] for key in self._queues} | set(self._stats)
+            result = {}
+            for session in sessions:
+                stats = self._stats.get(session, {})
+                waits, runs = sorted(stats.get("wait", ())), sorted(stats.get("run", ()))
+                result[session] = {
+                    "queued": sum(len(q) for key, q in self._queues.items() if key[0] == session),
+                    "running": sum(1 for key in self._running if key[0] == session),
+                    "done": stats.get("done", 0),
+                    "wait_p50": _percentile(waits, 0.5), "wait_p95": _percentile(waits, 0.95),
+                    "run_p50": _percentile(runs, 0.5), "run_p95": _percentile(runs, 0.95)}
+            return result
+
+    def forget_session(self, session):
+        """Drop an idle session's queues and stats, e.g. when its tab closes"""
+        with self._lock:
+            for key in [key for key in self._queues if key[0] == session and key not in self._running]:
+                if not self._queues[key]:
+                    del self._queues[key]
+                    del self._rank[key]
+            if not any(key[0] == session for key in self._queues):
+                self._session_rank.pop(session, None)
+            self._stats.pop(session, None)
+
+    def cancel(self, crew_name=None, session=ALL):
+        """Abort running requests and drop queued ones; returns (cancelled, dropped)"""
+        with self._lock:
+            running = [job for key, job in self._running.items() if self._matches(key, crew_name, session)]
+            dropped = []
+            for key, pending in self._queues.items():
+                if self._matches(key, crew_name, session):
+                    dropped.extend(pending)
+                    pending.clear()
+        for job in running:
+            job.cancel_event.set()
+            for method in CANCEL_METHODS:
+                abort = getattr(job.member, method, None)
+                if callable(abort):
+                    try:
+                        abort()
+                    except Exception as e:
+                        print(f"Error cancelling {job.crew_name}: {e}")
+                    break
+        for job in dropped:
+            job.future.cancel()
+        self._notify()
+        return len(running), len(dropped)
+
+    def _dispatch(self):
+        """Start every job that fits under the limits; caller holds the lock"""
+        busy = {}
+        for job in self._running.values():
+            key = self.backend_key(job.member)
+            busy[key] = busy.get(key, 0) + 1
+        while True:
+            # Foreground before background; sessions least recently served (or never)
+            # go first, then the same within each session
+            ready = [queue_key for queue_key, pending in self._queues.items()
+                     if pending and queue_key not in self._running
+                     and busy.get(self.backend_key(pending[0].member), 0) < self.limit_for(pending[0].member)]
+            if not ready:
+                return
+            queue_key = min(ready, key=lambda k: (self._queues[k][0].background,
+                                                  self._session_rank[k[0]], self._rank[k]))
+            job = self._queues[queue_key].popleft()
+            key = self.backend_key(job.member)
+            busy[key] = busy.get(key, 0) + 1
+            self._running[queue_key] = job
+            self._turn += 1
+            self._rank[queue_key] = (self._turn, self._rank[queue_key][1])
+            self._session_rank[queue_key[0]] = (self._turn, self._session_rank[queue_key[0]][1])
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _run(self, job):
+        job.announced.wait()
+        job.started = time.perf_counter()
+        started = job.future.set_running_or_notify_cancel()
+        result = error = None
+        if started:
+            try:
+                result = job.func(job.cancel_event)
+            except BaseException as e:
+                error = e
+        finished = time.perf_counter()
+        # Off the running list before the future resolves, so a request sent
+        # the moment this one is answered does not find its crew member busy
+        with self._lock:
+            self._running.pop(job.key, None)
+            if not job.background:
+                stats = self._stats.setdefault(job.session, {"done": 0, "wait": deque(maxlen=self.STATS_SAMPLES),
+                                                             "run": deque(maxlen=self.STATS_SAMPLES)})
+                stats["done"] += 1
+                stats["wait"].append(job.started - job.submitted)
+                stats["run"].append(finished - job.started)
+            self._dispatch()
+        self._notify()
+        if started:
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+    def _notify(self):
+        if self._listeners:
+            counts = self.counts()
+            for listener in list(self._listeners):
+                listener(*counts)
+
+
+class ResponseCache:
+    """LRU cache of crew answers keyed on crew name, conversation state and query.
+
+    The conversation state is a digest chained over every exchange since the
+    member's last reset, so an answer is only reused from the same context.
+    Entries are tied to one model and can be saved to disk between launches;
+    a file written for another model is ignored.
+    """
+    def __init__(self, model_name, max_entries=256, path=None):
+        self.model_name = str(model_name)
+        self.max_entries = max(1, max_entries)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._states = {}  # crew name -> digest of the conversation so far
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    @staticmethod
+    def normalize(query):
+        return " ".join(query.lower().split())
+
+    def _key(self, crew_name, query):
+        raw = json.dumps([self.model_name, crew_name, self._states.get(crew_name, ""), self.normalize(query)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, crew_name, query):
+        """Cached answer for query in the member's current state, or None"""
+        with self._lock:
+            key = self._key(crew_name, query)
+            response = self._entries.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, crew_name, query, response):
+        with self._lock:
+            self._entries[self._key(crew_name, query)] = response
+            self._entries.move_to_end(self._key(crew_name, query))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def advance(self, crew_name, query, response):
+        """Fold a completed exchange into the member's conversation state"""
+        with self._lock:
+            state = self._states.get(crew_name, "")
+            raw = json.dumps([state, query, response])
+            self._states[crew_name] = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def detach(self, crew_name):
+        """Mark a member's state as unknown so nothing matches it until reset"""
+        with self._lock:
+            self._states[crew_name] = uuid.uuid4().hex
+
+    def reset(self, crew_name):
+        """The member's memory was wiped; it is back in the initial state"""
+        with self._lock:
+            self._states.pop(crew_name, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._states.clear()
+
+    def state(self, crew_name):
+        """The member's conversation state, for saving alongside its history"""
+        with self._lock:
+            return self._states.get(crew_name)
+
+    def restore(self, crew_name, state):
+        with self._lock:
+            if state:
+                self._states[crew_name] = state
+            else:
+                self._states.pop(crew_name, None)
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Error loading response cache: {e}")
+            return
+        if data.get("model") != self.model_name:
+            return
+        for key, response in data.get("entries", [])[-self.max_entries:]:
+            self._entries[key] = response
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"model": self.model_name, "entries": list(self._entries.items())}
+        try:
+            write_atomic(self.path, lambda f: json.dump(data, f))
+        except OSError as e:
+            print(f"Error saving response cache: {e}")
+
+
+def member_history(member):
+    """A crew member's list of role/content messages, or None if it keeps none"""
+    history = getattr(member, "history", None)
+    if history is None:
+        history = getattr(member, "messages", None)
+    return history if isinstance(history, list) else None
+
+
+def fork_member(member):
+    """A copy of a crew member sharing its model but holding a fresh conversation of its own"""
+    clone = copy.copy(member)
+    for attribute in ("history", "messages"):
+        history = getattr(member, attribute, None)
+        if isinstance(history, list):
+            setattr(clone, attribute, [dict(m) if isinstance(m, dict) else m for m in history])
+    reset = getattr(clone, "reset", None)
+    if callable(reset):
+        reset()
+    return clone
+
+
+def replay_exchange(member, query, response):
+    """Append an exchange to a member's chat history list; False if it has none"""
+    history = member_history(member)
+    if history is None:
+        return False
+    history.append({"role": "user", "content": query})
+    history.append({"role": "assistant", "content": response})
+    return True
+
+
+def write_atomic(path, write, binary=False):
+    """Call write(file) on a unique temp file beside path, then move it over path"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with (os.fdopen(fd, "wb") if binary else os.fdopen(fd, "w", encoding="utf-8")) as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class ConversationMemory:
+    """Keeps every crew member's history inside the model's context window.
+
+    Before each question the prompt (history plus query) is counted with the
+    member's own tokenizer when it has one, or estimated at four characters
+    per token. Past high_water of the usable context, everything older than
+    the last keep_turns exchanges is folded into a short digest appended to
+    the system message. Histories are saved as JSON in path; on exit the
+    llama.cpp state of each model can be pickled next to it so the next launch
+    starts with the conversation already evaluated. The usable context is
+    context_tokens less reserve_tokens, but never under half of it.
+    """
+    SUMMARY_MARK = "[EARLIER CONVERSATION, COMPACTED]"
+    MESSAGE_OVERHEAD = 4   # Chat-template tokens around each message
+    COUNT_CACHE = 4096
+
+    def __init__(self, context_tokens, high_water=0.8, keep_turns=4, reserve_tokens=512, summary_tokens=256,
+                 directory=None, model_name=""):
+        self.context_tokens = context_tokens
+        self.high_water = high_water
+        self.keep_turns = max(1, keep_turns)
+        self.reserve_tokens = reserve_tokens
+        self.summary_tokens = summary_tokens
+        self.model_name = str(model_name)
+        self.path = None  # One session file per model
+        if directory:
+            digest = hashlib.sha1(self.model_name.encode("utf-8")).hexdigest()[:12]
+            self.path = os.path.join(os.path.expanduser(directory), f"session-{digest}.json")
+        self._counts = OrderedDict()   # (tokenizer id, text digest) -> tokens
+        self._last_member = {}         # backend id -> crew name whose prompt it evaluated last
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # Answers finishing together save one at a time
+
+    @property
+    def budget(self):
+        """Prompt tokens allowed before compaction kicks in"""
+        usable = max(self.context_tokens // 2, self.context_tokens - self.reserve_tokens)
+        return int(usable * self.high_water)
+
+    def count(self, member, text):
+        """Tokens in text for this member's model, cached"""
+        model = member_backend(member)
+        key = (id(model), hashlib.sha1(text.encode("utf-8")).digest())
+        with self._lock:
+            tokens = self._counts.get(key)
+        if tokens is not None:
+            return tokens
+        tokens = None
+        tokenize = getattr(model, "tokenize", None)
+        if callable(tokenize):
+            try:
+                tokens = len(tokenize(text.encode("utf-8"), add_bos=False))
+            except Exception:
+                tokens = None
+        if tokens is None:
+            tokens = len(text) // 4 + 1
+        with self._lock:
+            self._counts[key] = tokens
+            while len(self._counts) > self.COUNT_CACHE:
+                self._counts.popitem(last=False)
+        return tokens
+
+    def history_tokens(self, member, history):
+        return sum(self.count(member, str(m.get("content", ""))) + self.MESSAGE_OVERHEAD for m in history)
+
+    def prepare(self, crew_name, member, query):
+        """Compact the member's history if needed; returns (prompt tokens, exchanges compacted)"""
+        model = member_backend(member)
+        if model is not None:
+            self._last_member[id(model)] = crew_name
+        history = member_history(member)
+        query_tokens = self.count(member, query) + self.MESSAGE_OVERHEAD
+        if history is None:
+            return query_tokens, 0
+        prompt = self.history_tokens(member, history) + query_tokens
+        compacted = 0
+        if prompt > self.budget:
+            compacted = self._compact(member, history, self.budget - query_tokens)
+            prompt = self.history_tokens(member, history) + query_tokens
+        return prompt, compacted
+
+    def _compact(self, member, history, budget):
+        """Fold old exchanges into the digest until history fits budget; returns how many"""
+        head = 1 if history and history[0].get("role") == "system" else 0
+        system = history[0]["content"] if head else ""
+        system, _, old_digest = system.partition("\n\n" + self.SUMMARY_MARK)
+        lines = [line for line in old_digest.splitlines() if line.strip()]
+
+        turns = history[head:]
+        keep = self.keep_turns * 2
+        folded = 0
+        while len(turns) > 2 and (len(turns) > keep or self.history_tokens(member, turns) > budget):
+            user, assistant = turns[0], turns[1]
+            lines.append(f"- {self._gist(user)} -> {self._gist(assistant)}")
+            turns = turns[2:]
+            folded += 1
+        if not folded:
+            return 0
+        # The digest keeps its newest lines within its own token allowance
+        while len(lines) > 1 and self.count(member, "\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        digest = "\n\n" + self.SUMMARY_MARK + "\n" + "\n".join(lines)
+        history[:] = [{"role": "system", "content": (system + digest).strip()}] + turns
+        return folded
+
+    @staticmethod
+    def _gist(message):
+        text = " ".join(str(message.get("content", "")).split())
+        return f"{str(message.get('role', '')).upper()}: {text[:100]}{'...' if len(text) > 100 else ''}"
+
+    def _kv_path(self, crew_name):
+        digest = hashlib.sha1(f"{self.model_name}/{crew_name}".encode("utf-8")).hexdigest()[:16]
+        return os.path.join(os.path.dirname(self.path), f"kv-{digest}.pkl")
+
+    def save(self, crew, current_crew=None, cache_states=None, kv_state=False):
+        """Write every member's history (and optionally model states) to disk"""
+        if not self.path or not crew:
+            return
+        with self._save_lock:
+            self._save(crew, current_crew, cache_states, kv_state)
+
+    def _save(self, crew, current_crew, cache_states, kv_state):
+        data = {"model": self.model_name, "current_crew": current_crew, "saved": time.time(),
+                "crew": {}, "kv": {}}
+        for name, member in list(crew.items()):
+            history = member_history(member)
+            if history is not None:
+                # Copied message by message so a reply landing meanwhile cannot change what is written
+                data["crew"][name] = {"history": [dict(m) if isinstance(m, dict) else m for m in list(history)],
+                                      "cache_state": (cache_states or {}).get(name)}
+        if kv_state:
+            for key, name in list(self._last_member.items()):
+                model = member_backend(crew.get(name)) if name in crew else None
+                save_state = getattr(model, "save_state", None)
+                if not callable(save_state) or id(model) != key:
+                    continue
+                try:
+                    path = self._kv_path(name)
+                    state = save_state()
+                    write_atomic(path, lambda f: pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL),
+                                 binary=True)
+                    data["kv"][name] = os.path.basename(path)
+                except Exception as e:
+                    print(f"Error saving model state for {name}: {e}")
+        try:
+            write_atomic(self.path, lambda f: json.dump(data, f))
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Error saving session: {e}")
+
+    def load(self, crew):
+        """Put saved histories back into the crew; returns the session data or None"""
+        if not self.path or not crew:
+            return None
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Error loading session: {e}")
+            return None
+        if data.get("model") != self.model_name:
+            return None
+        for name, saved in data.get("crew", {}).items():
+            history = member_history(crew.get(name)) if name in crew else None
+            if history is not None:
+                history[:] = saved.get("history", [])
+        return data
+
+    def load_kv(self, crew, data):
+        """Restore saved model states; run where nothing else is using those models"""
+        restored = []
+        for name, filename in data.get("kv", {}).items():
+            model = member_backend(crew.get(name)) if name in crew else None
+            load_state = getattr(model, "load_state", None)
+            if not callable(load_state):
+                continue
+            try:
+                with open(os.path.join(os.path.dirname(self.path), filename), "rb") as f:
+                    load_state(pickle.load(f))
+                self._last_member[id(model)] = name
+                restored.append(name)
+            except Exception as e:
+                print(f"Error restoring model state for {name}: {e}")
+        return restored
+
+
+class WarmSet:
+    """Keeps the model state of recently used crew members ready for a switch.
+
+    Crew members sharing one in-process llama.cpp model also share its KV
+    cache, so whoever runs next overwrites the prompt the last member had
+    evaluated. Before a member runs, the state of the member that used the
+    model last is saved here and the incoming member's state, if still warm,
+    is loaded back; llama.cpp's prefix matching then skips re-evaluating its
+    prompt. At most limit states are kept, least recently used evicted first.
+    Models without save_state/load_state are left alone.
+    """
+
+    def __init__(self, limit=3):
+        self.limit = max(0, limit)
+        self._states = OrderedDict()  # crew name -> saved model state
+        self._owners = {}             # backend id -> crew name whose state the model holds
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @staticmethod
+    def _swappable(model):
+        return callable(getattr(model, "save_state", None)) and callable(getattr(model, "load_state", None))
+
+    def activate(self, crew_name, member):
+        """Give the model crew_name's state; returns "warm", "cold" or None if the model can't swap.
+
+        Call only where nothing else is using the member's model.
+        """
+        model = member_backend(member)
+        if not self._swappable(model):
+            return None
+        with self._lock:
+            owner = self._owners.get(id(model))
+        if owner == crew_name:
+            return "warm"
+        if owner is not None and self.limit:
+            self._keep(owner, model.save_state())
+        with self._lock:
+            state = self._states.pop(crew_name, None)
+            self._owners[id(model)] = crew_name
+        if state is None:
+            return "cold"
+        model.load_state(state)
+        return "warm"
+
+    def _keep(self, crew_name, state):
+        with self._lock:
+            self._states[crew_name] = state
+            self._states.move_to_end(crew_name)
+            while len(self._states) > self.limit:
+                self._states.popitem(last=False)
+                self.evictions += 1
+
+    def claim(self, crew_name, member):
+        """Record that the member's model already holds crew_name's state"""
+        model = member_backend(member)
+        if self._swappable(model):
+            with self._lock:
+                self._owners[id(model)] = crew_name
+
+    def forget(self, crew_name):
+        """Drop crew_name's state, e.g. after its conversation was reset"""
+        with self._lock:
+            self._states.pop(crew_name, None)
+            for key, owner in list(self._owners.items()):
+                if owner == crew_name:
+                    del self._owners[key]
+
+    def is_warm(self, crew_name, member):
+        """True if switching to crew_name needs no prompt re-evaluation, None if unknown"""
+        model = member_backend(member)
+        if not self._swappable(model):
+            return None
+        with self._lock:
+            return self._owners.get(id(model)) == crew_name or crew_name in self._states
+
+    def owners(self):
+        """Keys whose state the models hold right now"""
+        with self._lock:
+            return set(self._owners.values())
+
+    def warm_count(self):
+        with self._lock:
+            return len(self._states) + len(self._owners)
+
+    def prefill(self, crew_name, member):
+        """Evaluate the member's system prompt now; returns seconds taken, or None if it can't be done.
+
+        A member's own prefill() or warm_up() is used when it has one;
+        otherwise the system messages go through the model's chat template
+        with a one-token completion, leaving them in the KV cache.
+        """
+        started = time.perf_counter()
+        warm_up = getattr(member, "prefill", None) or getattr(member, "warm_up", None)
+        if callable(warm_up):
+            self.activate(crew_name, member)
+            warm_up()
+            return time.perf_counter() - started
+        model = member_backend(member)
+        create = getattr(model, "create_chat_completion", None)
+        system = [m for m in member_history(member) or [] if m.get("role") == "system"]
+        if not system or not callable(create) or not self._swappable(model):
+            return None
+        self.activate(crew_name, member)
+        create(messages=system, max_tokens=1)
+        return time.perf_counter() - started
+
+
+class LoopMonitor:
+    """Measures Tk event-loop lag with a heartbeat after() timer.
+
+    Every beat is scheduled interval_ms ahead; how late it actually runs is
+    the time the loop spent busy elsewhere. on_beat(lag_seconds) is called on
+    the Tk thread.
+    """
+    def __init__(self, root, interval_ms=100, on_beat=None):
+        self.root = root
+        self.interval = interval_ms / 1000
+        self.on_beat = on_beat
+        self.last_beat = None
+        self.lag = 0.0
+
+    def start(self):
+        self.last_beat = time.perf_counter()
+        self.root.after(int(self.interval * 1000), self._beat)
+
+    def _beat(self):
+        now = time.perf_counter()
+        self.lag = max(0.0, now - self.last_beat - self.interval)
+        self.last_beat = now
+        if self.on_beat:
+            self.on_beat(self.lag)
+        self.root.after(int(self.interval * 1000), self._beat)
+
+
+class StallWatchdog:
+    """Background thread that catches the Tk thread blocked past a threshold.
+
+    It watches a LoopMonitor: once no heartbeat has arrived for threshold
+    seconds, the main thread's stack is captured with sys._current_frames()
+    while it is still stuck, which names the blocking callback. The next
+    beat closes the stall with its full duration and reports it to
+    on_stall(stall). The KEEP worst stalls are kept for the session.
+    """
+    KEEP = 50
+
+    def __init__(self, monitor, threshold=0.25, on_stall=None):
+        self.monitor = monitor
+        self.threshold = threshold
+        self.on_stall = on_stall
+        self.thread_id = threading.get_ident()  # Created on the Tk thread
+        self.stalls = []      # Worst first
+        self.count = 0
+        self._lock = threading.Lock()
+        self._sample = None   # (beat it belongs to, stack) for the stall in progress
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 4):
+            last = self.monitor.last_beat
+            if last is None:
+                continue
+            overdue = time.perf_counter() - last - self.monitor.interval
+            with self._lock:
+                if overdue < self.threshold or (self._sample and self._sample[0] == last):
+                    continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = traceback.extract_stack(frame) if frame is not None else []
+            del frame
+            with self._lock:
+                self._sample = (last, stack)
+
+    @staticmethod
+    def blocking_callback(stack):
+        """The frame Tk called into: the one right after tkinter's callback wrapper"""
+        for i in range(len(stack) - 1, -1, -1):
+            entry = stack[i]
+            if (entry.name in ("__call__", "callit") and os.path.basename(os.path.dirname(entry.filename)) == "tkinter"
+                    and i + 1 < len(stack)):
+                entry = stack[i + 1]
+                break
+        else:
+            if not stack:
+                return "UNKNOWN"
+            entry = stack[-1]
+        return f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+
+    def beat(self, lag):
+        """Tk thread: called with every heartbeat's lag"""
+        with self._lock:
+            sample, self._sample = self._sample, None
+        if lag < self.threshold:
+            return
+        stack = sample[1] if sample else []
+        stall = {"seconds": lag, "started": time.time() - lag,
+                 "callback": self.blocking_callback(stack) if sample else "UNKNOWN (ENDED BEFORE SAMPLING)",
+                 "stack": [f"{os.path.basename(e.filename)}:{e.lineno} in {e.name}" for e in stack]}
+        with self._lock:
+            self.count += 1
+            self.stalls.append(stall)
+            self.stalls.sort(key=lambda s: s["seconds"], reverse=True)
+            del self.stalls[self.KEEP:]
+        print(f"STALL {lag * 1000:.0f}MS IN {stall['callback']}")
+        for line in stall["stack"][-8:]:
+            print(f"    {line}")
+        if self.on_stall:
+            self.on_stall(stall)
+
+    def worst(self, count=10):
+        with self._lock:
+            return list(self.stalls[:count])
+
+
+class UIDispatcher:
+    """Single queue through which worker threads reach Tk widgets.
+
+    Any thread may post; only the Tk thread drains, on a timer. Consecutive
+    text appends to a widget are merged into one write() per tick and label
+    updates collapse to their latest value, so the redraw cost per tick stays
+    fixed however chatty the backend is.
+    """
+    def __init__(self, root, interval_ms=30, max_ops=5000):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.max_ops = max_ops
+        self._ops = deque()        # deque append/popleft are thread-safe
+        self._pending_text = {}    # widget -> chunks waiting for the next flush
+
+    def post(self, func, *args):
+        """Run func(*args) on the Tk thread"""
+        self._ops.append(("call", func, args))
+
+    def append(self, widget, text):
+        """Append text to a widget exposing write(text)"""
+        self._ops.append(("text", widget, text))
+
+    def configure(self, widget, **kwargs):
+        """Configure a widget; only the latest value per option survives a tick"""
+        self._ops.append(("config", widget, kwargs))
+
+    def backlog(self):
+        """Operations posted but not yet applied"""
+        return len(self._ops) + len(self._pending_text)
+
+    def start(self):
+        self.root.after(self.interval_ms, self._drain)
+
+    def _flush_text(self):
+        # A typewriter widget busy animating queues the text behind its jobs itself
+        for widget in list(self._pending_text):
+            chunks = self._pending_text.pop(widget)
+            try:
+                widget.write("".join(chunks))
+            except tk.TclError as e:
+                print(f"UI dispatch error: {e}")
+
+    def _drain(self):
+        configs = {}
+        try:
+            for _ in range(min(len(self._ops), self.max_ops)):
+                kind, target, payload = self._ops.popleft()
+                if kind == "text":
+                    self._pending_text.setdefault(target, []).append(payload)
+                elif kind == "config":
+                    configs.setdefault(target, {}).update(payload)
+                else:
+                    self._flush_text()
+                    try:
+                        target(*payload)
+                    except Exception as e:
+                        print(f"UI dispatch error: {e}")
+            self._flush_text()
+            for widget, kwargs in configs.items():
+                try:
+                    widget.config(**kwargs)
+                except tk.TclError as e:
+                    print(f"UI dispatch error: {e}")
+        finally:
+            self.root.after(self.interval_ms, self._drain)
+
 
 class MatrixRain(tk.Canvas):
-    """Digital rain effect in Matrix style"""
-    def __init__(self, parent, **kwargs):
+    """Digital rain effect in Matrix style.
+
+    Rendering is retained-mode: every stream slot owns a fixed set of canvas
+    text items that are created once and then only moved or reconfigured when
+    their glyph, colour or position actually changes.
+
+    A frame governor times every frame and stretches the frame interval and
+    thins the streams when drawing exceeds the CPU budget. The animation
+    pauses while the window is unmapped or fully obscured, and whenever a
+    caller asks it to via pause()/resume().
+    """
+    GLYPH_SPACING = 15
+    MAX_STREAM_LENGTH = 15
+
+    PAUSED_POLL_MS = 250
+    MIN_DENSITY = 0.2
+
+    def __init__(self, parent, max_items=1200, target_fps=20, cpu_budget=0.15, **kwargs):
         super().__init__(parent, **kwargs)
         self.configure(bg='black', highlightthickness=0)
         self.width = self.winfo_reqwidth()
         self.height = self.winfo_reqheight()
         self.chars = "a〒bc*defgh010㋞10ijclemmklmnopqrstuvw0101※01010x1SgodofdoubtBBCﾇDEF〒GHIJKL0MNOPQRSTUVWXYZ0123456789!@#$%^&*()_+-=[]{}|;:,./<>?"
+        self.font = ("Courier", 12, "bold")
+        # Hard cap on canvas items so the per-frame cost stays flat on big windows
+        self.max_items = max_items
         self.streams = []
         self.active = False
-        
+        self._colors = {}
+        # Frame governor state
+        self.frame_interval = 1.0 / max(1, target_fps)
+        self.cpu_budget = max(0.01, min(1.0, cpu_budget))
+        self.frame_time = 0.0           # Smoothed seconds spent drawing one frame
+        self.fps = 0.0                  # Frames actually delivered per second
+        self.density = 1.0              # Share of max_streams currently allowed
+        self._last_frame = None
+        self._pause_reasons = set()
+        self.bind("<Visibility>", self._on_visibility, add="+")
+        self.winfo_toplevel().bind("<Unmap>", self._on_unmap, add="+")
+        self.winfo_toplevel().bind("<Map>", self._on_map, add="+")
+
+    @property
+    def max_streams(self):
+        """Number of stream slots allowed by window width and the item budget"""
+        cap = min(int(self.width / 10), self.max_items // self.MAX_STREAM_LENGTH)
+        return max(1, int(cap * self.density))
+
+    def _color(self, i, length):
+        """Fading green for glyph i of a stream (brighter at head), memoized"""
+        key = (i, length)
+        color = self._colors.get(key)
+        if color is None:
+            intensity = int(255 * (1 - i / length))
+            color = f"#{0:02x}{intensity:02x}{0:02x}"
+            self._colors[key] = color
+        return color
+
+    def _new_stream(self):
+        """Allocate a stream slot together with its pool of hidden text items"""
+        stream = {"items": [self.create_text(0, 0, text="", font=self.font, state='hidden')
+                            for _ in range(self.MAX_STREAM_LENGTH)],
+                  "drawn": [None] * self.MAX_STREAM_LENGTH}
+        self._respawn(stream)
+        return stream
+
+    def _respawn(self, stream):
+        """Send a stream back to the top; its canvas items are reused as-is"""
+        stream["x"] = random.randint(10, max(10, self.width - 10))
+        stream["y"] = 0
+        stream["speed"] = random.uniform(1, 3)
+        stream["length"] = random.randint(5, self.MAX_STREAM_LENGTH)
+        stream["chars"] = [random.choice(self.chars) for _ in range(20)]
+
+    def pause(self, reason):
+        """Suspend drawing until every pause reason has been resumed"""
+        self._pause_reasons.add(reason)
+
+    def resume(self, reason):
+        self._pause_reasons.discard(reason)
+
+    @property
+    def paused(self):
+        return bool(self._pause_reasons)
+
+    def _on_visibility(self, event):
+        if event.state == "VisibilityFullyObscured":
+            self.pause("obscured")
+        else:
+            self.resume("obscured")
+
+    def _on_unmap(self, event):
+        if event.widget is self.winfo_toplevel():
+            self.pause("unmapped")
+
+    def _on_map(self, event):
+        if event.widget is self.winfo_toplevel():
+            self.resume("unmapped")
+
+    def _govern(self, elapsed):
+        """Adapt density and return the delay (ms) before the next frame"""
+        self.frame_time = elapsed if not self.frame_time else 0.8 * self.frame_time + 0.2 * elapsed
+        budget = self.cpu_budget * self.frame_interval
+        if self.frame_time > budget:
+            self.density = max(self.MIN_DENSITY, self.density * 0.9)
+        elif self.frame_time < budget * 0.5:
+            self.density = min(1.0, self.density * 1.02)
+        # Drop surplus streams together with their canvas items
+        while len(self.streams) > self.max_streams:
+            for item in self.streams.pop()["items"]:
+                self.delete(item)
+        # Stretch the interval so drawing never takes more than the budget
+        delay = max(self.frame_interval, self.frame_time / self.cpu_budget)
+        return max(1, int(delay * 1000))
+
     def start_animation(self):
         self.active = True
         self.width = self.winfo_width()
         self.height = self.winfo_height()
-        # Create initial streams
+        # Drop any pool from a previous run and create the initial streams
+        self.delete("all")
         self.streams = []
-        for i in range(int(self.width / 20)):  # Adjust density of streams
-            x = random.randint(10, self.width - 10)
-            speed = random.uniform(1, 3)
-            self.streams.append({"x": x, "y": 0, "speed": speed, "length": random.randint(5, 15), 
-                                "chars": [random.choice(self.chars) for _ in range(20)]})
+        self.density = 1.0
+        self.frame_time = 0.0
+        self._last_frame = None
+        for i in range(min(int(self.width / 20), self.max_streams)):  # Adjust density of streams
+            self.streams.append(self._new_stream())
         self.animate()
-    
+
     def animate(self):
         if not self.active:
             return
-        
-        self.delete("all")
-        
-        # Process each stream
-        for stream in self.streams:
-            x, y = stream["x"], stream["y"]
-            speed = stream["speed"]
-            stream_chars = stream["chars"]
-            length = stream["length"]
-            
-            # Draw characters in stream with fading effect
-            for i in range(length):
-                char_y = y - (i * 15)
-                if 0 <= char_y <= self.height:
-                    # Calculate green intensity based on position (brighter at head)
-                    intensity = int(255 * (1 - i/length))
-                    color = f"#{0:02x}{intensity:02x}{0:02x}"
-                    self.create_text(x, char_y, text=stream_chars[i % len(stream_chars)], 
-                                    fill=color, font=("Courier", 12, "bold"))
-            
-            # Move stream down
-            stream["y"] += speed
-            
-            # Replace first character randomly
-            if random.random() < 0.1:
-                stream_chars[0] = random.choice(self.chars)
-            
-            # Restart stream if it's gone too far
-            if y > self.height + length * 15:
-                stream["y"] = 0
-                stream["x"] = random.randint(10, self.width - 10)
-                stream["chars"] = [random.choice(self.chars) for _ in range(20)]
-        
-        # Randomly add new streams
-        if random.random() < 0.05 and len(self.streams) < self.width / 10:
-            x = random.randint(10, self.width - 10)
-            speed = random.uniform(1, 3)
-            self.streams.append({"x": x, "y": 0, "speed": speed, "length": random.randint(5, 15), 
-                                "chars": [random.choice(self.chars) for _ in range(20)]})
-        
-        self.after(50, self.animate)
-    
-    def stop_animation(self):
-        self.active = False
+        if self.paused:
+            self._last_frame = None
+            self.fps = 0.0
+            self.after(self.PAUSED_POLL_MS, self.animate)
+            return
+
+        started = time.perf_counter()
+        if self._last_frame is not None:
+            self.fps = 1.0 / max(1e-6, started - self._last_frame)
+        self._last_frame = started
+        spacing = self.GLYPH_SPACING
+
+        # Process each stream
+        for stream in self.streams:
+            x, y = stream["x"], stream["y"]
+            stream_chars = stream["chars"]
+            length = stream["length"]
+            drawn = stream["drawn"]
+
+            # Update only the items whose glyph, colour or position changed
+            for i, item in enumerate(stream["items"]):
+                char_y = int(y - (i * spacing))
+                if i < length and 0 <= char_y <= self.height:
+                    char = stream_chars[i % len(stream_chars)]
+                    color = self._color(i, length)
+                    prev = drawn[i]
+                    if prev is None:
+                        self.coords(item, x, char_y)
+                        self.itemconfigure(item, text=char, fill=color, state='normal')
+                    else:
+                        if prev[0] != x or prev[1] != char_y:
+                            self.coords(item, x, char_y)
+                        if prev[2] != char or prev[3] != color:
+                            self.itemconfigure(item, text=char, fill=color)
+                    drawn[i] = (x, char_y, char, color)
+                elif drawn[i] is not None:
+                    self.itemconfigure(item, state='hidden')
+                    drawn[i] = None
+
+            # Move stream down
+            stream["y"] += stream["speed"]
+
+            # Replace first character randomly
+            if random.random() < 0.1:
+                stream_chars[0] = random.choice(self.chars)
+
+            # Restart stream if it's gone too far
+            if y > self.height + length * spacing:
+                self._respawn(stream)
+
+        # Randomly add new streams
+        if random.random() < 0.05 and len(self.streams) < self.max_streams:
+            self.streams.append(self._new_stream())
+
+        self.after(self._govern(time.perf_counter() - started), self.animate)
+
+    def stop_animation(self):
+        self.active = False
+
+
+class Transcript:
+    """Append-only on-disk log of everything shown in the output area.
+
+    Only a sparse index of byte offsets (one entry every INDEX_STRIDE lines)
+    is kept in memory, which is enough to page any old line back in. With
+    index, a TranscriptIndex beside the file makes it searchable by FIND.
+    """
+    INDEX_STRIDE = 1000
+
+    def __init__(self, path, index=False):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._file = open(path, "ab")
+        self._size = 0
+        self.lines = 0
+        self._index = [0]  # Byte offset of line k * INDEX_STRIDE
+        if self._file.tell():
+            self._scan()
+        self.search_index = None
+        if index:
+            self.search_index = TranscriptIndex(os.path.splitext(path)[0] + ".idx", first_line=self.lines)
+
+    @classmethod
+    def for_session(cls, directory, suffix="", index=False):
+        """New transcript file in directory named after the session start time"""
+        name = time.strftime("session-%Y%m%d-%H%M%S") + suffix + ".log"
+        return cls(os.path.join(os.path.expanduser(directory), name), index=index)
+
+    def _scan(self):
+        """Count the lines of a transcript being reopened"""
+        with open(self.path, "rb") as f:
+            for data in iter(lambda: f.read(1 << 20), b""):
+                self._count(data)
+                self._size += len(data)
+
+    def _count(self, data):
+        newlines = data.count(b"\n")
+        stride = self.INDEX_STRIDE
+        if self.lines % stride + newlines < stride:
+            self.lines += newlines
+        else:
+            pos = data.find(b"\n")
+            while pos >= 0:
+                self.lines += 1
+                if self.lines % stride == 0:
+                    self._index.append(self._size + pos + 1)
+                pos = data.find(b"\n", pos + 1)
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        self._file.write(data)
+        self._file.flush()
+        self._count(data)
+        self._size += len(data)
+        if self.search_index:
+            self.search_index.feed(text)
+
+    def read_lines(self, start, count):
+        """Return up to count lines beginning at line number start"""
+        start = max(0, start)
+        block = min(start // self.INDEX_STRIDE, len(self._index) - 1)
+        result = []
+        with open(self.path, "rb") as f:
+            f.seek(self._index[block])
+            for _ in range(start - block * self.INDEX_STRIDE):
+                if not f.readline():
+                    return result
+            for _ in range(count):
+                line = f.readline()
+                if not line:
+                    break
+                result.append(line.decode("utf-8", errors="replace").rstrip("\n"))
+        return result
+
+    def search(self, terms, crew=None, since=None, limit=10):
+        """Ranked matches from the index, each with the first line of its block holding a term"""
+        hits = self.search_index.search(terms, crew=crew, since=since, limit=limit)
+        for hit in hits:
+            lines = self.read_lines(hit["line"], min(hit["lines"], TranscriptIndex.SNIPPET_SCAN))
+            hit["snippet"], found = (lines[0].strip() if lines else ""), 0
+            for line in lines:
+                lower = line.lower()
+                matched = sum(1 for term in hit["terms"] if term in lower)
+                if matched > found:
+                    hit["snippet"], found = line.strip(), matched
+        return hits
+
+    def close(self):
+        self._file.close()
+        if self.search_index:
+            self.search_index.close()
+
+
+def parse_since(text):
+    """Epoch seconds for a FIND SINCE: value, a duration back (30M, 2H, 1D) or a clock time today (14:30)"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhd])", text.lower())
+    if match:
+        return time.time() - float(match.group(1)) * {"s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)]
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})", text)
+    if match and int(match.group(1)) < 24 and int(match.group(2)) < 60:
+        now = time.localtime()
+        since = time.mktime((now.tm_year, now.tm_mon, now.tm_mday,
+                             int(match.group(1)), int(match.group(2)), 0, 0, 0, -1))
+        # A time later than now means yesterday
+        return since - 86400 if since > time.time() else since
+    return None
+
+
+class TranscriptIndex:
+    """Inverted index over the blocks of a transcript, behind FIND.
+
+    A block is the run of lines from a command echo, a crew response header
+    or a tool result to the next of them. Text is indexed as it is written;
+    finished blocks go into per-term posting arrays (block ids and counts)
+    and are appended to a sidecar file that is read back if the transcript
+    is reopened. The block still being written is searched from its Counter.
+    Matches are ranked by BM25 and must contain every term.
+    """
+    BLOCK_START = re.compile(r"^(?:> (\S*)|\[([A-Z0-9_ ]+?) RESPONSE\]|(TOOL EXECUTION COMPLETE|ERROR IN TOOL EXECUTION"
+                             r"|EXPANDING \S+ RESULT)|SWITCHING NEURAL LINK: (\S+))", re.M)
+    WORD = re.compile(r"[a-z0-9_]{2,40}")
+    K1 = 1.2
+    B = 0.75
+    SNIPPET_SCAN = 200  # Lines of a block searched for the line shown with a match
+
+    def __init__(self, path=None, first_line=0):
+        self.path = path
+        self._lock = threading.Lock()
+        self._postings = {}      # term -> (array of block ids, array of counts)
+        self.starts = array("q")  # First transcript line of each block
+        self.times = array("d")
+        self.lengths = array("q")  # Indexed words in each finished block
+        self.crews = []          # Crew member speaking, or active for commands and tools
+        self.kinds = []          # "command", "response", "tool", "find" or "output"
+        self._total = 0
+        self._open = None        # Counter of the block being written
+        self._skip = False       # FIND output is not indexed, so searches never find themselves
+        self._partial = ""
+        self.lines = first_line
+        self.crew = None
+        self._file = None
+        if path:
+            self._load()
+            self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for row in f:
+                try:
+                    entry = json.loads(row)
+                    counts = Counter(entry["terms"])
+                    self._add_block(entry["line"], entry["t"], entry["crew"], entry["kind"])
+                except (ValueError, KeyError, TypeError):
+                    continue  # A line torn by a crash
+                self._post(counts)
+        if self.crews:
+            self.crew = self.crews[-1]
+
+    def _add_block(self, line, started, crew, kind):
+        self.starts.append(line)
+        self.times.append(started)
+        self.crews.append(crew)
+        self.kinds.append(kind)
+        self.lengths.append(0)
+
+    def _post(self, counts):
+        """Move the counts of the last block into the postings"""
+        block = len(self.starts) - 1
+        for term, count in counts.items():
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = (array("q"), array("q"))
+            posting[0].append(block)
+            posting[1].append(count)
+        length = sum(counts.values())
+        self.lengths[block] = length
+        self._total += length
+
+    def _start_block(self, kind, crew):
+        self._finish_block()
+        self._add_block(self.lines, time.time(), crew, kind)
+        self._open = Counter()
+        self._skip = kind == "find"
+
+    def _finish_block(self):
+        if self._open is None:
+            return
+        counts, self._open = self._open, None
+        self._post(counts)
+        if self._file:
+            block = len(self.starts) - 1
+            self._file.write(json.dumps({"line": self.starts[block], "t": round(self.times[block], 3),
+                                         "crew": self.crews[block], "kind": self.kinds[block],
+                                         "terms": counts}, separators=(",", ":")) + "\n")
+            self._file.flush()
+
+    def _count_words(self, text):
+        if self._skip or not text:
+            return
+        words = self.WORD.findall(text.lower())
+        if words:
+            if self._open is None:
+                self._start_block("output", self.crew)
+            self._open.update(words)
+
+    def feed(self, text):
+        """Index newly written text; a partial last line waits for the rest of it"""
+        with self._lock:
+            data = self._partial + text
+            cut = data.rfind("\n") + 1
+            self._partial = data[cut:]
+            if not cut:
+                return
+            pos = 0
+            for match in self.BLOCK_START.finditer(data, 0, cut):
+                self._count_words(data[pos:match.start()])
+                self.lines += data.count("\n", pos, match.start())
+                pos = match.start()
+                command, speaker, tool, switched = match.groups()
+                if switched:
+                    self.crew = switched.lower()
+                elif speaker:
+                    # Until a USE is seen, the first member to answer is taken as the active one
+                    self.crew = self.crew or speaker.lower()
+                    self._start_block("response", speaker.lower())
+                elif tool:
+                    self._start_block("tool", self.crew)
+                else:
+                    self._start_block("find" if command.lower() == "find" else "command", self.crew)
+            self._count_words(data[pos:cut])
+            self.lines += data.count("\n", pos, cut)
+
+    def search(self, terms, crew=None, since=None, limit=10):
+        """Best blocks holding every term, as dicts, highest score first"""
+        words = list(dict.fromkeys(self.WORD.findall(" ".join(terms).lower())))
+        if not words:
+            return []
+        with self._lock:
+            blocks = len(self.starts)
+            current = blocks - 1 if self._open else None
+            current_length = sum(self._open.values()) if self._open else 0
+            average = max(1.0, (self._total + current_length) / max(1, blocks))
+            frequencies = []
+            for word in words:
+                ids, counts = self._postings.get(word, ((), ()))
+                frequency = dict(zip(ids, counts))
+                if current is not None and self._open.get(word):
+                    frequency[current] = self._open[word]
+                if not frequency:
+                    return []
+                frequencies.append(frequency)
+            frequencies.sort(key=len)
+            weights = [math.log(1 + (blocks - len(f) + 0.5) / (len(f) + 0.5)) for f in frequencies]
+            scored = []
+            for block in frequencies[0]:
+                if crew and self.crews[block] != crew or since and self.times[block] < since:
+                    continue
+                if not all(block in f for f in frequencies[1:]):
+                    continue
+                length = current_length if block == current else self.lengths[block]
+                norm = self.K1 * (1 - self.B + self.B * length / average)
+                score = sum(weight * f[block] * (self.K1 + 1) / (f[block] + norm)
+                            for weight, f in zip(weights, frequencies))
+                scored.append((score, block))
+            # Equal scores favour the newer block
+            best = heapq.nlargest(limit, scored)
+            return [{"line": self.starts[block],
+                     "lines": max(1, (self.starts[block + 1] if block + 1 < blocks else self.lines) - self.starts[block]),
+                     "time": self.times[block], "crew": self.crews[block], "kind": self.kinds[block],
+                     "score": score, "terms": words}
+                    for score, block in best]
+
+    def close(self):
+        with self._lock:
+            self._count_words(self._partial)
+            self._finish_block()
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+# Token colours for highlighted code, by tag
+HIGHLIGHT_COLORS = {
+    "hl_keyword": "#00FFAA",
+    "hl_name": "#ADFF2F",
+    "hl_builtin": "#00CED1",
+    "hl_string": "#E6DB74",
+    "hl_number": "#B0FFB0",
+    "hl_comment": "#2E8B57",
+    "hl_operator": "#7FFFD4",
+}
+# Pygments token type prefixes -> tag; the first match wins
+PYGMENTS_TAGS = (
+    ("Token.Comment", "hl_comment"),
+    ("Token.Literal.String", "hl_string"),
+    ("Token.Literal.Number", "hl_number"),
+    ("Token.Operator.Word", "hl_keyword"),
+    ("Token.Operator", "hl_operator"),
+    ("Token.Keyword", "hl_keyword"),
+    ("Token.Name.Builtin", "hl_builtin"),
+    ("Token.Name.Decorator", "hl_builtin"),
+    ("Token.Name.Function", "hl_name"),
+    ("Token.Name.Class", "hl_name"),
+)
+# Used when Pygments is missing: just enough to read Python
+FALLBACK_TOKENS = re.compile(
+    r"(?P<hl_comment>#[^\n]*)"
+    r"|(?P<hl_string>[rbfRBF]{0,2}(\"\"\"[\s\S]*?(\"\"\"|$)|'''[\s\S]*?('''|$)|\"[^\"\n]*\"?|'[^'\n]*'?))"
+    r"|(?P<hl_number>\b\d[\d_]*(\.\d+)?([eE][-+]?\d+)?\b)"
+    r"|(?P<hl_keyword>\b(" + "|".join(keyword.kwlist) + r")\b)"
+    r"|(?P<hl_builtin>\b(print|len|range|open|int|str|float|list|dict|set|tuple|isinstance|super|self)\b)")
+
+
+_LEXERS = {}  # Language -> Pygments lexer, or None without Pygments
+
+
+def _pygments_lexer(language):
+    """A Pygments lexer for language (Python if unknown), or None without Pygments"""
+    language = language or "python"
+    if language in _LEXERS:
+        return _LEXERS[language]
+    try:
+        from pygments.lexers import get_lexer_by_name, PythonLexer
+        from pygments.util import ClassNotFound
+    except ImportError:
+        _LEXERS[language] = None
+        return None
+    try:
+        lexer = get_lexer_by_name(language, stripnl=False, ensurenl=False)
+    except ClassNotFound:
+        lexer = PythonLexer(stripnl=False, ensurenl=False)
+    _LEXERS[language] = lexer
+    return lexer
+
+
+_TOKEN_TAGS = {}  # Pygments token type -> tag or None
+
+
+def _token_tag(token):
+    if token not in _TOKEN_TAGS:
+        name = str(token)
+        _TOKEN_TAGS[token] = next((tag for prefix, tag in PYGMENTS_TAGS if name.startswith(prefix)), None)
+    return _TOKEN_TAGS[token]
+
+
+def code_spans(lines, previous=None):
+    """Highlight ranges for a code answer as (line, start column, end column, tag).
+
+    If the answer has ``` fences only the fenced parts count as code, each in
+    its fence's language; otherwise all of it is treated as Python, the same
+    way RUN_CODE treats it. An unclosed fence runs to the end, so a block
+    still streaming in highlights as it grows. previous is (line count, spans)
+    from an earlier call on a prefix of lines; its spans are kept up to the
+    last line where lexing can safely restart, so a growing answer costs
+    about one re-lex of its newest lines.
+    """
+    is_fence = [line.lstrip().startswith("```") for line in lines]
+    blocks = []  # (first line, language, lines)
+    if not any(is_fence):
+        blocks.append((0, "python", lines))
+    else:
+        start = language = None
+        for number, line in enumerate(lines):
+            if not is_fence[number]:
+                continue
+            if start is None:
+                start, language = number + 1, line.strip()[3:].strip().lower()
+            else:
+                blocks.append((start, language, lines[start:number]))
+                start = None
+        if start is not None:
+            blocks.append((start, language, lines[start:]))
+
+    known, old = 0, {}
+    if previous and any(is_fence[:previous[0]]) == any(is_fence):
+        known = previous[0]
+        for span in previous[1]:
+            old.setdefault(span[0], []).append(span)
+
+    spans = []
+    for first, language, block in blocks:
+        # Restart at the last top-level line the previous pass saw that isn't continuing a string
+        restart = first
+        for number in range(min(first + len(block), known) - 1, first, -1):
+            line = lines[number]
+            if (line[:1].strip() and not lines[number - 1].endswith("\\")
+                    and not any(s[1] == 0 and s[3] == "hl_string" for s in old.get(number, ()))):
+                restart = number
+                break
+        for number in range(first, restart):
+            spans.extend(old.get(number, ()))
+
+        code = "\n".join(block[restart - first:])
+        lexer = _pygments_lexer(language)
+        if lexer is not None:
+            tokens = ((_token_tag(token), value) for token, value in lexer.get_tokens(code))
+        else:
+            tokens = []
+            position = 0
+            for match in FALLBACK_TOKENS.finditer(code):
+                tokens.append((None, code[position:match.start()]))
+                tokens.append((match.lastgroup, match.group()))
+                position = match.end()
+        line, column = restart, 0
+        for tag, value in tokens:
+            # Tokens such as docstrings cover several lines; Tk ranges are cut per line
+            pieces = value.split("\n")
+            for index, piece in enumerate(pieces):
+                if index:
+                    line, column = line + 1, 0
+                if tag and piece:
+                    spans.append((line, column, column + len(piece), tag))
+                column += len(piece)
+    return spans
+
+
+class CodeHighlighter:
+    """Highlights code_expert answers in a TypewriterText, near the visible region only.
+
+    Every line appended to the widget is fed through feed(); the body of each
+    code_expert answer is collected as a block, line by line as it streams
+    in. Blocks are tokenized on a worker thread, the result cached by content
+    so scrolling back never tokenizes them again, and the tag ranges applied
+    on the Tk thread in batches of APPLY_BATCH. Only blocks within MARGIN
+    lines of what is on screen are tokenized or tagged. Lines are numbered
+    absolutely (widget line 1 is text.first_line) so trimming and paging
+    history keep blocks pointing at the right text.
+    """
+    HEADER = re.compile(r"^\[CODE_EXPERT RESPONSE\]")
+    SECTION_END = re.compile(r"^(\[(PROMPT|SWITCH|GENERATION CANCELLED|[A-Z0-9_]+ RESPONSE)\b|BROADCAST COMPLETE)")
+    MARGIN = 50          # Lines above/below the view that are highlighted too
+    APPLY_BATCH = 400    # Tag ranges applied per event-loop callback
+    DELAY_MS = 40        # Coalesces scrolls and streamed lines into one pass
+    MAX_BLOCKS = 200
+    CACHE_SIZE = 256
+
+    def __init__(self, text):
+        self.text = text
+        for tag, color in HIGHLIGHT_COLORS.items():
+            text.tag_configure(tag, foreground=color)
+        self._worker = None
+        self._blocks = OrderedDict()  # first absolute line -> block
+        self._cache = OrderedDict()   # text digest -> spans
+        self._block = None            # Block being written, or "header" before its underline
+        self._partial = ""
+        self._line = text.first_line  # Absolute number of the line being written
+        self._pass_id = None
+        self._apply_id = None
+        self._pending = deque()       # (block, spans) waiting to be tagged
+
+    def reset(self):
+        """Forget all blocks; the widget was cleared"""
+        self._blocks.clear()
+        self._pending.clear()
+        self._block = None
+        self._partial = ""
+        self._line = self.text.first_line
+
+    def feed(self, text):
+        """Account for text appended at the end of the widget"""
+        *complete, self._partial = (self._partial + text).split("\n")
+        for line in complete:
+            self._line_done(line)
+            self._line += 1
+
+    def _line_done(self, line):
+        block = self._block
+        if block is None:
+            if self.HEADER.match(line):
+                self._block = "header"
+        elif block == "header":
+            # The ═══ underline; the answer starts on the next line
+            self._block = {"start": self._line + 1, "lines": [], "version": 0,
+                           "spans": None, "spans_version": -1, "applied": -1, "busy": False}
+            self._blocks[self._block["start"]] = self._block
+            while len(self._blocks) > self.MAX_BLOCKS:
+                self._blocks.popitem(last=False)
+        elif self.SECTION_END.match(line):
+            self._block = None
+            if self.HEADER.match(line):
+                self._block = "header"
+        else:
+            block["lines"].append(line)
+            block["version"] += 1
+            self.schedule()
+
+    def invalidate(self):
+        """Tags must be applied again, e.g. after history was paged back in"""
+        for block in self._blocks.values():
+            block["applied"] = -1
+        self.schedule()
+
+    def schedule(self):
+        if self._pass_id is None:
+            self._pass_id = self.text.after(self.DELAY_MS, self._pass)
+
+    def _visible(self):
+        """Absolute line range to highlight"""
+        top = int(self.text.index("@0,0").split(".")[0])
+        bottom = int(self.text.index(f"@0,{self.text.winfo_height()}").split(".")[0])
+        first = self.text.first_line - 1
+        return first + top - self.MARGIN, first + bottom + self.MARGIN
+
+    def _pass(self):
+        """Tokenize or tag whichever blocks near the view are out of date"""
+        self._pass_id = None
+        if not self._blocks:
+            return
+        low, high = self._visible()
+        for start, block in reversed(self._blocks.items()):
+            end = start + len(block["lines"])
+            if end < low:
+                break  # Blocks are in line order; the rest are further up
+            if start > high:
+                continue
+            if block["spans_version"] != block["version"]:
+                self._tokenize(block)
+            elif block["applied"] != block["spans_version"]:
+                block["applied"] = block["spans_version"]
+                self._pending.append((block, block["spans"]))
+        if self._pending and self._apply_id is None:
+            self._apply_id = self.text.after_idle(self._apply)
+
+    def _tokenize(self, block):
+        if block["busy"]:
+            return
+        version, lines = block["version"], list(block["lines"])
+        previous = (block["spans_version"], block["spans"]) if block["spans"] is not None else None
+        key = hashlib.sha1("\n".join(lines).encode("utf-8")).digest()
+        spans = self._cache.get(key)
+        if spans is not None:
+            self._cache.move_to_end(key)
+            self._tokenized(block, version, key, spans)
+            return
+        if self._worker is None:
+            self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="highlight")
+        block["busy"] = True
+
+        def work():
+            try:
+                spans = code_spans(lines, previous)
+            except Exception as e:
+                print(f"Highlighting failed: {e}")
+                spans = []
+            self.text._post(self._tokenized, block, version, key, spans)
+        self._worker.submit(work)
+
+    def _tokenized(self, block, version, key, spans):
+        """Tk thread: store a block's spans and tag it"""
+        block["busy"] = False
+        self._cache[key] = spans
+        while len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        if version >= block["spans_version"]:
+            block["spans"], block["spans_version"] = spans, version
+        self.schedule()
+
+    def _apply(self):
+        """Tag up to APPLY_BATCH ranges, then yield to the event loop"""
+        self._apply_id = None
+        budget = self.APPLY_BATCH
+        first, last = self.text.first_line, self.text.first_line + int(self.text.index("end-1c").split(".")[0]) - 1
+        while self._pending and budget > 0:
+            block, spans = self._pending[0]
+            position = block.get("position", 0)
+            if position == 0:
+                start = max(block["start"], first) - first + 1
+                end = block["start"] + len(block["lines"]) - first + 1
+                if end > start:
+                    for tag in HIGHLIGHT_COLORS:
+                        self.text.tag_remove(tag, f"{start}.0", f"{end}.0")
+            ranges = {}
+            chunk = spans[position:position + budget]
+            for line, column, stop, tag in chunk:
+                line += block["start"]
+                if first <= line <= last:
+                    ranges.setdefault(tag, []).extend((f"{line - first + 1}.{column}", f"{line - first + 1}.{stop}"))
+            for tag, indexes in ranges.items():
+                self.text.tag_add(tag, *indexes)
+            budget -= len(chunk)
+            if position + len(chunk) >= len(spans):
+                block["position"] = 0
+                self._pending.popleft()
+            else:
+                block["position"] = position + len(chunk)
+        if self._pending:
+            self._apply_id = self.text.after(1, self._apply)
+
+    def shutdown(self):
+        if self._worker is not None:
+            self._worker.shutdown(wait=False)
+
+
+class TypewriterText(ScrolledText):
+    """Text widget that displays text with a typewriter effect and initial garbled text.
+
+    Typing runs on the Tk event loop. Each frame reveals every character that
+    has come due since the previous frame in a single insert, followed by a
+    short garbled tail, so the cost scales with frames rather than characters.
+    Jobs queue up instead of being dropped and skip() fast-forwards them all.
+    """
+    FRAME_MS = 16
+    MAX_CHUNK = 4000    # Characters revealed per frame at most
+    WORK_SHARE = 0.25   # Fraction of the event loop a typing frame may occupy
+    REVEAL_PAGE_LIMIT = 10000  # Older lines paged in at most to reach a FIND match
+
+    def __init__(self, parent, dispatcher=None, scrollback_lines=None, transcript=None, highlight=False, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.is_typing = False
+        self.dispatcher = dispatcher
+        self.scrollback_lines = scrollback_lines
+        self.transcript = transcript
+        self.first_line = transcript.lines if transcript else 0  # Transcript line shown on widget line 1
+        self._history_allowance = 0  # Paged-in lines kept beyond the scrollback limit
+        self.on_typing = None  # Optional callable(bool) told when typing starts/stops
+        self._jobs = deque()
+        self._garbled = 0      # Garble characters currently shown after the text
+        self._last_tick = 0.0
+        self._tick_id = None
+        self.highlighter = None
+        if highlight:
+            self.highlighter = CodeHighlighter(self)
+            self['yscrollcommand'] = self._on_scroll
+
+    def _on_scroll(self, first, last):
+        self.vbar.set(first, last)
+        self.highlighter.schedule()
+
+    def _post(self, func, *args):
+        """Hand a widget operation to the Tk thread"""
+        if self.dispatcher:
+            self.dispatcher.post(func, *args)
+        else:
+            self.after(0, func, *args)
+
+    def write(self, text):
+        """Append text in one insert and scroll to it; Tk thread only.
+
+        While an animation runs the text joins the job queue instead, so it
+        lands after the jobs queued before it.
+        """
+        self._record(text)
+        if self.is_typing:
+            self._jobs.append({"text": text, "pos": 0, "delay": 0, "callback": None, "plain": True})
+            return
+        self.configure(state='normal')
+        self.insert(tk.END, text)
+        self._trim()
+        self.see(tk.END)
+        self.configure(state='disabled')
+
+    def clear(self):
+        """Empty the widget; the transcript keeps what was shown"""
+        self.configure(state='normal')
+        self.delete(1.0, tk.END)
+        self.configure(state='disabled')
+        self.first_line = self.transcript.lines if self.transcript else 0
+        self._history_allowance = 0
+        if self.highlighter:
+            self.highlighter.reset()
+
+    def _record(self, text):
+        """Account for text about to be appended: highlighter first, then the transcript"""
+        if self.highlighter:
+            self.highlighter.feed(text)
+        if not self.transcript:
+            return
+        try:
+            self.transcript.write(text)
+        except OSError as e:
+            print(f"Transcript disabled: {e}")
+            self.transcript = None
+            return
+        self._history_allowance = max(0, self._history_allowance - text.count("\n"))
+
+    def _trim(self):
+        """Drop the oldest lines in bulk once the widget overruns its limit"""
+        if not self.scrollback_lines:
+            return
+        limit = self.scrollback_lines + self._history_allowance
+        lines = int(self.index("end-1c").split(".")[0])
+        # Trim with some slack so deletes happen in large, infrequent batches
+        if lines > limit + max(100, self.scrollback_lines // 10):
+            excess = lines - limit
+            self.delete("1.0", f"{excess + 1}.0")
+            self.first_line += excess
+
+    def page_history(self, count):
+        """Insert up to count older transcript lines at the top; returns how many"""
+        if not self.transcript or self.first_line <= 0:
+            return 0
+        start = max(0, self.first_line - count)
+        lines = self.transcript.read_lines(start, self.first_line - start)
+        if not lines:
+            return 0
+        self.configure(state='normal')
+        self.insert("1.0", "\n".join(lines) + "\n")
+        self.configure(state='disabled')
+        self.first_line -= len(lines)
+        self._history_allowance += len(lines)
+        self.see("1.0")
+        if self.highlighter:
+            self.highlighter.invalidate()
+        return len(lines)
+
+    def reveal(self, line, count=1):
+        """Scroll transcript line into view and mark count lines from it; False if it is too far back"""
+        if line < self.first_line:
+            if self.first_line - line > self.REVEAL_PAGE_LIMIT or not self.page_history(self.first_line - line):
+                return False
+            if line < self.first_line:
+                return False
+        start = line - self.first_line + 1
+        self.tag_configure("find_hit", background="#005500")
+        self.tag_remove("find_hit", "1.0", tk.END)
+        self.tag_add("find_hit", f"{start}.0", f"{start + count}.0")
+        self.see(f"{start + count}.0")
+        self.see(f"{start}.0")
+        return True
+
+    def typewrite(self, text, delay=10, callback=None, garble_duration=100, garble_speed=20):
+        """Queue text for the typewriter effect; delay is milliseconds per character.
+
+        The job is posted through the dispatcher so it lands after any output
+        queued before it. garble_duration and garble_speed are kept for
+        compatibility; the garbled tail now lasts exactly one frame.
+        """
+        lines = text.splitlines() if text else [""]
+        job = {"text": "\n".join(lines) + "\n", "pos": 0,
+               "delay": max(0.05, delay), "callback": callback}
+        self._post(self._enqueue, job)
+
+    def skip(self, event=None):
+        """Fast-forward every queued typewriter job straight to its final text"""
+        if not self.is_typing:
+            return
+        self.configure(state='normal')
+        self._clear_garble()
+        jobs, self._jobs = list(self._jobs), deque()
+        self.insert(tk.END, "".join(job["text"][job["pos"]:] for job in jobs))
+        self.see(tk.END)
+        self.configure(state='disabled')
+        self._finish_typing()
+        for job in jobs:
+            if job["callback"]:
+                job["callback"]()
+
+    def _enqueue(self, job):
+        self._record(job["text"])
+        self._jobs.append(job)
+        if not self.is_typing:
+            self.is_typing = True
+            if self.on_typing:
+                self.on_typing(True)
+            self._last_tick = time.perf_counter()
+            self._tick_id = self.after(self.FRAME_MS, self._tick)
+
+    def _clear_garble(self):
+        if self._garbled:
+            self.delete(f"end-{self._garbled + 1}c", "end-1c")
+            self._garbled = 0
+
+    def _finish_typing(self):
+        if self._tick_id:
+            self.after_cancel(self._tick_id)
+            self._tick_id = None
+        self.is_typing = False
+        if self.on_typing:
+            self.on_typing(False)
+
+    def _tick(self):
+        """Reveal the characters that came due since the last frame"""
+        self._tick_id = None
+        if not self._jobs:
+            return
+        started = time.perf_counter()
+        job = self._jobs[0]
+        if job.get("plain"):
+            end = len(job["text"])
+        else:
+            due = int((started - self._last_tick) * 1000 / job["delay"])
+            end = job["pos"] + min(self.MAX_CHUNK, max(1, due))
+        self._last_tick = started
+
+        self.configure(state='normal')
+        self._clear_garble()
+        self.insert(tk.END, job["text"][job["pos"]:end])
+        job["pos"] = end
+        done = end >= len(job["text"])
+        if not done:
+            garble = "".join(random.choice(string.ascii_letters + string.digits)
+                             for _ in range(min(3, len(job["text"]) - end)))
+            self.insert(tk.END, garble)
+            self._garbled = len(garble)
+        self.see(tk.END)
+        self.configure(state='disabled')
+
+        if done:
+            self._trim()
+            self._jobs.popleft()
+            if job["callback"]:
+                job["callback"]()
+        if not self._jobs:
+            self._finish_typing()
+            return
+        work_ms = (time.perf_counter() - started) * 1000
+        self._tick_id = self.after(max(self.FRAME_MS, int(work_ms / self.WORK_SHARE)), self._tick)
+
+
+def process_rss():
+    """Resident set size of this process in bytes, or None if unknown"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Peak rather than current RSS, but the best the platform offers
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Metrics:
+    """Thread-safe store of recent samples and gauges behind STATUS and the exporters.
+
+    observe() adds a sample to a labelled series (ASK latency per crew member,
+    duration per tool, ...) keeping the last WINDOW of them; gauge() sets a
+    current value. Sources registered with add_source() are polled for more
+    gauges whenever a snapshot is taken.
+    """
+    WINDOW = 500
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}   # series -> {label: deque of samples}
+        self._gauges = {}
+        self._sources = []
+
+    def observe(self, series, value, label=""):
+        with self._lock:
+            labels = self._series.setdefault(series, {})
+            samples = labels.get(label)
+            if samples is None:
+                samples = labels[label] = deque(maxlen=self.WINDOW)
+            samples.append(value)
+
+    def gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def add_source(self, func):
+        """func() returns a dict of gauges; called from whichever thread takes a snapshot"""
+        self._sources.append(func)
+
+    @staticmethod
+    def summarize(samples):
+        ordered = sorted(samples)
+        return {"last": samples[-1], "mean": sum(ordered) / len(ordered),
+                "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+                "max": ordered[-1], "n": len(ordered)}
+
+    def stats(self, series):
+        """{label: {last, mean, p95, max, n}} for one series"""
+        with self._lock:
+            labels = {label: list(samples) for label, samples in self._series.get(series, {}).items()}
+        return {label: self.summarize(samples) for label, samples in labels.items() if samples}
+
+    def snapshot(self):
+        """Everything as one JSON-serializable dict"""
+        with self._lock:
+            gauges = dict(self._gauges)
+            names = list(self._series)
+        for source in self._sources:
+            try:
+                gauges.update(source())
+            except Exception as e:
+                gauges.setdefault("source_errors", []).append(str(e))
+        return {"time": time.time(), "series": {name: self.stats(name) for name in names}, "gauges": gauges}
+
+
+class MetricsExporter:
+    """Publishes snapshot() as a periodically rewritten JSON file and/or over local HTTP"""
+    def __init__(self, snapshot, path=None, interval=5, port=None, host="127.0.0.1"):
+        self.snapshot = snapshot
+        self.path = os.path.expanduser(path) if path else None
+        self.interval = interval
+        self.port = port
+        self.host = host
+        self.server = None
+        self._stop = threading.Event()
+        self._writer = None
+
+    def start(self):
+        if self.path:
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+        if self.port is not None:
+            snapshot = self.snapshot
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.rstrip("/") not in ("", "/metrics"):
+                        self.send_error(404)
+                        return
+                    body = json.dumps(snapshot(), default=str).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def write(self):
+        """Replace the metrics file atomically so scrapers never read half of it"""
+        snapshot = self.snapshot()
+        write_atomic(self.path, lambda f: json.dump(snapshot, f, default=str))
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Error writing metrics: {e}")
+                return
+
+    def stop(self):
+        self._stop.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        if self._writer:
+            # The last write must not race a periodic one still in progress
+            self._writer.join()
+        if self.path:
+            try:
+                self.write()
+            except OSError:
+                pass
+
+
+class OutputSink:
+    """Where a CommandEngine sends everything it has to show.
+
+    The base class writes nothing; frontends override what they support.
+    Every method may be called from any thread.
+    """
+    def write(self, text):
+        """One block of output; a newline is implied"""
+
+    def write_raw(self, text):
+        """Text continuing the current line, e.g. streamed tokens"""
+        self.write(text)
+
+    def typewrite(self, text):
+        """Decorative text such as HELP; frontends without effects just write it"""
+        self.write(text)
+
+    def status(self, text):
+        """Main system status line"""
+
+    def set_field(self, name, text):
+        """Named status fields: crew, tools, queue, perf and connection"""
+
+    def rendering(self, active, reason="response"):
+        """A response is being rendered; frontends may pause decoration"""
+
+    def confirm(self, title, message, on_answer):
+        """Ask the operator a yes/no question; on_answer(bool) may run on any thread"""
+        on_answer(False)
+
+    def page_history(self, count):
+        """Bring count older lines back into view; False if unsupported"""
+        return False
+
+    def backlog(self):
+        """Output accepted but not yet displayed; bulk writers wait for it to drain"""
+        return 0
+
+    def tabs(self, action):
+        """Open ("new"), close ("close"), switch to (a name) or list ("") sessions; False if unsupported"""
+        return False
+
+    def search(self, terms, crew=None, since=None, limit=10):
+        """Ranked transcript blocks holding every term, or None without a searchable transcript"""
+        return None
+
+    def reveal(self, line, count):
+        """Bring transcript line into view with the count lines from it marked"""
+
+    def exit(self):
+        """The engine has shut down and the frontend should close"""
+
+
+class StreamSink(OutputSink):
+    """Plain-text sink for stdout and files: output only, no status noise"""
+    def __init__(self, stream=None, auto_confirm=False):
+        self.stream = stream or sys.stdout
+        self.auto_confirm = auto_confirm
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        self.write_raw(text + "\n")
+
+    def write_raw(self, text):
+        with self._lock:
+            self.stream.write(text)
+            self.stream.flush()
+
+    def confirm(self, title, message, on_answer):
+        on_answer(self.auto_confirm)
+
+
+class JsonLinesSink(StreamSink):
+    """Sink emitting one JSON object per event, for scripts and load tests"""
+    def _emit(self, kind, **fields):
+        line = json.dumps(dict(fields, type=kind, t=round(time.time(), 6)), default=str)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def write(self, text):
+        self._emit("output", text=text)
+
+    def write_raw(self, text):
+        self._emit("stream", text=text)
+
+    def status(self, text):
+        self._emit("status", text=text)
+
+    def set_field(self, name, text):
+        self._emit("field", name=name, text=text)
+
+    def exit(self):
+        self._emit("exit")
+
+
+class CommandFailed(Exception):
+    """A command was rejected; the message has already been shown"""
+
+
+def _resolved(result=None):
+    """A Future that is already done"""
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+HELP_TEXT = """
+AVAILABLE COMMANDS:
+===================
+HELP       - ACCESS THIS INFORMATION NODE
+EXIT       - TERMINATE NEURAL CONNECTION
+STATUS     - DISPLAY SYSTEM DIAGNOSTICS
+DESTINATION - REVEAL CURRENT MISSION COORDINATES
+MODEL_INFO - DISPLAY ACTIVE MODEL CONFIGURATION
+ASK [QUERY] - INTERROGATE CREW KNOWLEDGE BASE
+ASK ALL [QUERY] - INTERROGATE EVERY CREW MEMBER AT ONCE
+ASK [A,B] [QUERY] - INTERROGATE THE NAMED CREW MEMBERS AT ONCE
+CREW       - LIST AVAILABLE CREW MEMBERS
+TOOLS      - LIST AVAILABLE SPECIALIZED TOOLS
+RELOAD TOOLS - REBUILD THE TOOL REGISTRY FROM SOURCE
+USE [NAME] - SWITCH ACTIVE CREW MEMBER, KEEPING EACH ONE'S MEMORY
+RESET      - PURGE CONVERSATION MEMORY
+CANCEL     - ABORT QUERIES, TOOLS AND CODE RUNS, DROP QUEUED ONES [CTRL+G]
+RUN_TOOL [TOOL_NAME ...] - EXECUTE SPECIALIZED TOOLS CONCURRENTLY
+RUN_CODE   - EXECUTE LAST GENERATED CODE SEQUENCE
+[TAB]      - COMPLETE COMMANDS, TOOL AND CREW NAMES
+HISTORY [N] - RECALL N OLDER LINES FROM THE TRANSCRIPT
+STALLS     - LIST THE WORST USER INTERFACE FREEZES THIS SESSION
+EXPAND [#ID] [N] - SHOW THE REST (OR N MORE LINES) OF THE LAST (OR #ID) TRUNCATED RESULT
+TAB [NEW|CLOSE|N] - OPEN, CLOSE OR SWITCH TERMINAL SESSIONS [CTRL+T, CTRL+TAB]
+FIND [TERMS] [CREW:NAME] [SINCE:30M|2H|14:30] - SEARCH THE WHOLE SESSION, JUMP TO THE BEST MATCH
+FIND #N    - JUMP TO MATCH N OF THE LAST SEARCH
+SOURCE [FILE] - RUN A FILE OF COMMANDS, INDEPENDENT STEPS IN PARALLEL
+               (A LINE WITH ONLY 'WAIT' WAITS FOR EVERYTHING BEFORE IT)
+[ESC]      - SKIP TEXT ANIMATION
+"""
+
+DESTINATION_TEXT = """
+TARGET: EUROPA (JUPITER II)
+MISSION: SUBSURFACE EXPLORATION
+ETA: 267 DAYS 14 HOURS
+STATUS: ON COURSE
+"""
+
+
+class CommandEngine:
+    """Command dispatcher shared by every frontend.
+
+    Owns the crew, backend, tools, scheduler, caches and runners, and
+    reports only through its OutputSink, so the same dispatch path serves the
+    Tk window, the stdin/stdout CLI and load tests. execute() may be called
+    from any thread and returns a Future resolved when the command's work
+    (response, tool batch, code run) has finished, or failed with
+    CommandFailed if the command was rejected.
+
+    An engine made with parent is a further session on the same model: it
+    shares the parent's scheduler, backend, server client and warm set and
+    keeps its own crew conversations, caches and saved session.
+    """
+    SCRIPT_DEPTH = 8  # SOURCE nesting allowed inside scripts
+
+    def __init__(self, sink, crew_instance=None, model=None, max_tokens=None, model_name="UNKNOWN_MODEL",
+                 config=None, backend=None, started=None, parent=None, session=None):
+        self.sink = sink
+        self.settings = dict(DEFAULT_CONFIG, **(config or {}))
+        self.parent = parent
+        self.session = session  # Label of this session in the shared scheduler
+        if parent is not None:
+            # Files at fixed paths and the model's single KV state stay with the first session
+            self.settings.update(response_cache_path=None, metrics_path=None, metrics_port=None,
+                                 session_kv_state=False, prefill_crew=False)
+        self.model = model
+        self.max_tokens = max_tokens
+        self.model_name = model_name
+        self._lock = threading.RLock()
+        self._started = started or time.perf_counter()
+        self.startup_timings = {}  # Phase name -> seconds since startup began
+
+        # Store last code response
+        self.last_code_response = ""
+
+        # Latency, throughput and load figures for STATUS and the exporters
+        self.metrics = Metrics()
+        self.metrics.add_source(self._load_gauges)
+        self.metrics_exporter = None
+        self.watchdog = None  # StallWatchdog supplied by a frontend with an event loop
+
+        # Repeat questions are answered from here without another inference
+        self.response_cache = None
+        if self.settings["response_cache"]:
+            self.response_cache = ResponseCache(self.model_name,
+                                                max_entries=self.settings["response_cache_size"],
+                                                path=self.settings["response_cache_path"])
+
+        # RUN_CODE sequences execute here, never on the frontend thread
+        self.code_runner = CodeRunner(timeout=self.settings["code_timeout"],
+                                      cpu_seconds=self.settings["code_cpu_seconds"],
+                                      memory_mb=self.settings["code_memory_mb"],
+                                      prewarm=self.settings["code_prewarm"])
+
+        # A llama.cpp server owned by the launcher is reached and watched through this client
+        self.server = None
+        if parent is not None:
+            self.server = parent.server
+        elif isinstance(self.model, dict) and self.model.get("type") == "server":
+            self.server = LlamaServerClient.from_model(self.model, base_url=self.settings["server_url"],
+                                                       pool_size=self.settings["server_pool_size"])
+            self.model.setdefault("client", self.server)
+
+        # Every ASK goes through the scheduler instead of its own thread; sessions share one
+        if parent is not None:
+            self.scheduler = parent.scheduler
+            self.scheduler.add_listener(self._update_queue_status)
+        else:
+            self.scheduler = CrewScheduler(max_inflight=self.settings["max_inflight_per_backend"],
+                                           on_change=self._update_queue_status)
+
+        # Backend modules and the tool list load in the background; commands
+        # that need them wait in _deferred_commands until it is ready
+        self.backend = backend or (parent.backend if parent is not None else Backend())
+        self.tools = ToolRegistry(self.backend)
+        self.tool_executor = ToolExecutor(self.backend, self.tools,
+                                          max_threads=self.settings["tool_threads"],
+                                          max_processes=self.settings["tool_processes"],
+                                          timeout=self.settings["tool_timeout"],
+                                          timeouts=self.settings["tool_timeouts"],
+                                          process_tools=self.settings["process_tools"])
+        self.available_tools = []
+        self._truncated = OrderedDict()  # id -> ToolResult whose rest waits for EXPAND, oldest first
+        self._result_ids = 0
+        self._result_streams = set()  # Cancel events of tool results being written out
+        self._find_hits = []          # Matches of the last FIND, for FIND #N
+        self._deferred_commands = []  # (command, Future) pairs
+        self.backend_state = "loading"  # Then "ready" or "error"
+
+        # Initialize crew if provided
+        self.crew = {}
+        self.current_crew = None
+        if crew_instance:
+            self.crew = crew_instance
+            # Fix: Handle crew initialization properly
+            if isinstance(self.crew, dict) and len(self.crew) > 0:
+                self.current_crew = next(iter(self.crew))
+            else:
+                self.crew = None
+
+        # History is trimmed to the context window and saved between launches
+        self.memory = ConversationMemory(self._context_tokens(), high_water=self.settings["context_high_water"],
+                                         keep_turns=self.settings["context_keep_turns"],
+                                         reserve_tokens=self.settings["context_reserve_tokens"],
+                                         summary_tokens=self.settings["context_summary_tokens"],
+                                         directory=self.settings["session_dir"],
+                                         model_name=self.model_name if parent is None
+                                         else f"{self.model_name} [SESSION {session}]")
+
+        # Switching crew members keeps their conversations; recent model states stay loaded-ready
+        self.warm_set = parent.warm_set if parent is not None else WarmSet(self.settings["warm_set_size"])
+        self._prefilled = False
+        self._last_first_token = {}  # crew name -> (seconds, "FIRST TOKEN" or "RESPONSE") of its last answer
+        self._switches = {}          # crew name switched to -> (crew switched from, its last first token)
+
+    def _context_tokens(self):
+        """Context window to budget against: max_tokens, else the model's own, else 4096"""
+        if self.max_tokens:
+            return int(self.max_tokens)
+        for member in (self.crew or {}).values():
+            n_ctx = getattr(member_backend(member), "n_ctx", None)
+            if callable(n_ctx):
+                try:
+                    return int(n_ctx())
+                except Exception:
+                    pass
+        return 4096
+
+    def start(self):
+        """Begin loading the backend and watching the server"""
+        self.sink.set_field("tools", "TOOLS: LOADING...")
+        self._resume_session()
+        if self.current_crew:
+            self.sink.set_field("crew", f"ACTIVE: {self.current_crew.upper()}")
+        threading.Thread(target=self._load_backend, daemon=True).start()
+        if self.server and self.parent is None:
+            threading.Thread(target=self._monitor_server, daemon=True).start()
+        if self.settings["metrics_path"] or self.settings["metrics_port"] is not None:
+            self.metrics_exporter = MetricsExporter(self.metrics.snapshot, path=self.settings["metrics_path"],
+                                                    interval=self.settings["metrics_interval"],
+                                                    port=self.settings["metrics_port"])
+            try:
+                self.metrics_exporter.start()
+            except OSError as e:
+                self.output(f"ERROR STARTING METRICS EXPORT: {e}")
+
+    def _resume_session(self):
+        """Give every crew member back the conversation it had when the last session ended"""
+        session = self.memory.load(self.crew)
+        if not session:
+            return
+        turns = []
+        for name, saved in session.get("crew", {}).items():
+            if name in self.crew and self.response_cache:
+                self.response_cache.restore(name, saved.get("cache_state"))
+            exchanges = sum(1 for m in saved.get("history", []) if m.get("role") == "user")
+            if exchanges:
+                turns.append(f"{name.upper()} {exchanges}")
+        if session.get("current_crew") in self.crew:
+            self.current_crew = session["current_crew"]
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(session.get("saved", 0)))
+        self.output(f"SESSION RESUMED FROM {when}: " + (", ".join(turns) + " TURNS" if turns else "NO HISTORY"))
+        if session.get("kv"):
+            # Queued like a question so no generation touches the model while its state loads
+            def report(future):
+                if not future.cancelled() and future.result():
+                    self.output("MODEL STATE RESTORED: " + ", ".join(name.upper() for name in future.result()))
+
+            job = self.scheduler.submit(self.current_crew, self.crew[self.current_crew],
+                                        lambda cancel: self._restore_kv(session), session=self.session)
+            job.future.add_done_callback(report)
+
+    def _restore_kv(self, session):
+        restored = self.memory.load_kv(self.crew, session)
+        for name in restored:
+            self.warm_set.claim(self._warm_key(name), self.crew[name])
+        return restored
+
+    def _warm_key(self, crew_name):
+        """Warm-set key; sessions share the set but not their members' states"""
+        return self.session, crew_name
+
+    def save_session(self, kv_state=False):
+        states = {name: self.response_cache.state(name) for name in self.crew} if self.response_cache else {}
+        self.memory.save(self.crew, self.current_crew, states, kv_state=kv_state)
+
+    def mark_startup(self, phase):
+        self.startup_timings[phase] = time.perf_counter() - self._started
+
+    def output(self, text):
+        self.sink.write(text)
+
+    def set_status(self, text):
+        self.sink.status(text)
+
+    def _load_backend(self):
+        """Worker thread: import the backend and fetch the tool list"""
+        if self.parent is not None:
+            # The first session imports the shared backend
+            self.backend.ready.wait()
+        elif not self.backend.ready.is_set():
+            self.backend.load(progress=lambda label: self.set_status(f"LOADING BACKEND: {label}..."))
+        tools = []
+        if self.backend.error is None:
+            try:
+                tools = self.tools.build()
+            except Exception as e:
+                self.backend.error = e
+        self._backend_ready(tools)
+
+    def _backend_ready(self, tools):
+        """Publish the tool list, report startup and run queued commands"""
+        with self._lock:
+            self.mark_startup("backend_ready")
+            if self.backend.error is not None:
+                self.backend_state = "error"
+                self.sink.set_field("tools", "TOOLS: ERROR LOADING")
+                self.output(f"ERROR LOADING BACKEND: {self.backend.error}")
+                print(f"Error loading tools: {self.backend.error}")
+            else:
+                self.backend_state = "ready"
+                self.available_tools = tools
+                self.sink.set_field("tools", f"TOOLS: {len(self.available_tools)} LOADED")
+            self.set_status("READY FOR COMMANDS")
+
+            phases = [f"{name.upper()} {secs * 1000:.0f}MS" for name, secs in self.startup_timings.items()]
+            phases += [f"IMPORT {label} {secs * 1000:.0f}MS" for label, secs in self.backend.timings.items()]
+            report = "STARTUP: " + " | ".join(phases)
+            print(report)
+            self.output(report)
+
+            self._run_deferred()
+            self._prefill_crew()
+
+    def _prefill_crew(self):
+        """Queue a background system-prompt prefill for the crew, the active member first"""
+        if self._prefilled or not self.crew or not self.settings["prefill_crew"] or not self.warm_set.limit:
+            return
+        self._prefilled = True
+        names = [self.current_crew] + [name for name in self.crew if name != self.current_crew]
+        names = names[:self.warm_set.limit + 1]  # Later prefills would only evict earlier ones
+        timings = {}
+        pending = []
+
+        def prefill(name, cancel):
+            member = self.crew[name]
+            if cancel.is_set() or self.warm_set.is_warm(self._warm_key(name), member):
+                return None
+            try:
+                return self.warm_set.prefill(self._warm_key(name), member)
+            except Exception as e:
+                print(f"Error prefilling {name}: {e}")
+                return None
+
+        def finished(name, future):
+            seconds = None if future.cancelled() or future.exception() else future.result()
+            with self._lock:
+                if seconds is not None:
+                    timings[name] = seconds
+                    self.metrics.observe("prefill", seconds, name)
+                pending.remove(name)
+                if pending or not timings:
+                    return
+            self.output("CREW PREFILLED: " + ", ".join(f"{n.upper()} {s:.2f}s" for n, s in timings.items()))
+
+        pending.extend(names)
+        for name in names:
+            job = self.scheduler.submit(name, self.crew[name], lambda cancel, name=name: prefill(name, cancel),
+                                        session=self.session, background=True)
+            job.future.add_done_callback(lambda future, name=name: finished(name, future))
+
+    def _run_deferred(self):
+        deferred, self._deferred_commands = self._deferred_commands, []
+        for command, future in deferred:
+            self._chain(self.execute(command), future)
+
+    @staticmethod
+    def _chain(source, target):
+        """Resolve target with source's outcome once source is done"""
+        def _copy(done):
+            if done.cancelled():
+                target.cancel()
+            elif done.exception() is not None:
+                target.set_exception(done.exception())
+            else:
+                target.set_result(done.result())
+        source.add_done_callback(_copy)
+
+    def _defer(self, command):
+        future = Future()
+        self._deferred_commands.append((command, future))
+        return future
+
+    def reload_tools(self):
+        """Re-import the tools module and rebuild the registry off the calling thread"""
+        with self._lock:
+            if self.backend_state == "loading":
+                return
+            # Tool commands queue up behind the reload like they do at startup
+            self.backend_state = "loading"
+        self.sink.set_field("tools", "TOOLS: RELOADING...")
+
+        def _reload():
+            try:
+                self.backend.reload_tools()
+                tools = self.tools.build()
+            except Exception as e:
+                self.output(f"ERROR RELOADING TOOLS: {e}")
+                tools = None
+            self._tools_reloaded(tools)
+        threading.Thread(target=_reload, daemon=True).start()
+
+    def _tools_reloaded(self, tools):
+        with self._lock:
+            self.backend_state = "ready"
+            if tools is None:
+                self.sink.set_field("tools", "TOOLS: ERROR LOADING")
+            else:
+                self.available_tools = tools
+                self.sink.set_field("tools", f"TOOLS: {len(tools)} LOADED")
+                self.output(f"TOOL REGISTRY RELOADED: {len(tools)} TOOLS")
+            self._run_deferred()
+
+    def _check_tools_fresh(self):
+        """Reload the registry if a tool source file changed since the last build"""
+        if self.tools.is_stale():
+            self.output("TOOL SOURCES CHANGED - RELOADING REGISTRY")
+            self.reload_tools()
+            return False
+        return True
+
+    def completions(self, text):
+        """Candidates for the last word of text: command words, tool names or crew names"""
+        head, _, last = text.rpartition(" ")
+        first = text.split(" ", 1)[0].lower()
+        if not head:
+            return [w for w in COMMAND_WORDS if w.startswith(last.lower())]
+        if first == "run_tool":
+            return self.tools.complete(last)
+        if first == "use" and head.lower() == first:
+            return sorted(name for name in (self.crew or {}) if name.lower().startswith(last.lower()))
+        return []
+
+    @staticmethod
+    def _needs_backend(command_lower):
+        """True for commands that use the backend modules"""
+        return any(command_lower == c or command_lower.startswith(c + " ") for c in BACKEND_COMMANDS)
+
+    def execute(self, command):
+        """Execute the command with Matrix flair; returns a Future for its completion"""
+        with self._lock:
+            try:
+                return self._execute(command.strip())
+            finally:
+                self.set_status("READY FOR COMMANDS")
+
+    def _execute(self, command):
+        command_lower = command.lower()
+
+        if self._needs_backend(command_lower) and self.backend_state != "ready":
+            if self.backend_state == "loading":
+                self.output("BACKEND STILL LOADING - COMMAND QUEUED")
+                return self._defer(command)
+            return self._fail("ERROR: BACKEND UNAVAILABLE")
+
+        if command_lower == "exit":
+            self.output("DISCONNECTING FROM MATRIX...")
+            if self.server:
+                self.output("Terminating server process...")
+            finished = Future()
+            threading.Thread(target=self._exit, args=(finished,), daemon=True).start()
+            return finished
+
+        elif command_lower == "help":
+            self.sink.typewrite(HELP_TEXT)
+
+        elif command_lower == "status":
+            self.sink.typewrite(self.status_text())
+
+        elif command_lower == "destination":
+            self.sink.typewrite(DESTINATION_TEXT)
+
+        elif command_lower in ["crew", "list crew"]:
+            self.list_crew()
+
+        elif command_lower in ["tools", "list tools"]:
+            self.list_tools()
+
+        elif command_lower == "reload tools":
+            self.reload_tools()
+
+        elif command_lower in ["model_info", "model info"]:
+            self.show_model_info()
+
+        elif command_lower.startswith("use "):
+            crew_name = command[4:].strip()
+            if self.crew and crew_name in self.crew:
+                previous, self.current_crew = self.current_crew, crew_name
+                # The member keeps its conversation; RESET is the way to wipe it
+                notes = []
+                warm = self.warm_set.is_warm(self._warm_key(crew_name), self.crew[crew_name])
+                if warm is not None:
+                    notes.append("STATE WARM" if warm else "STATE COLD")
+                if previous != crew_name:
+                    before = self._last_first_token.get(previous)
+                    self._switches[crew_name] = (previous, before)
+                    if before:
+                        notes.append(f"{previous.upper()} {before[1]} {before[0]:.2f}s")
+                self.output(f"SWITCHING NEURAL LINK: {crew_name.upper()}" + (f" ({' | '.join(notes)})" if notes else ""))
+                self.sink.set_field("crew", f"ACTIVE: {crew_name.upper()}")
+            else:
+                return self._fail(f"ERROR: CREW MEMBER '{crew_name.upper()}' NOT FOUND IN DATABASE")
+
+        elif command_lower == "history" or command_lower.startswith("history "):
+            parts = command.split()
+            count = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 200
+            if not self.sink.page_history(count):
+                return self._fail("ERROR: TRANSCRIPT DISABLED")
+
+        elif command_lower == "cancel":
+            self.cancel_requests()
+
+        elif command_lower == "stalls":
+            self.show_stalls()
+
+        elif command_lower == "find" or command_lower.startswith("find "):
+            return self.find(command[4:].strip())
+
+        elif command_lower == "tab" or command_lower.startswith("tab "):
+            if not self.sink.tabs(command[3:].strip().lower()):
+                return self._fail("ERROR: THIS TERMINAL RUNS A SINGLE SESSION")
+
+        elif command_lower == "expand" or command_lower.startswith("expand "):
+            args = command[6:].split()
+            number = args.pop(0)[1:] if args and args[0].startswith("#") else None
+            if len(args) > 1 or (args and not args[0].isdigit()) or (number is not None and not number.isdigit()):
+                return self._fail("ERROR: USAGE: EXPAND [#ID] [LINES]")
+            return self.expand_result(int(number) if number else None, int(args[0]) if args else None)
+
+        elif command_lower.startswith("source "):
+            return self.source(command[7:].strip())
+
+        elif command_lower == "reset":
+            if self.crew and self.current_crew in self.crew:
+                self.reset_member(self.current_crew)
+                self.last_code_response = ""
+                self.output(f"MEMORY PURGE COMPLETE: {self.current_crew.upper()}")
+            else:
+                return self._fail("ERROR: NO CREW MEMBER ACTIVE")
+
+        elif command_lower.startswith("ask "):
+            query = command[4:].strip()
+            if not query:
+                return self._fail("ERROR: QUERY PARAMETER REQUIRED")
+
+            targets, fanout_query = self._fanout_targets(query)
+            if targets is not None:
+                if not fanout_query:
+                    return self._fail("ERROR: QUERY PARAMETER REQUIRED")
+                return self.ask_many(targets, fanout_query)
+
+            if self.crew and self.current_crew in self.crew:
+                crew_name = self.current_crew
+
+                def announce(position):
+                    if position:
+                        self.output(f"QUERY QUEUED FOR {crew_name.upper()} (POSITION {position})")
+                    else:
+                        self.output(f"PROCESSING QUERY THROUGH {crew_name.upper()}...")
+
+                return self._submit_ask(crew_name, query, announce=announce).future
+            return self._fail("ERROR: NO ACTIVE CREW MEMBER")
+
+        elif command_lower.startswith("run_tool"):
+            parts = command.split(maxsplit=1)
+            if len(parts) < 2:
+                return self._fail("ERROR: TOOL IDENTIFIER REQUIRED")
+
+            if not self._check_tools_fresh():
+                return self._defer(command)
+            # A whole argument naming one tool wins; otherwise each word is a tool
+            requested = parts[1].strip()
+            names = [requested] if self.tools.get(requested) else requested.split()
+            unknown = [name for name in names if self.tools.get(name) is None]
+            if unknown:
+                for name in unknown:
+                    self.output(f"ERROR: UNKNOWN TOOL '{name.upper()}'")
+                    matches = self.tools.complete(name[:3])
+                    if matches:
+                        self.output("DID YOU MEAN: " + ", ".join(matches))
+                return self._fail(None)
+            names = [self.tools.get(name)["name"] for name in names]
+            self.output(f"EXECUTING TOOL{'S' if len(names) > 1 else ''}: "
+                        + ", ".join(f"'{name.upper()}'" for name in names))
+            self.set_status("RUNNING TOOL...")
+            return self.execute_tools(names)
+
+        elif command_lower == "run_code":
+            if self.current_crew == "code_expert" and self.last_code_response:
+                self.output("\n⚠ SECURITY WARNING ⚠")
+                self.output("UNAUTHORIZED CODE EXECUTION DETECTED")
+                self.output("REVIEW BEFORE PROCEEDING:\n")
+                self.output(self.last_code_response)
+
+                code = self.last_code_response
+                finished = Future()
+
+                def on_answer(confirm):
+                    if confirm:
+                        self._chain(self.run_code(code), finished)
+                    else:
+                        self.output("CODE EXECUTION ABORTED")
+                        finished.set_result(None)
+
+                self.sink.confirm("EXECUTE CODE?", "EXECUTE POTENTIALLY DANGEROUS CODE SEQUENCE?", on_answer)
+                return finished
+            return self._fail("ERROR: NO CODE SEQUENCE AVAILABLE")
+
+        else:
+            self.output("COMMAND NOT RECOGNIZED")
+            return self._fail("TYPE 'HELP' FOR COMMAND LIST")
+
+        return _resolved()
+
+    def _fail(self, message):
+        """Show message (if any) and return a Future failed with CommandFailed"""
+        if message:
+            self.output(message)
+        future = Future()
+        future.set_exception(CommandFailed(message or "command rejected"))
+        return future
+
+    def source(self, path, depth=0):
+        """Run a file of commands on a worker thread; returns a Future for its summary"""
+        if depth > self.SCRIPT_DEPTH:
+            return self._fail("ERROR: SCRIPTS NESTED TOO DEEPLY")
+        path = os.path.expanduser(path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except OSError as e:
+            return self._fail(f"ERROR: CANNOT READ SCRIPT: {e}")
+        self.output(f"SOURCING {os.path.basename(path)}")
+        finished = Future()
+        threading.Thread(target=self._run_script, args=(lines, path, depth, finished), daemon=True).start()
+        return finished
+
+    def _step_keys(self, command_lower):
+        """(keys the step must wait for, keys it produces); None waits for every earlier step.
+
+        Keys are "crew:<name>" for a member's conversation, "tools" and
+        "code". Questions to one member are already kept in order by the
+        scheduler, so only steps that read or wipe a member's answers wait.
+        """
+        current = f"crew:{self.current_crew}"
+        if command_lower in ("wait", "exit") or command_lower.startswith(("source ", "find ")):
+            # FIND searches the output of every step before it
+            return None, set()
+        if command_lower.startswith("ask "):
+            targets, _ = self._fanout_targets(command_lower[4:].strip())
+            return set(), {current} if targets is None else {f"crew:{name}" for name in targets}
+        if command_lower == "reset":
+            return {current}, {current}
+        if command_lower == "run_code":
+            return {current, "code"}, {"code"}
+        if command_lower.startswith("run_tool"):
+            return set(), {"tools"}
+        if command_lower == "expand" or command_lower.startswith("expand "):
+            return {"tools"}, {"tools"}
+        if command_lower == "reload tools":
+            return {"tools"}, {"tools"}
+        return set(), set()
+
+    @staticmethod
+    def _step_failed(command_lower, future):
+        if future.cancelled() or future.exception() is not None:
+            return True
+        result = future.result()
+        if command_lower.startswith("ask "):
+            return not result or (isinstance(result, dict) and not all(result.values()))
+        if command_lower.startswith("run_tool"):
+            return any(status != "OK" for status in result.values())
+        if command_lower == "run_code":
+            return result != 0
+        if command_lower.startswith("source "):
+            return bool(result["failed"])
+        return False
+
+    def _run_script(self, lines, path, depth, finished):
+        """Worker thread: submit each step as soon as the steps it depends on are done"""
+        started = time.perf_counter()
+        steps = []
+
+        def wait_for(keys):
+            for step in steps:
+                if keys is None or step["keys"] & keys:
+                    wait([step["future"]])
+
+        for number, line in enumerate(lines, 1):
+            command = line.strip()
+            if not command or command.startswith("#"):
+                continue
+            command_lower = command.lower()
+            needs, keys = self._step_keys(command_lower)
+            wait_for(needs)
+            if command_lower == "wait":
+                continue
+            step = {"line": number, "command": command, "keys": keys, "started": time.perf_counter()}
+            # Echoed as a typed command is, so its output can be told apart and FIND sees the step
+            self.output(f"> {command}")
+            if command_lower.startswith("source "):
+                nested = os.path.join(os.path.dirname(path), os.path.expanduser(command[7:].strip()))
+                step["future"] = self.source(nested, depth + 1)
+            else:
+                step["future"] = self.execute(command)
+            step["future"].add_done_callback(lambda future, step=step: step.update(ended=time.perf_counter()))
+            steps.append(step)
+            if command_lower.startswith("source "):
+                wait([step["future"]])
+            if command_lower == "exit":
+                break
+        wait_for(None)
+
+        elapsed = time.perf_counter() - started
+        failed = [step for step in steps if self._step_failed(step["command"].lower(), step["future"])]
+        for step in steps:
+            step["seconds"] = step.get("ended", time.perf_counter()) - step["started"]
+        report = [f"SCRIPT COMPLETE: {os.path.basename(path)} | {len(steps)} STEPS IN {elapsed:.2f}s "
+                  f"(STEP TIME {sum(step['seconds'] for step in steps):.2f}s) | {len(failed)} FAILED"]
+        report += [f"  FAILED LINE {step['line']}: {step['command']}" for step in failed]
+        slowest = sorted(steps, key=lambda step: step["seconds"], reverse=True)[:3]
+        if slowest:
+            report.append("  SLOWEST: " + "; ".join(f"LINE {step['line']} {step['command'][:30]} {step['seconds']:.2f}s"
+                                                    for step in slowest))
+        self.output("\n".join(report))
+        finished.set_result({"steps": len(steps), "seconds": elapsed,
+                             "failed": [(step["line"], step["command"]) for step in failed]})
+
+    def _load_gauges(self):
+        queued, running = self.scheduler.counts(self.session)
+        rss = process_rss()
+        return {"requests_running": running, "requests_queued": queued,
+                "code_running": self.code_runner.running,
+                "rss_mb": round(rss / 2 ** 20, 1) if rss else None}
+
+    def _fanout_targets(self, query):
+        """(crew names, query) for "ALL ..." or "a,b ..."; (None, query) for a plain question"""
+        if not self.crew:
+            return None, query
+        first, _, rest = query.partition(" ")
+        if first.lower() == "all":
+            return list(self.crew), rest.strip()
+        if "," not in first:
+            return None, query
+        by_lower = {name.lower(): name for name in self.crew}
+        names = [name.strip().lower() for name in first.split(",") if name.strip()]
+        if not names or any(name not in by_lower for name in names):
+            return None, query
+        return list(dict.fromkeys(by_lower[name] for name in names)), rest.strip()
+
+    def _submit_ask(self, crew_name, query, fanout=False, announce=None):
+        """Queue a question for one crew member and time it; returns the CrewJob"""
+        submitted = time.perf_counter()
+
+        def record_latency(future):
+            if not future.cancelled():
+                self.metrics.observe("ask_latency", time.perf_counter() - submitted, crew_name)
+
+        job = self.scheduler.submit(crew_name, self.crew[crew_name],
+                                    lambda cancel: self.process_ask(query, crew_name, cancel, fanout=fanout),
+                                    session=self.session, announce=announce)
+        job.future.add_done_callback(record_latency)
+        return job
+
+    def ask_many(self, crew_names, query):
+        """Send one question to several crew members at once; returns a Future for all answers.
+
+        The scheduler runs members on separate backends in parallel and lets
+        a batching server take as many as it has slots, so the wall time
+        approaches the slowest answer. Each answer is shown whole, in its own
+        section, as soon as it is ready.
+        """
+        started = time.perf_counter()
+        self.output(f"BROADCASTING QUERY TO {len(crew_names)} CREW MEMBERS: "
+                    + ", ".join(name.upper() for name in crew_names))
+        jobs = {name: self._submit_ask(name, query, fanout=True) for name in crew_names}
+        finished = Future()
+        latencies = {}
+        lock = threading.Lock()
+
+        def on_done(name, future):
+            with lock:
+                latencies[name] = time.perf_counter() - started
+                if len(latencies) < len(jobs):
+                    return
+            answers = {name: None if job.future.cancelled() or job.future.exception() else job.future.result()
+                       for name, job in jobs.items()}
+            answered = sum(1 for answer in answers.values() if answer)
+            slowest = max(latencies, key=latencies.get)
+            self.output(f"BROADCAST COMPLETE: {answered}/{len(jobs)} ANSWERED IN "
+                        f"{time.perf_counter() - started:.2f}s (SLOWEST {slowest.upper()} "
+                        f"{latencies[slowest]:.2f}s)")
+            finished.set_result(answers)
+
+        for name, job in jobs.items():
+            job.future.add_done_callback(lambda future, name=name: on_done(name, future))
+        return finished
+
+    def status_text(self):
+        """STATUS box filled from the live metrics"""
+        model_type = "GGUF"
+        snapshot = self.metrics.snapshot()
+        series, gauges = snapshot["series"], snapshot["gauges"]
+
+        def row(label, value):
+            return f"{label} ".ljust(26, ".") + f" {value}"
+
+        def timing(stats, scale=1000, unit="MS"):
+            return (f"LAST {stats['last'] * scale:.0f}{unit} MEAN {stats['mean'] * scale:.0f}{unit} "
+                    f"P95 {stats['p95'] * scale:.0f}{unit} (N={stats['n']})")
+
+        rows = [row("CREW CONNECTION", "STABLE" if self.crew else "OFFLINE"),
+                row("MODEL TYPE", model_type),
+                row("TOOLS", len(self.available_tools) if self.available_tools else "N/A"),
+                row("REQUESTS", f"{gauges['requests_running']} RUNNING, {gauges['requests_queued']} QUEUED"
+                                + (", CODE RUNNING" if gauges["code_running"] else "")),
+                row("PROCESS RSS", f"{gauges['rss_mb']:.0f}MB" if gauges.get("rss_mb") else "N/A")]
+        if "rain_fps" in gauges:
+            rows.append(row("RAIN", "PAUSED" if gauges["rain_paused"] else
+                            f"{gauges['rain_fps']:.1f} FPS, FRAME {gauges['rain_frame_ms']:.1f}MS, "
+                            f"DENSITY {gauges['rain_density']:.0%}"))
+        for stats in series.get("loop_lag", {}).values():
+            rows.append(row("EVENT LOOP LAG", timing(stats)))
+        for name, stats in sorted(series.get("ask_latency", {}).items()):
+            rows.append(row(f"ASK {name.upper()}", timing(stats)))
+        for name, stats in sorted(series.get("ttft", {}).items()):
+            rate = series.get("tokens_per_sec", {}).get(name)
+            rows.append(row(f"TTFT {name.upper()}", f"LAST {stats['last']:.2f}s MEAN {stats['mean']:.2f}s"
+                            + (f" | {rate['last']:.1f} TOK/S (MEAN {rate['mean']:.1f})" if rate else "")))
+        for name, stats in sorted(series.get("prompt_tokens", {}).items()):
+            rows.append(row(f"CONTEXT {name.upper()}", f"{stats['last']} TOKENS "
+                                                        f"({stats['last'] * 100 // self.memory.context_tokens}% "
+                                                        f"OF {self.memory.context_tokens})"))
+        for name, stats in sorted(series.get("tool_seconds", {}).items()):
+            rows.append(row(f"TOOL {name.upper()}", timing(stats)))
+        sessions = self.scheduler.session_stats()
+        if len(sessions) > 1:
+            for session, stats in sorted(sessions.items(), key=lambda item: str(item[0])):
+                waits = (f" | WAIT P50 {stats['wait_p50']:.2f}s P95 {stats['wait_p95']:.2f}s"
+                         f" | RUN P50 {stats['run_p50']:.2f}s" if stats["done"] else "")
+                rows.append(row(f"SESSION {session or 'MAIN'}" + (" (THIS)" if session == self.session else ""),
+                                f"{stats['running']} RUNNING, {stats['queued']} QUEUED, {stats['done']} DONE" + waits))
+        for stats in series.get("stall", {}).values():
+            rows.append(row("EVENT LOOP STALLS", f"{self.watchdog.count if self.watchdog else stats['n']} "
+                                                 f"(WORST {stats['max'] * 1000:.0f}MS)"))
+
+        title = "SYSTEM STATUS: ALL SYSTEMS OPERATIONAL"
+        width = max(len(title), *(len(r) for r in rows)) + 2
+        lines = ["╔" + "═" * width + "╗", "║ " + title.ljust(width - 1) + "║", "╠" + "═" * width + "╣"]
+        lines += ["║ " + r.ljust(width - 1) + "║" for r in rows]
+        lines.append("╚" + "═" * width + "╝")
+        return ("\n" + "\n".join(lines) + "\n"
+                + f"  Active Crew: {self.current_crew.upper() if self.current_crew else 'NONE'}\n")
+
+    def run_code(self, code):
+        """Execute a code sequence in the code runner, streaming its output; returns a Future"""
+        finished = Future()
+
+        def on_line(stream, line):
+            self.output(line if stream == "stdout" else f"! {line}")
+
+        def on_exit(returncode, seconds, reason):
+            if reason:
+                self.output(f"--- EXECUTION {reason} AFTER {seconds:.2f}s ---")
+            elif returncode == 0:
+                self.output(f"--- EXECUTION SUCCESSFUL ({seconds:.2f}s) ---")
+            else:
+                self.output(f"--- EXECUTION ERROR (EXIT {returncode}, {seconds:.2f}s) ---")
+            self.set_status("READY FOR COMMANDS")
+            finished.set_result(returncode)
+
+        try:
+            if not self.code_runner.run(code, on_line, on_exit):
+                self.output("ERROR: A CODE SEQUENCE IS ALREADY RUNNING - CANCEL TO KILL IT")
+                return _resolved()
+        except OSError as e:
+            self.output(f"FATAL ERROR: {e}")
+            return _resolved()
+        self.output("\n--- EXECUTING CODE SEQUENCE ---")
+        self.set_status("RUNNING CODE...")
+        return finished
+
+    def _monitor_server(self):
+        """Worker thread: wait for the server to load, then check its health periodically"""
+        def show(state, latency):
+            text = {"ok": "STATUS: CONNECTED", "loading": "STATUS: SERVER LOADING",
+                    "error": "STATUS: SERVER ERROR", "down": "STATUS: SERVER DOWN"}[state]
+            if state == "ok":
+                text += f" ({latency * 1000:.0f}MS)"
+            self.sink.set_field("connection", text)
+
+        server = self.server
+        if not server.wait_until_ready(self.settings["server_ready_timeout"], on_poll=show):
+            self.output("WARNING: MODEL SERVER DID NOT BECOME READY")
+        elif (server.fetch_slots() or 1) > 1:
+            self.output(f"MODEL SERVER BATCHES {server.slots} REQUESTS IN PARALLEL")
+        while self.server is server:
+            show(*server.health())
+            time.sleep(self.settings["server_health_interval"])
+
+    def _exit(self, finished):
+        """Worker thread: stop the server gracefully, release everything, tell the frontend"""
+        server, self.server = self.server, None
+        if server:
+            server.shutdown(timeout=self.settings["server_shutdown_timeout"])
+            self.output("SERVER PROCESS STOPPED")
+        self.shutdown()
+        self.sink.exit()
+        finished.set_result(None)
+
+    def shutdown(self):
+        """Persist caches and the session, then stop every worker"""
+        if self.response_cache:
+            self.response_cache.save()
+        if self.crew:
+            # Model state is only consistent when no generation is running and it holds this session's
+            kv_state = (self.settings["session_kv_state"] and not self.scheduler.counts()[1]
+                        and all(key[0] == self.session for key in self.warm_set.owners()))
+            self.save_session(kv_state=kv_state)
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+        self.scheduler.cancel(session=self.session)
+        if self.parent is not None:
+            self.scheduler.remove_listener(self._update_queue_status)
+            self.scheduler.forget_session(self.session)
+        with self._lock:
+            truncated, self._truncated = list(self._truncated.values()), OrderedDict()
+        for result in truncated:
+            result.close()
+        self.tool_executor.shutdown()
+        self.code_runner.shutdown()
+
+    def execute_tools(self, names):
+        """Fan tools out to the executor; each result is shown as it finishes"""
+        started = time.perf_counter()
+
+        def on_done(name, status, result, seconds):
+            if status == "OK":
+                self.output(f"TOOL EXECUTION COMPLETE: {name.upper()} ({seconds:.2f}s)")
+                self.show_result(name, result)
+            elif status == "ERROR":
+                self.output(f"ERROR IN TOOL EXECUTION: {name.upper()} ({seconds:.2f}s): {result}")
+            else:
+                self.output(f"TOOL {status}: {name.upper()} ({seconds:.2f}s)")
+            self.metrics.observe("tool_seconds", seconds, name)
+
+        def on_batch_done(future):
+            statuses = future.result()
+            if len(statuses) > 1:
+                ok = sum(1 for status in statuses.values() if status == "OK")
+                self.output(f"TOOLS COMPLETE: {ok}/{len(statuses)} OK IN {time.perf_counter() - started:.2f}s")
+            self.set_status("READY FOR COMMANDS")
+
+        batch = self.tool_executor.run(names, self.crew, on_done)
+        batch.add_done_callback(on_batch_done)
+        return batch
+
+    def find(self, query):
+        """List transcript blocks matching query and jump to the best, or to match #N of the last search"""
+        preview = self.settings["tool_preview_lines"]
+        if query.startswith("#"):
+            number = query[1:]
+            if not number.isdigit() or not 1 <= int(number) <= len(self._find_hits):
+                return self._fail("ERROR: NO SUCH MATCH")
+            hit = self._find_hits[int(number) - 1]
+            self.sink.reveal(hit["line"], min(hit["lines"], preview))
+            return _resolved()
+        terms, crew, since = [], None, None
+        for word in query.split():
+            lower = word.lower()
+            if lower.startswith("crew:"):
+                crew = lower[5:]
+            elif lower.startswith("since:"):
+                since = parse_since(lower[6:])
+                if since is None:
+                    return self._fail(f"ERROR: BAD TIME '{word[6:].upper()}' (USE 30M, 2H, 1D OR 14:30)")
+            else:
+                terms.append(word)
+        if not terms:
+            return self._fail("USAGE: FIND [TERMS] [CREW:NAME] [SINCE:30M|2H|14:30]")
+        started = time.perf_counter()
+        hits = self.sink.search(terms, crew=crew, since=since, limit=self.settings["find_results"])
+        if hits is None:
+            return self._fail("ERROR: TRANSCRIPT DISABLED")
+        elapsed = time.perf_counter() - started
+        self.metrics.observe("find_seconds", elapsed)
+        if not hits:
+            self.output(f"NO MATCHES FOR '{' '.join(terms).upper()}' ({elapsed * 1000:.0f}MS)")
+            return _resolved()
+        self._find_hits = hits
+        self.output(f"{len(hits)} BEST MATCH{'ES' if len(hits) > 1 else ''} ({elapsed * 1000:.0f}MS):")
+        for number, hit in enumerate(hits, 1):
+            when = time.strftime("%H:%M:%S", time.localtime(hit["time"]))
+            source = f"{hit['kind']} {hit['crew']}" if hit["crew"] else hit["kind"]
+            self.output(f"#{number} LINE {hit['line'] + 1} {when} [{source.upper()}] {hit['snippet'][:100]}")
+        if len(hits) > 1:
+            self.output("TYPE 'FIND #N' TO JUMP TO ANOTHER MATCH")
+        self.sink.reveal(hits[0]["line"], min(hits[0]["lines"], preview))
+        return _resolved()
+
+    TRUNCATED_KEPT = 16  # Truncated results EXPAND can return to; older ones are closed
+
+    def show_result(self, name, value):
+        """Show a tool result; past the preview limits the rest waits for EXPAND.
+
+        Big results are read on a worker thread, so the tool batch can
+        report its other tools meanwhile.
+        """
+        result = ToolResult(name, value)
+        max_lines, max_chars = self.settings["tool_preview_lines"], self.settings["tool_preview_chars"]
+        if result.is_small(max_lines, max_chars):
+            self.output(f"RESULT: {result.value}")
+            return _resolved(True)
+        with self._lock:
+            self._result_ids += 1
+            result.id = self._result_ids
+        return self._stream_result(result, max_lines, max_chars, header=f"RESULT #{result.id} ({name.upper()}):")
+
+    def expand_result(self, number=None, count=None):
+        """Stream the rest of truncated result #number (the latest by default), or its next count lines"""
+        with self._lock:
+            if number is None and self._truncated:
+                number = next(reversed(self._truncated))
+            result = self._truncated.pop(number, None)
+        if result is None:
+            if number is None:
+                return self._fail("ERROR: NO TRUNCATED TOOL RESULT TO EXPAND")
+            return self._fail(f"ERROR: NO TRUNCATED RESULT #{number}")
+        self.output(f"EXPANDING {result.name.upper()} RESULT #{result.id}...")
+        return self._stream_result(result, max_lines=count)
+
+    def _keep_truncated(self, result):
+        with self._lock:
+            self._truncated[result.id] = result
+            evicted = []
+            while len(self._truncated) > self.TRUNCATED_KEPT:
+                evicted.append(self._truncated.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+
+    def _stream_result(self, result, max_lines=None, max_chars=None, header=None):
+        """Write result lines in chunks on a worker thread until a limit or its end; returns a Future of success.
+
+        Each chunk waits for the frontend to display the one before, so a
+        huge result never lands as a single insert. header goes out with the
+        first chunk, keeping a preview in one piece.
+        """
+        finished = Future()
+        cancel = threading.Event()
+        with self._lock:
+            self._result_streams.add(cancel)
+        chunk_lines = self.settings["tool_expand_chunk"]
+        flush_interval = self.settings["stream_flush_ms"] / 1000
+
+        def write(lines):
+            nonlocal header
+            while self.sink.backlog() and not cancel.is_set():
+                time.sleep(0.01)
+            if header:
+                lines, header = [header] + lines, None
+            self.output("\n".join(lines))
+
+        def run():
+            shown = chars = 0
+            pending = []
+            last_flush = time.perf_counter()
+            try:
+                while not result.done and not cancel.is_set():
+                    if (max_lines is not None and shown >= max_lines) or (max_chars is not None and chars >= max_chars):
+                        break
+                    # One line at a time so a slow generator's lines still show promptly
+                    lines = result.page(1)
+                    shown += len(lines)
+                    chars += sum(len(line) + 1 for line in lines)
+                    pending.extend(lines)
+                    now = time.perf_counter()
+                    if pending and (len(pending) >= chunk_lines or now - last_flush >= flush_interval):
+                        write(pending)
+                        pending = []
+                        last_flush = now
+                if pending or header:
+                    write(pending)
+            except Exception as e:
+                self.output(f"ERROR READING TOOL RESULT: {e}")
+                result.close()
+                result.done = True
+            finally:
+                with self._lock:
+                    self._result_streams.discard(cancel)
+
+            if cancel.is_set():
+                result.close()
+                self.output(f"RESULT OUTPUT CANCELLED: {result.name.upper()} ({result.lines_shown:,} LINES SHOWN)")
+            elif not result.done:
+                self._keep_truncated(result)
+                self.output(f"[RESULT #{result.id} TRUNCATED: {result.summary()} - "
+                            f"TYPE 'EXPAND #{result.id}' FOR THE REST]")
+            elif max_chars is None:
+                self.output(f"[RESULT COMPLETE: {result.lines_shown:,} LINES]")
+            finished.set_result(not cancel.is_set())
+
+        threading.Thread(target=run, daemon=True).start()
+        return finished
+
+    def reset_member(self, crew_name):
+        """Wipe a crew member's memory; cached answers from older context stop matching"""
+        self.crew[crew_name].reset()
+        if self.response_cache:
+            self.response_cache.reset(crew_name)
+        self.warm_set.forget(self._warm_key(crew_name))
+        self.save_session()
+
+    def cancel_requests(self):
+        """Abort running crew requests and drop the queued ones"""
+        cancelled, dropped = self.scheduler.cancel(session=self.session)
+        tool_batches = self.tool_executor.cancel_all()
+        code_killed = self.code_runner.kill()
+        with self._lock:
+            result_streams = list(self._result_streams)
+        for stream in result_streams:
+            stream.set()
+        if cancelled or dropped:
+            self.output(f"CANCELLED {cancelled} RUNNING, DROPPED {dropped} QUEUED")
+        if tool_batches:
+            self.output(f"CANCELLING {tool_batches} TOOL RUN{'S' if tool_batches > 1 else ''}")
+        if not (cancelled or dropped or tool_batches or code_killed or result_streams):
+            self.output("NO REQUESTS TO CANCEL")
+
+    def _update_queue_status(self, queued, running):
+        # The scheduler may be shared; show this session's share of it
+        queued, running = self.scheduler.counts(self.session)
+        self.sink.set_field("queue", f"QUEUE: {queued} | RUN: {running}")
+
+    def process_ask(self, query, crew_name=None, cancel=None, fanout=False):
+        """Process an ask command, streaming tokens when the crew member supports it.
+
+        With fanout the answer is collected and shown in one piece, labelled
+        with its latency, so concurrent answers never interleave.
+        """
+        crew_name = crew_name or self.current_crew
+        cancel = cancel or threading.Event()
+        member = self.crew[crew_name]
+        header = f"\n[{crew_name.upper()} RESPONSE]:\n"
+        response = ""
+        started = time.perf_counter()
+        try:
+            cached = self.response_cache.get(crew_name, query) if self.response_cache else None
+            if cached is not None:
+                # The member never saw this exchange unless it can be replayed into its history
+                if replay_exchange(member, query, cached):
+                    self.response_cache.advance(crew_name, query, cached)
+                else:
+                    self.response_cache.detach(crew_name)
+                header = f"\n[{crew_name.upper()} RESPONSE] [CACHED]:\n"
+                self.sink.set_field("perf", "CACHE HIT")
+                self.output(header + "═" * (len(header) - 3) + "\n" + cached)
+                if crew_name == "code_expert":
+                    self.last_code_response = cached
+                return cached
+
+            self.set_status("PROCESSING QUERY...")
+            switch = self._switches.pop(crew_name, None)
+            warmth = self.warm_set.activate(self._warm_key(crew_name), member)
+            prompt_tokens, compacted = self.memory.prepare(crew_name, member, query)
+            if compacted:
+                self.output(f"MEMORY COMPACTED: {compacted} OLDER TURN{'S' if compacted > 1 else ''} "
+                            f"OF {crew_name.upper()} SUMMARIZED")
+                if self.response_cache:
+                    self.response_cache.advance(crew_name, ConversationMemory.SUMMARY_MARK, str(compacted))
+            self.metrics.observe("prompt_tokens", prompt_tokens, crew_name)
+            history = member_history(member)
+            kept = len(history) if history is not None else None
+            stream = stream_method(member) if self.settings["stream_responses"] and not fanout else None
+            if stream:
+                response = self._stream_response(stream, query, header, cancel, crew_name)
+                if cancel.is_set():
+                    self._forget_cancelled(crew_name, history, kept)
+            else:
+                response = member.chat(query)
+                elapsed = time.perf_counter() - started
+                self._last_first_token[crew_name] = (elapsed, "RESPONSE")
+                self.sink.set_field("perf", f"RESPONSE {elapsed:.1f}s")
+                if cancel.is_set():
+                    self.output(f"[{crew_name.upper()}] GENERATION CANCELLED")
+                    self._forget_cancelled(crew_name, history, kept)
+
+                if fanout:
+                    header = f"\n[{crew_name.upper()} RESPONSE] ({elapsed:.2f}s | PROMPT {prompt_tokens} TOKENS):\n"
+                self.sink.rendering(True)
+                self.output(header + "═" * (len(header) - 3) + "\n" + response)
+
+            if self.response_cache:
+                self.response_cache.put(crew_name, query, response)
+                self.response_cache.advance(crew_name, query, response)
+
+            # Store code responses for potential execution
+            if crew_name == "code_expert":
+                self.last_code_response = response
+
+            if not fanout:
+                context = self.memory.context_tokens
+                self.output(f"[PROMPT {prompt_tokens} TOKENS | {prompt_tokens * 100 // context}% OF {context} CONTEXT]")
+            if switch and crew_name in self._last_first_token:
+                self._report_switch(crew_name, switch, warmth)
+            self.save_session()
+
+        except CommandFailed:
+            raise
+        except Exception as e:
+            self.output(f"ERROR IN NEURAL INTERFACE: {e}")
+        finally:
+            self.sink.rendering(False)
+            self.set_status("READY FOR COMMANDS")
+        return response
+
+    def _forget_cancelled(self, crew_name, history, kept):
+        """Drop a cut-off exchange from the member's memory and fail the ask"""
+        if history is not None:
+            del history[kept:]
+        elif self.response_cache:
+            # The cut-off generation may have reached a memory we cannot trim
+            self.response_cache.detach(crew_name)
+        raise CommandFailed("generation cancelled")
+
+    def _stream_response(self, stream, query, header, cancel, crew_name=""):
+        """Render a streamed response in time-based batches; returns the full text"""
+        flush_interval = self.settings["stream_flush_ms"] / 1000
+        started = time.perf_counter()
+        first_token = None
+        tokens = 0
+        parts = []
+        pending = []
+        last_flush = started
+
+        chunks = stream(query)
+        for chunk in chunks:
+            if cancel.is_set():
+                # Closing the generator stops llama.cpp from producing more tokens
+                close = getattr(chunks, "close", None)
+                if close:
+                    close()
+                pending.append("\n[GENERATION CANCELLED]")
+                break
+            text = chunk_text(chunk)
+            if not text:
+                continue
+            now = time.perf_counter()
+            if first_token is None:
+                first_token = now - started
+                self.sink.rendering(True)
+                self.output(header + "═" * (len(header) - 3))
+                self.sink.set_field("perf", f"TTFT {first_token:.2f}s")
+            tokens += 1
+            parts.append(text)
+            pending.append(text)
+            if now - last_flush >= flush_interval:
+                self.sink.write_raw("".join(pending))
+                pending = []
+                last_flush = now
+                rate = tokens / max(1e-6, now - started - first_token)
+                self.sink.set_field("perf", f"TTFT {first_token:.2f}s | {rate:.1f} TOK/S")
+
+        if first_token is None:
+            self.output(header + "═" * (len(header) - 3))
+            first_token = time.perf_counter() - started
+        self.sink.write_raw("".join(pending) + "\n")
+        elapsed = time.perf_counter() - started
+        rate = tokens / max(1e-6, elapsed - first_token)
+        self.sink.set_field("perf", f"TTFT {first_token:.2f}s | {rate:.1f} TOK/S")
+        if tokens:
+            self._last_first_token[crew_name] = (first_token, "FIRST TOKEN")
+            self.metrics.observe("ttft", first_token, crew_name)
+            self.metrics.observe("tokens_per_sec", rate, crew_name)
+        return "".join(parts)
+
+    def _report_switch(self, crew_name, switch, warmth):
+        """Show the first answer after a USE next to the last answer before it"""
+        seconds, label = self._last_first_token[crew_name]
+        self.metrics.observe("switch_first_token", seconds, crew_name)
+        previous, before = switch
+        line = f"[SWITCH {previous.upper()} -> {crew_name.upper()}] {label} {seconds:.2f}s"
+        if warmth:
+            line += f" ({warmth.upper()} STATE)"
+        if before:
+            line += f" | BEFORE SWITCH {before[1]} {before[0]:.2f}s"
+        self.output(line)
+
+    def reset_crew(self):
+        """Reset current crew member"""
+        with self._lock:
+            if self.crew and self.current_crew in self.crew:
+                self.reset_member(self.current_crew)
+                self.last_code_response = ""
+                self.output(f"NEURAL LINK RESET: {self.current_crew.upper()}")
+            else:
+                self.output("ERROR: NO ACTIVE CREW MEMBER")
+
+    def show_stalls(self, count=10):
+        """List the longest event-loop stalls with the callback that caused each"""
+        if not self.watchdog:
+            self.output("ERROR: STALL WATCHDOG NOT RUNNING")
+            return
+        stalls = self.watchdog.worst(count)
+        if not stalls:
+            self.output(f"NO STALLS OVER {self.watchdog.threshold * 1000:.0f}MS THIS SESSION")
+            return
+        lines = [f"WORST STALLS ({self.watchdog.count} OVER {self.watchdog.threshold * 1000:.0f}MS):",
+                 "═" * 30]
+        for i, stall in enumerate(stalls, 1):
+            when = time.strftime("%H:%M:%S", time.localtime(stall["started"]))
+            lines.append(f"[{i}] {stall['seconds'] * 1000:.0f}MS AT {when} IN {stall['callback']}")
+            lines += [f"      {frame}" for frame in stall["stack"][-3:]]
+        self.output("\n".join(lines))
 
+    def list_crew(self):
+        """List available crew members"""
+        if self.crew and isinstance(self.crew, dict) and len(self.crew) > 0:
+            crew_list = [f"[{i}] {crew_name.upper()} - STATUS: {'ACTIVE' if crew_name == self.current_crew else 'STANDBY'}"
+                     for i, crew_name in enumerate(self.crew.keys(), 1)]
+            show_crew = "CREW MANIFEST:\n══════════════\n" + f"Active Crew: {self.current_crew.upper() if self.current_crew else 'NONE'}\n" + "\n".join(crew_list)
+            self.output(show_crew)
+        else:
+            self.output("ERROR: CREW DATABASE EMPTY")
 
-class TypewriterText(ScrolledText):
-    """Text widget that displays text with a typewriter effect and initial garbled text"""
-    def __init__(self, parent, **kwargs):
-        super().__init__(parent, **kwargs)
-        self.is_typing = False
-        self._typing_thread = None
-    
-    def typewrite(self, text, delay=10, callback=None, garble_duration=100, garble_speed=20):
-        """Add text with typewriter effect and initial garbled text, processing character by character"""
-        if self.is_typing:  # Prevent multiple simultaneous typing animations
+    def list_tools(self):
+        """Tool information"""
+        if self.backend_state != "ready":
+            self.output("BACKEND STILL LOADING - TRY AGAIN SHORTLY"
+                        if self.backend_state == "loading" else "ERROR: BACKEND UNAVAILABLE")
             return
-            
-        self.is_typing = True
-        
-        # Fix: Make sure text is properly prepared for line processing
-        lines = text.splitlines() if text else [""]
-        
-        def _process_lines():
-            """Process the text line by line with a proper typewriter effect"""
+        if not self._check_tools_fresh():
+            self._defer("tools")
+            return
+        lines = []
+        for tool in self.tools.tools.values():
+            args = f"({', '.join(map(str, tool['args']))})" if tool["args"] else ""
+            description = f" - {tool['description']}" if tool["description"] else ""
+            lines.append(f"  {tool['name']}{args}{description}")
+        self.output("\nTools List:\n" + "\n".join(lines))
+
+    def show_model_info(self):
+        """Display model information"""
+        model_type = "GGUF"  # Fixed to GGUF as model_choice is removed
+        model_info = f"""
+    MODEL INFORMATION:
+    ══════════════════
+    TYPE: {model_type}
+    MAX TOKENS: {self.max_tokens}
+    BACKEND: LLAMA.CPP{f" SERVER {self.server.host}:{self.server.port}" if self.server else ""}
+    STATUS: {'LOADED' if self.model is not None else 'NOT LOADED'}
+    """
+        self.output(model_info)
+
+
+class TkSink(OutputSink):
+    """Routes one session's engine output into its tab of a ClemmMatrixUI through the dispatcher"""
+    def __init__(self, app, tab):
+        self.app = app
+        self.tab = tab
+
+    def write(self, text):
+        self.app.ui.append(self.tab.output_text, text + "\n")
+
+    def write_raw(self, text):
+        self.app.ui.append(self.tab.output_text, text)
+
+    def typewrite(self, text):
+        self.tab.output_text.typewrite(text, delay=1)
+
+    def status(self, text):
+        self.app.ui.configure(self.tab.system_status, text=text)
+
+    def set_field(self, name, text):
+        label = {"crew": self.tab.crew_status, "tools": self.tab.tools_status,
+                 "queue": self.tab.queue_status, "perf": self.tab.perf_status,
+                 "connection": self.app.status_label}.get(name)
+        if label is not None:
+            self.app.ui.configure(label, text=text)
+
+    def rendering(self, active, reason="response"):
+        self.app._set_rendering(active, reason)
+
+    def confirm(self, title, message, on_answer):
+        # Dialogs must run on the Tk thread, after the output queued before them
+        self.app.ui.post(lambda: on_answer(messagebox.askyesno(title, message, icon="warning")))
+
+    def backlog(self):
+        return self.app.ui.backlog()
+
+    def page_history(self, count):
+        if not self.tab.transcript:
+            return False
+        # Earlier output must be on screen before older lines go above it
+        self.app.ui.post(self.tab.page_history, count)
+        return True
+
+    def tabs(self, action):
+        self.app.ui.post(self.app.tab_command, action)
+        return True
+
+    def search(self, terms, crew=None, since=None, limit=10):
+        transcript = self.tab.transcript
+        if not transcript or not transcript.search_index:
+            return None
+        return transcript.search(terms, crew=crew, since=since, limit=limit)
+
+    def reveal(self, line, count):
+        self.app.ui.post(self.tab.reveal, line, count)
+
+    def exit(self):
+        self.app.ui.post(lambda: self.app.after(1000, self.app.shutdown))
+
+
+class SessionTab:
+    """One terminal session in the window: output area, status bar, transcript and engine.
+
+    Only the active tab's frames are packed; the others keep running and
+    rendering off screen.
+    """
+    def __init__(self, app, name):
+        self.app = app
+        self.name = name
+        self.engine = None
+        self.transcript = None
+        if app.settings["transcript_dir"]:
             try:
-                for line in lines:
-                    self.configure(state='normal')
-                    current_pos = self.index(tk.END + "-1c")
-                    
-                    # Process each character with garbled text effect
-                    for char in line:
-                        # Add a garbled character first
-                        garbled_char = random.choice(string.ascii_letters + string.digits)
-                        self.insert(current_pos, garbled_char)
-                        self.see(tk.END)
-                        self.update_idletasks()
-                        time.sleep(garble_speed / 1000)
-                        
-                        # Replace with correct character
-                        self.delete(current_pos)
-                        self.insert(current_pos, char)
-                        self.see(tk.END)
-                        self.update_idletasks()
-                        time.sleep(delay / 1000)
-                        
-                        # Update current position
-                        current_pos = self.index(tk.END + "-1c")
-                    
-                    # Add a newline after each line
-                    self.insert(tk.END, "\n")
-                    self.see(tk.END)
-                    self.update_idletasks()
-                    time.sleep(delay / 1000)
-                    
-                    self.configure(state='disabled')
-            
-            finally:
-                self.is_typing = False
-                if callback:
-                    self.after(0, callback)
-        
-        # Start the typing process in a separate thread to prevent UI freezing
-        self._typing_thread = threading.Thread(target=_process_lines, daemon=True)
-        self._typing_thread.start()
+                self.transcript = Transcript.for_session(app.settings["transcript_dir"],
+                                                         suffix="" if name == "1" else f"-tab{name}",
+                                                         index=app.settings["transcript_index"])
+            except OSError as e:
+                print(f"Error opening transcript: {e}")
+
+        # Output text area with matrix styling
+        self.output_frame = tk.Frame(app.output_holder, bg=app.dark_green, bd=2,
+                                     relief="sunken", padx=2, pady=2)
+        self.output_text = TypewriterText(self.output_frame, dispatcher=app.ui,
+                                          scrollback_lines=app.settings["scrollback_lines"],
+                                          transcript=self.transcript, wrap='word',
+                                          highlight=app.settings["highlight_code"],
+                                          bg=app.black, fg=app.matrix_green,
+                                          insertbackground=app.matrix_green,
+                                          selectbackground=app.dark_green,
+                                          selectforeground=app.matrix_green,
+                                          font=("Courier", 11),
+                                          bd=0, padx=10, pady=10)
+        self.output_text.pack(expand=True, fill='both')
+        self.output_text.configure(state='disabled')
+        # Rain yields the UI thread while text is being rendered
+        self.output_text.on_typing = app._set_rendering
+
+        # Status bar
+        self.status_bar = tk.Frame(app.status_holder, bg=app.dark_green, height=20)
+        label = dict(bg=app.dark_green, fg=app.matrix_green, font=("Courier", 10))
+        self.crew_status = tk.Label(self.status_bar, text="NO CREW SELECTED", **label)
+        self.crew_status.pack(side="left", padx=5)
+        self.tools_status = tk.Label(self.status_bar, text="TOOLS LOADED", **label)
+        self.tools_status.pack(side="left", padx=5)
+        self.system_status = tk.Label(self.status_bar, text="SYSTEM ONLINE", **label)
+        self.system_status.pack(side="right", padx=5)
+        # Crew request queue depth of this session
+        self.queue_status = tk.Label(self.status_bar, text="QUEUE: 0", **label)
+        self.queue_status.pack(side="right", padx=5)
+        # Generation speed of the last response
+        self.perf_status = tk.Label(self.status_bar, text="", **label)
+        self.perf_status.pack(side="right", padx=5)
 
+    def show(self):
+        self.output_frame.pack(expand=True, fill='both')
+        self.status_bar.pack(fill='x')
 
+    def hide(self):
+        self.output_frame.pack_forget()
+        self.status_bar.pack_forget()
+
+    def page_history(self, count):
+        if not self.output_text.page_history(count):
+            self.app.ui.append(self.output_text, "NO OLDER HISTORY IN TRANSCRIPT\n")
+
+    def reveal(self, line, count):
+        if not self.output_text.reveal(line, count):
+            # Too far back to page in; show the block here instead
+            lines = self.transcript.read_lines(line, count)
+            self.app.ui.append(self.output_text, f"[LINE {line + 1}]\n" + "\n".join(lines) + "\n")
+
+    def close(self):
+        """Stop the engine and release the tab's widgets and transcript"""
+        if self.engine:
+            self.engine.shutdown()
+        if self.output_text.highlighter:
+            self.output_text.highlighter.shutdown()
+        if self.transcript:
+            self.transcript.close()
+        self.output_frame.destroy()
+        self.status_bar.destroy()
 
 
 class ClemmMatrixUI(tk.Tk):
-    def __init__(self, crew_instance=None, model=None, max_tokens=None, model_name="UNKNOWN_MODEL", available_tools=None):
+    def __init__(self, crew_instance=None, model=None, max_tokens=None, model_name="UNKNOWN_MODEL", available_tools=None,
+                 config=None, backend=None, script=None):
+        self._started = time.perf_counter()
         super().__init__()
         self.title("CLEMM- MATRIX TERMINAL")
         self.geometry("968x1400")
         self.configure(bg='black')
         
-        # Store backend components
+        # Every session's engine is built from these
+        self.crew_instance = crew_instance
         self.model = model
         self.max_tokens = max_tokens
         self.model_name = model_name
-        self.available_tools = available_tools if available_tools else []
-        self.crew_instance = crew_instance
+        self.settings = dict(DEFAULT_CONFIG, **(config or {}))
+        # Every widget update from a worker thread goes through this queue
+        self.ui = UIDispatcher(self, interval_ms=self.settings["ui_drain_ms"])
         
         # Matrix theme colors
         self.matrix_green = "#00ff00"
@@ -185,7 +4408,9 @@ class ClemmMatrixUI(tk.Tk):
         self.bg_frame.place(relwidth=1, relheight=1)
         
         # Matrix rain canvas in background
-        self.matrix_canvas = MatrixRain(self.bg_frame, bg=self.black, highlightthickness=0)
+        self.matrix_canvas = MatrixRain(self.bg_frame, bg=self.black, highlightthickness=0,
+                                        target_fps=self.settings["rain_target_fps"],
+                                        cpu_budget=self.settings["rain_cpu_budget"])
         self.matrix_canvas.place(relwidth=1, relheight=1)
         
         # Semi-transparent frame for content
@@ -206,20 +4431,13 @@ class ClemmMatrixUI(tk.Tk):
                                     font=("Courier", 12))
         self.status_label.pack(side="right", padx=10)
         
-        # Output text area with matrix styling
-        self.output_frame = tk.Frame(self.content_frame, bg=self.dark_green, bd=2, 
-                                   relief="sunken", padx=2, pady=2)
-        self.output_frame.pack(expand=True, fill='both', padx=10, pady=10)
-        
-        self.output_text = TypewriterText(self.output_frame, wrap='word', 
-                                         bg=self.black, fg=self.matrix_green,
-                                         insertbackground=self.matrix_green,
-                                         selectbackground=self.dark_green,
-                                         selectforeground=self.matrix_green,
-                                         font=("Courier", 11),
-                                         bd=0, padx=10, pady=10)
-        self.output_text.pack(expand=True, fill='both')
-        self.output_text.configure(state='disabled')
+        # One button per session; every session shares the loaded model
+        self.tab_bar = tk.Frame(self.content_frame, bg=self.black)
+        self.tab_bar.pack(fill='x', padx=10)
+
+        # The active session's output area goes here
+        self.output_holder = tk.Frame(self.content_frame, bg=self.black)
+        self.output_holder.pack(expand=True, fill='both', padx=10, pady=10)
         
         # Command prompt frame
         self.command_frame = tk.Frame(self.content_frame, bg=self.black)
@@ -236,60 +4454,38 @@ class ClemmMatrixUI(tk.Tk):
                                   font=("Courier", 12), relief="flat")
         self.input_entry.pack(fill='x', expand=True)
         self.input_entry.bind("<Return>", self.process_command_event)
+        self.input_entry.bind("<Tab>", self.complete_input)
+        self.input_entry.bind("<Control-Tab>", self.next_tab)
+        self.input_entry.bind("<Control-t>", lambda event: self.new_tab())
+        # Any window can fast-forward a running typewriter animation
+        self.bind("<Escape>", lambda event: self.output_text.skip(event))
+        self.bind("<Control-g>", lambda event: self.engine.cancel_requests())
+
+        # The active session's status bar goes here
+        self.status_holder = tk.Frame(self.content_frame, bg=self.dark_green)
+        self.status_holder.pack(fill='x', padx=10, pady=(0, 10))
         
-        # Status bar
-        self.status_bar = tk.Frame(self.content_frame, bg=self.dark_green, height=20)
-        self.status_bar.pack(fill='x', padx=10, pady=(0, 10))
-        
-        self.crew_status = tk.Label(self.status_bar, text="NO CREW SELECTED", 
-                                  bg=self.dark_green, fg=self.matrix_green, 
-                                  font=("Courier", 10))
-        self.crew_status.pack(side="left", padx=5)
-        
-        # Add tools status label
-        self.tools_status = tk.Label(self.status_bar, text="TOOLS LOADED", 
-                                  bg=self.dark_green, fg=self.matrix_green, 
-                                  font=("Courier", 10))
-        self.tools_status.pack(side="left", padx=5)
-        
-        self.system_status = tk.Label(self.status_bar, text="SYSTEM ONLINE", 
-                                    bg=self.dark_green, fg=self.matrix_green, 
-                                    font=("Courier", 10))
-        self.system_status.pack(side="right", padx=5)
-        
+        self.ui.start()
+
         # Animation and blinking cursor effect
         self.cursor_visible = True
         self.cursor_blink()
-        
-        # Store last code response
-        self.last_code_response = ""
-        
-        # Initialize crew and tools
-        self.crew = {}
-        self.current_crew = None
-        
-        # Load available tools
-        self.available_tools = []
 
-        try:
-            self.available_tools = list_tools()
-            self.tools_status.config(text=f"TOOLS: {len(self.available_tools)} LOADED")
-        except Exception as e:
-            self.tools_status.config(text="TOOLS: ERROR LOADING")
-            print(f"Error loading tools: {e}")
-        
-        # Initialize crew if provided
-        if crew_instance:
-            self.crew = crew_instance
-            if self.crew:
-                # Fix: Handle crew initialization properly
-                if isinstance(self.crew, dict) and len(self.crew) > 0:
-                    self.current_crew = next(iter(self.crew))
-                    self.crew_status.config(text=f"ACTIVE: {self.current_crew.upper()}")
-                else:
-                    self.crew = None
-                    self.current_crew = None
-        else:
+        self.tabs = []  # SessionTab per terminal session, the first owning the shared model state
+        self.tab = None
+        self._tab_serial = 0
+
+        self.loop_monitor = LoopMonitor(self, interval_ms=self.settings["loop_monitor_ms"], on_beat=self._on_beat)
+        self.loop_monitor.start()
+        self.watchdog = None
+        if self.settings["stall_threshold_ms"]:
+            self.watchdog = StallWatchdog(self.loop_monitor, threshold=self.settings["stall_threshold_ms"] / 1000,
+                                          on_stall=self._on_stall)
+            self.watchdog.start()
+
+        # All command logic lives in the engines, one per session; this window is one frontend
+        self.new_tab(crew_instance=crew_instance, backend=backend)
+        if not crew_instance:
             # Initialize the system in a separate thread
             threading.Thread(target=self.initialize_system, daemon=True).start()
         
@@ -300,33 +4496,154 @@ class ClemmMatrixUI(tk.Tk):
         
         crew_menu = tk.Menu(menubar, tearoff=0, bg=self.black, fg=self.matrix_green,
                           activebackground=self.dark_green, activeforeground=self.matrix_green)
-        crew_menu.add_command(label="RESET CREW", command=self.reset_crew)
-        crew_menu.add_command(label="LIST CREW", command=self.list_crew)
+        crew_menu.add_command(label="RESET CREW", command=lambda: self.engine.reset_crew())
+        crew_menu.add_command(label="LIST CREW", command=lambda: self.engine.list_crew())
         menubar.add_cascade(label="CREW", menu=crew_menu)
         
         # Add Tools menu
         tools_menu = tk.Menu(menubar, tearoff=0, bg=self.black, fg=self.matrix_green,
                            activebackground=self.dark_green, activeforeground=self.matrix_green)
-        tools_menu.add_command(label="LIST TOOLS", command=self.list_tools)
+        tools_menu.add_command(label="LIST TOOLS", command=lambda: self.engine.list_tools())
         menubar.add_cascade(label="TOOLS", menu=tools_menu)
         
         # Add Model info menu
         model_menu = tk.Menu(menubar, tearoff=0, bg=self.black, fg=self.matrix_green,
                            activebackground=self.dark_green, activeforeground=self.matrix_green)
-        model_menu.add_command(label="MODEL INFO", command=self.show_model_info)
+        model_menu.add_command(label="MODEL INFO", command=lambda: self.engine.show_model_info())
         menubar.add_cascade(label="MODEL", menu=model_menu)
         
+        self.engine.mark_startup("ui_built")
+
         # Boot sequence - make sure to run this AFTER UI setup is complete
-        self.after(500, self.boot_sequence)
+        self.after_idle(self.boot_sequence)
         
-        # Start matrix rain effect after a short delay
-        self.after(1000, self.matrix_canvas.start_animation)
+        # Start matrix rain effect once the window has its real size
+        self.after(300, self.matrix_canvas.start_animation)
         
         # Focus on input entry after initialization
-        self.after(2000, lambda: self.input_entry.focus_set())
-    
+        self.after_idle(self.input_entry.focus_set)
+
+        if script:
+            # Commands needing the backend wait for it inside the engine
+            self.after_idle(self.engine.source, script)
+
+    @property
+    def engine(self):
+        return self.tab.engine
+
+    @property
+    def output_text(self):
+        return self.tab.output_text
+
+    @property
+    def transcript(self):
+        return self.tab.transcript
+
+    def new_tab(self, crew_instance=None, backend=None):
+        """Open a session on the shared model and switch to it; the first one owns the shared parts"""
+        self._tab_serial += 1
+        tab = SessionTab(self, str(self._tab_serial))
+        parent = self.tabs[0].engine if self.tabs else None
+        if parent is not None and self.crew_instance:
+            # Same crew and model, separate conversations
+            crew_instance = {name: fork_member(member) for name, member in self.crew_instance.items()}
+        tab.engine = CommandEngine(TkSink(self, tab), crew_instance=crew_instance, model=self.model,
+                                   max_tokens=self.max_tokens, model_name=self.model_name, config=self.settings,
+                                   backend=backend, started=self._started, parent=parent, session=tab.name)
+        tab.engine.watchdog = self.watchdog
+        tab.engine.metrics.add_source(self._render_gauges)
+        self.tabs.append(tab)
+        self.switch_tab(tab)
+        tab.engine.start()
+        if parent is not None:
+            tab.engine.output(f"SESSION {tab.name} ONLINE. SHARING MODEL {self.model_name}. "
+                              "TYPE 'HELP' FOR AVAILABLE COMMANDS.")
+        return tab
+
+    def switch_tab(self, tab):
+        if self.tab is not None:
+            self.tab.hide()
+        self.tab = tab
+        tab.show()
+        self._render_tab_bar()
+
+    def next_tab(self, event=None):
+        if len(self.tabs) > 1:
+            self.switch_tab(self.tabs[(self.tabs.index(self.tab) + 1) % len(self.tabs)])
+        return "break"
+
+    def close_tab(self, tab=None):
+        tab = tab or self.tab
+        if len(self.tabs) == 1:
+            self.append_output("ERROR: CANNOT CLOSE THE LAST SESSION")
+            return
+        if tab is self.tabs[0]:
+            # The other sessions run on its server, scheduler and warm set
+            self.append_output(f"ERROR: SESSION {tab.name} OWNS THE SHARED MODEL STATE AND CANNOT BE CLOSED")
+            return
+        index = self.tabs.index(tab)
+        self.tabs.remove(tab)
+        if tab is self.tab:
+            self.tab = None
+            self.switch_tab(self.tabs[min(index, len(self.tabs) - 1)])
+        else:
+            self._render_tab_bar()
+        tab.close()
+
+    def tab_command(self, action):
+        """TAB with no argument lists the sessions; NEW, CLOSE or a session name acts on them"""
+        if action == "new":
+            self.new_tab()
+        elif action == "close":
+            self.close_tab()
+        elif action:
+            tab = next((tab for tab in self.tabs if tab.name == action), None)
+            if tab is None:
+                self.append_output(f"ERROR: NO SESSION '{action.upper()}'")
+            else:
+                self.switch_tab(tab)
+        else:
+            stats = self.engine.scheduler.session_stats()
+            for tab in self.tabs:
+                counts = stats.get(tab.name, {})
+                crew = (tab.engine.current_crew or "NONE").upper()
+                self.append_output(f"SESSION {tab.name}{' (ACTIVE)' if tab is self.tab else ''}: {crew} | "
+                                   f"{counts.get('running', 0)} RUNNING, {counts.get('queued', 0)} QUEUED")
+
+    def _render_tab_bar(self):
+        for child in self.tab_bar.winfo_children():
+            child.destroy()
+        style = dict(fg=self.matrix_green, activebackground=self.dark_green,
+                     activeforeground=self.matrix_green, bd=0, relief="flat")
+        for tab in self.tabs:
+            active = tab is self.tab
+            tk.Button(self.tab_bar, text=f" SESSION {tab.name} ", command=lambda tab=tab: self.switch_tab(tab),
+                      bg=self.dark_green if active else self.black,
+                      font=("Courier", 10, "bold" if active else "normal"), **style).pack(side="left", padx=(0, 4))
+        tk.Button(self.tab_bar, text=" + ", command=self.new_tab, bg=self.black,
+                  font=("Courier", 10, "bold"), **style).pack(side="left")
+
+    def complete_input(self, event=None):
+        """Tab completion of command words, tool names and crew names"""
+        text = self.input_entry.get()
+        head, _, last = text.rpartition(" ")
+        candidates = self.engine.completions(text)
+
+        if len(candidates) == 1:
+            completion = candidates[0] + " "
+        elif candidates:
+            completion = os.path.commonprefix(candidates)
+            self.append_output("  ".join(candidates))
+        else:
+            return "break"
+        if len(completion.rstrip()) >= len(last):
+            self.input_entry.delete(0, tk.END)
+            self.input_entry.insert(0, (head + " " if head else "") + completion)
+        return "break"
+
     def boot_sequence(self):
         """Display Matrix-style boot sequence"""
+        self.engine.mark_startup("window_shown")
         welcome_text = """
 
 
@@ -351,12 +4668,33 @@ class ClemmMatrixUI(tk.Tk):
         """
         
          # Clear output text area first
-        self.output_text.configure(state='normal')
-        self.output_text.delete(1.0, tk.END)
-        self.output_text.configure(state='disabled')
+        self.output_text.clear()
         self.output_text.typewrite(welcome_text, delay=5, callback=lambda: self.append_output(
             "SYSTEM READY. TYPE 'HELP' FOR AVAILABLE COMMANDS."))
 
+    def _on_beat(self, lag):
+        for tab in self.tabs:
+            tab.engine.metrics.observe("loop_lag", lag)
+        if self.watchdog:
+            self.watchdog.beat(lag)
+
+    def _on_stall(self, stall):
+        for tab in list(self.tabs):
+            tab.engine.metrics.observe("stall", stall["seconds"])
+
+    def _render_gauges(self):
+        rain = self.matrix_canvas
+        return {"rain_fps": rain.fps, "rain_frame_ms": rain.frame_time * 1000,
+                "rain_density": rain.density, "rain_paused": rain.paused or not rain.active,
+                "loop_lag_ms": self.loop_monitor.lag * 1000}
+
+    def _set_rendering(self, rendering, reason="typing"):
+        """Pause the background rain while output is being rendered"""
+        if rendering:
+            self.matrix_canvas.pause(reason)
+        else:
+            self.matrix_canvas.resume(reason)
+
     def cursor_blink(self):
         """Create blinking cursor effect in input field"""
         if self.cursor_visible:
@@ -383,14 +4721,15 @@ class ClemmMatrixUI(tk.Tk):
             time.sleep(0.5)
         
         self.append_output("INITIALIZATION COMPLETE. SYSTEM READY.")
-        self.system_status.config(text="READY FOR COMMANDS")
+        self.set_status("READY FOR COMMANDS")
     
     def append_output(self, text):
-        """Add text to output directly"""
-        self.output_text.configure(state='normal')
-        self.output_text.insert(tk.END, text + "\n")
-        self.output_text.see(tk.END)
-        self.output_text.configure(state='disabled')
+        """Queue a line for the output area; safe to call from any thread"""
+        self.ui.append(self.output_text, text + "\n")
+
+    def set_status(self, text):
+        """Update the active session's status bar; safe to call from any thread"""
+        self.ui.configure(self.tab.system_status, text=text)
        # if not text:
         #    return
         #self.output_text.configure(state='normal') 
@@ -413,277 +4752,92 @@ class ClemmMatrixUI(tk.Tk):
         self.append_output(f"> {command}")
         self.input_entry.delete(0, tk.END)
         
-        # Process with some visual effects
-        self.system_status.config(text="PROCESSING...")
-        self.after(200, lambda: self.execute_command(command))
+        self.set_status("PROCESSING...")
+        self.execute_command(command)
     
     def execute_command(self, command):
-        """Execute the command with Matrix flair"""
-        command_lower = command.lower()
-        print(f"Executing command: {command_lower}")  # Debug print
-        
-        if command_lower == "exit":
-            self.append_output("DISCONNECTING FROM MATRIX...")
-            if self.model.get("type") == "server":
-                self.append_output("Terminating server process...")
-                self.model["process"].terminate()  
-            self.after(1000, self.quit)
-        
-        elif command_lower == "help":
-            self.output_text.configure(state='normal')
-            help_text = """
-AVAILABLE COMMANDS:
-===================
-HELP       - ACCESS THIS INFORMATION NODE
-EXIT       - TERMINATE NEURAL CONNECTION
-STATUS     - DISPLAY SYSTEM DIAGNOSTICS
-DESTINATION - REVEAL CURRENT MISSION COORDINATES
-MODEL_INFO - DISPLAY ACTIVE MODEL CONFIGURATION
-ASK [QUERY] - INTERROGATE CREW KNOWLEDGE BASE
-CREW       - LIST AVAILABLE CREW MEMBERS
-TOOLS      - LIST AVAILABLE SPECIALIZED TOOLS
-USE [NAME] - SWITCH ACTIVE CREW MEMBER
-RESET      - PURGE CONVERSATION MEMORY
-RUN_TOOL [TOOL_NAME] - EXECUTE SPECIALIZED TOOLS
-RUN_CODE   - EXECUTE LAST GENERATED CODE SEQUENCE
-"""
-            #self.output_text.insert(tk.END, help_text + "\n")
-            #self.output_text.see(tk.END)
-            #self.output_text.configure(state='disabled')
-            self.output_text.configure(state='normal')
-            self.output_text.typewrite(help_text, delay=1, 
-                                      callback=lambda: self.output_text.see(tk.END))
-
-        
-        elif command_lower == "status":
-            model_type = "GGUF"
-            status_text = f"""
-╔════════════════════════════════════════╗
-║ SYSTEM STATUS: ALL SYSTEMS OPERATIONAL ║
-╠════════════════════════════════════════╣
-║ QUANTUM CORE................ ONLINE    ║
-║ NEURAL INTERFACE............ ACTIVE    ║
-║ CREW CONNECTION............. {"STABLE" if self.crew else "OFFLINE"}    ║
-║ ENCRYPTION PROTOCOLS........ SECURE    ║
-║ LIFE SUPPORT................ NOMINAL   ║
-║ MODEL TYPE....................... {model_type} ║
-║ TOOLS............................ {len(self.available_tools) if self.available_tools else "N/A"}    ║
-╚════════════════════════════════════════╝
-  Active Crew: {self.current_crew.upper() if self.current_crew else "NONE"}
-"""
-            #self.output_text.configure(state='normal')
-            #self.output_text.delete(1.0, tk.END)
-            #self.output_text.configure(state='disabled')
-            self.output_text.configure(state='normal')
-            self.output_text.typewrite(status_text, delay=1, 
-                              callback=lambda: self.output_text.see(tk.END))
-            
-
-        
-        elif command_lower == "destination":
-            dest_text = """
-TARGET: EUROPA (JUPITER II)
-MISSION: SUBSURFACE EXPLORATION
-ETA: 267 DAYS 14 HOURS
-STATUS: ON COURSE
-"""         
-            self.output_text.configure(state='normal')
-            self.output_text.typewrite(dest_text, delay=1, 
-                                      callback=lambda: self.output_text.see(tk.END))
-            #self.append_output(dest_text)
-        
-        elif command_lower in ["crew", "list crew"]:
-            self.list_crew()
-        
-        elif command_lower in ["tools", "list tools"]:
-            self.list_tools()
-        
-        elif command_lower in ["model_info", "model info"]:
-            self.show_model_info()
-        
-        elif command_lower.startswith("use "):
-            crew_name = command[4:].strip()
-            if self.crew and crew_name in self.crew:
-                self.current_crew = crew_name
-                self.crew[crew_name].reset()
-                self.last_code_response = ""
-                self.append_output(f"SWITCHING NEURAL LINK: {crew_name.upper()}")
-                self.crew_status.config(text=f"ACTIVE: {crew_name.upper()}")
-            else:
-                self.append_output(f"ERROR: CREW MEMBER '{crew_name.upper()}' NOT FOUND IN DATABASE")
-        
-        elif command_lower == "reset":
-            if self.crew and self.current_crew in self.crew:
-                self.crew[self.current_crew].reset()
-                self.last_code_response = ""
-                self.append_output(f"MEMORY PURGE COMPLETE: {self.current_crew.upper()}")
-            else:
-                self.append_output("ERROR: NO CREW MEMBER ACTIVE")
-        
-        elif command_lower.startswith("ask "):
-            query = command[4:].strip()
-            if not query:
-                self.append_output("ERROR: QUERY PARAMETER REQUIRED")
-                return
-            
-            if self.crew and self.current_crew in self.crew:
-                self.append_output(f"PROCESSING QUERY THROUGH {self.current_crew.upper()}...")
-                threading.Thread(target=self.process_ask, args=(query,), daemon=True).start()
-            else:
-                self.append_output("ERROR: NO ACTIVE CREW MEMBER")
-        
-        elif command_lower.startswith("run_tool"):
-            parts = command.split(maxsplit=1)
-            if len(parts) < 2:
-                self.append_output("ERROR: TOOL IDENTIFIER REQUIRED")
-                return
-            
-            tool_name = parts[1].strip()
-            self.append_output(f"EXECUTING TOOL: '{tool_name.upper()}'")
-            self.system_status.config(text="RUNNING TOOL...")
-            
-            # Run in a separate thread to prevent UI freezing
-            threading.Thread(target=self.execute_tool, args=(tool_name,), daemon=True).start()
-        
-        elif command_lower == "run_code":
-            if self.current_crew == "code_expert" and self.last_code_response:
-                self.append_output("\n⚠ SECURITY WARNING ⚠")
-                self.append_output("UNAUTHORIZED CODE EXECUTION DETECTED")
-                self.append_output("REVIEW BEFORE PROCEEDING:\n")
-                self.append_output(self.last_code_response)
-                
-                def show_confirm_dialog():
-                    confirm = messagebox.askyesno(
-                        "EXECUTE CODE?", 
-                        "EXECUTE POTENTIALLY DANGEROUS CODE SEQUENCE?",
-                        icon="warning"
-                    )
-                    if confirm:
-                        try:
-                            self.append_output("\n--- EXECUTING CODE SEQUENCE ---")
-                            process = subprocess.run(
-                                ['python', '-c', self.last_code_response],
-                                capture_output=True, text=True, check=False
-                            )
-                            if process.returncode == 0:
-                                self.append_output("--- EXECUTION SUCCESSFUL ---")
-                                self.append_output(process.stdout)
-                            else:
-                                self.append_output("--- EXECUTION ERROR ---")
-                                self.append_output(process.stderr)
-                        except Exception as e:
-                            self.append_output(f"FATAL ERROR: {e}")
-                    else:
-                        self.append_output("CODE EXECUTION ABORTED")
-                
-                self.after(500, show_confirm_dialog)
-            else:
-                self.append_output("ERROR: NO CODE SEQUENCE AVAILABLE")
-        
-        else:
-            self.append_output("COMMAND NOT RECOGNIZED")
-            self.append_output("TYPE 'HELP' FOR COMMAND LIST")
-        
-        self.system_status.config(text="READY FOR COMMANDS")
-    
-    def execute_tool(self, tool_name):
-        """Execute a tool in a separate thread"""
-        try:
-            result = run_tool(tool_name, crew_instance=self.crew)
-            self.append_output(f"TOOL EXECUTION COMPLETE")
-            self.append_output(f"RESULT: {result}")
-            
-            # If there's an active crew, send the result back for processing
-           # if self.crew and self.current_crew in self.crew:
-            #    feedback_response = self.crew[self.current_crew].chat(f"Tool execution result: {result}")
-             #   if not isinstance(feedback_response, str) or not feedback_response.lower().startswith("run_tool"):
-              #      self.append_output(f"CREW ANALYSIS: {feedback_response}")
-            
-        except Exception as e:
-            self.append_output(f"ERROR IN TOOL EXECUTION: {e}")
-        
-        self.system_status.config(text="READY FOR COMMANDS")
+        """Hand the command to the engine; returns its completion Future"""
+        print(f"Executing command: {command.lower()}")  # Debug print
+        return self.engine.execute(command)
 
-    def process_ask(self, query):
-        """Process an ask command with animation"""
-        try:
-            self.system_status.config(text="PROCESSING QUERY...")
-            response = self.crew[self.current_crew].chat(query)
-            
-            header = f"\n[{self.current_crew.upper()} RESPONSE]:\n"
-            self.append_output(header + "═" * (len(header) - 3))
-            self.append_output(response)
-            
-            # Store code responses for potential execution
-            if self.current_crew == "code_expert":
-                self.last_code_response = response
-                
-        except Exception as e:
-            self.append_output(f"ERROR IN NEURAL INTERFACE: {e}")
-        finally:
-            self.system_status.config(text="READY FOR COMMANDS") 
-                
-    def reset_crew(self):
-        """Reset current crew member"""
-        if self.crew and self.current_crew in self.crew:
-            self.crew[self.current_crew].reset()
-            self.last_code_response = ""
-            self.append_output(f"NEURAL LINK RESET: {self.current_crew.upper()}")
-        else:
-            self.append_output("ERROR: NO ACTIVE CREW MEMBER")
-    
-    def list_crew(self):
-        """List available crew members"""
-        if self.crew and isinstance(self.crew, dict) and len(self.crew) > 0:
-            crew_list = [f"[{i}] {crew_name.upper()} - STATUS: {'ACTIVE' if crew_name == self.current_crew else 'STANDBY'}"
-                     for i, crew_name in enumerate(self.crew.keys(), 1)]
-            show_crew = "CREW MANIFEST:\n══════════════\n" + f"Active Crew: {self.current_crew.upper() if self.current_crew else 'NONE'}\n" + "\n".join(crew_list)
-            self.append_output(show_crew)
-        else:
-            self.append_output("ERROR: CREW DATABASE EMPTY")
-    
+    def shutdown(self):
+        """Close every session, the first (which owns the shared parts) last, and leave the main loop"""
+        if self.watchdog:
+            self.watchdog.stop()
+        for tab in reversed(self.tabs):
+            tab.close()
+        self.tabs = []
+        self.quit()
 
-    def list_tools(self):
-        """Tool information"""
-        tools_list = list_tools()
-        show_tools = "\nTools List: " + ", ".join(tools_list)
-        self.append_output(show_tools)
 
+def run_headless(model=None, crew_instance=None, max_tokens=None, config=None, commands=None,
+                 sink=None, backend=None, script=None):
+    """Drive the command engine without Tk, one command at a time.
 
-    
-    def show_model_info(self):
-        """Display model information"""
-        model_type = "GGUF"  # Fixed to GGUF as model_choice is removed
-        model_info = f"""
-    MODEL INFORMATION:
-    ══════════════════
-    TYPE: {model_type}
-    MAX TOKENS: {self.max_tokens}
-    BACKEND: LLAMA.CPP
-    STATUS: {'LOADED' if self.model is not None else 'NOT LOADED'}
+    commands is any iterable of command lines (stdin by default); each command
+    finishes before the next starts and there are no animation delays.
+    With script, that file is run pipelined as by SOURCE instead.
+    Returns the engine so callers can inspect its state.
     """
-        self.append_output(model_info)
+    model_name = getattr(model, 'model_path', 'Unknown GGUF Model')
+    if isinstance(model_name, str) and '/' in model_name:
+        model_name = os.path.basename(model_name)
+    engine = CommandEngine(sink or StreamSink(), crew_instance=crew_instance, model=model,
+                           max_tokens=max_tokens, model_name=model_name, config=config, backend=backend)
+    engine.start()
+    if script:
+        try:
+            engine.source(script).result()
+        except CommandFailed:
+            pass
+        engine.shutdown()
+        return engine
+    for line in (sys.stdin if commands is None else commands):
+        command = line.strip()
+        if not command or command.startswith("#"):
+            continue
+        try:
+            engine.execute(command).result()
+        except CommandFailed:
+            pass
+        if command.lower() == "exit":
+            break
+    else:
+        engine.shutdown()
+    return engine
 
 
-def launch_matrix_ui(model, crew_instance, max_tokens):
+def launch_matrix_ui(model, crew_instance, max_tokens, config=None, script=None):
     model_name = getattr(model, 'model_path', 'Unknown GGUF Model')
     if isinstance(model_name, str) and '/' in model_name:
         import os
         model_name = os.path.basename(model_name)
     #tokenizer_name = "N/A (GGUF)"
-    available_tools = list_tools() if 'list_tools' in globals() else []
+    # Tools are listed by the UI on a background thread after the window is up
+    available_tools = []
     app = ClemmMatrixUI(
         crew_instance=crew_instance,
         model=model,
         max_tokens=max_tokens,
         model_name=model_name,
         #tokenizer_name=tokenizer_name,
-        available_tools=available_tools
+        available_tools=available_tools,
+        config=config,
+        script=script
     )
     app.mainloop()
 
 if __name__ == "__main__":
-    # If you run this file directly without passing a preloaded crew,
-    # the UI will initialize the system as before.
-    app = ClemmMatrixUI()
-    app.mainloop()
+    import argparse
+    parser = argparse.ArgumentParser(description="CLEMM matrix terminal")
+    parser.add_argument("--headless", action="store_true", help="read commands from stdin instead of opening a window")
+    parser.add_argument("--jsonl", action="store_true", help="with --headless, emit JSON lines instead of plain text")
+    parser.add_argument("--script", help="run this file of commands at startup, as SOURCE does")
+    args = parser.parse_args()
+    if args.headless:
+        run_headless(sink=JsonLinesSink() if args.jsonl else StreamSink(), script=args.script)
+    else:
+        # If you run this file directly without passing a preloaded crew,
+        # the UI will initialize the system as before.
+        app = ClemmMatrixUI(script=args.script)
+        app.mainloop()
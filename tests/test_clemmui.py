@@ -0,0 +1,387 @@
+"""Tests for clemmui that run without a display"""
+import importlib.util
+import os
+import sys
+import types
+from unittest import mock
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import clemmui  # noqa: E402
+
+
+class FakeWidget(mock.MagicMock):
+    """Stand-in for every Tk widget: accepts any options, records nothing useful"""
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+
+    def _get_child_mock(self, **kwargs):
+        return mock.MagicMock(**kwargs)
+
+
+class FakeTk:
+    """Stand-in for tk.Tk; like the real one, unknown attributes raise AttributeError"""
+    def __init__(self):
+        pass
+
+    def _noop(self, *args, **kwargs):
+        return None
+
+    title = geometry = configure = config = bind = protocol = quit = mainloop = after_cancel = _noop
+
+    def after(self, ms, func=None, *args):
+        return "after#0"
+
+    def after_idle(self, func, *args):
+        return "after#0"
+
+    def winfo_toplevel(self):
+        return self
+
+    def __getattr__(self, name):
+        raise AttributeError(name)
+
+
+@pytest.fixture
+def fake_tk_clemmui(monkeypatch):
+    """clemmui loaded against a stubbed tkinter, as a separate module"""
+    tkinter = types.ModuleType("tkinter")
+    tkinter.Tk = FakeTk
+    for name in ("Frame", "Label", "Entry", "Button", "Menu", "Canvas"):
+        setattr(tkinter, name, type(name, (FakeWidget,), {}))
+    tkinter.END = "end"
+    tkinter.TclError = RuntimeError
+    scrolledtext = types.ModuleType("tkinter.scrolledtext")
+    scrolledtext.ScrolledText = type("ScrolledText", (FakeWidget,), {})
+    tkinter.messagebox = types.ModuleType("tkinter.messagebox")
+    tkinter.simpledialog = types.ModuleType("tkinter.simpledialog")
+    tkinter.scrolledtext = scrolledtext
+    for name, module in (("tkinter", tkinter), ("tkinter.scrolledtext", scrolledtext),
+                         ("tkinter.messagebox", tkinter.messagebox),
+                         ("tkinter.simpledialog", tkinter.simpledialog)):
+        monkeypatch.setitem(sys.modules, name, module)
+    spec = importlib.util.spec_from_file_location("clemmui_fake_tk", os.path.join(ROOT, "clemmui.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Member:
+    def __init__(self):
+        self.history = [{"role": "system", "content": "You are a pilot."}]
+
+    def chat(self, query):
+        return "answer to " + query
+
+    def reset(self):
+        self.history = self.history[:1]
+
+
+def offline_config(tmp_path, **overrides):
+    config = {"response_cache": False, "session_dir": None, "code_prewarm": False,
+              "transcript_dir": str(tmp_path), "prefill_crew": False}
+    config.update(overrides)
+    return config
+
+
+def test_ui_builds_and_opens_tabs(fake_tk_clemmui, tmp_path):
+    crew = {"pilot": Member(), "doc": Member()}
+    backend = fake_tk_clemmui.Backend(list_tools=lambda: [], run_tool=lambda *args, **kwargs: None)
+    app = fake_tk_clemmui.ClemmMatrixUI(crew_instance=crew, model=None, max_tokens=1024, model_name="TEST",
+                                        config=offline_config(tmp_path), backend=backend)
+    try:
+        assert app.engine.crew is crew
+        second = app.new_tab()
+        assert app.tab is second and second.engine.parent is app.tabs[0].engine
+        assert second.engine.crew["pilot"] is not crew["pilot"]
+        assert second.engine.scheduler is app.tabs[0].engine.scheduler
+        app.close_tab(app.tabs[0])
+        assert len(app.tabs) == 2
+        app.close_tab(second)
+        assert len(app.tabs) == 1
+    finally:
+        app.shutdown()
+
+
+def test_concurrent_session_saves_stay_whole(tmp_path, capsys):
+    memory = clemmui.ConversationMemory(4096, directory=str(tmp_path), model_name="TEST")
+    crew = {name: Member() for name in ("pilot", "doc", "navigator")}
+
+    def answer_and_save(name):
+        for turn in range(40):
+            crew[name].history.append({"role": "user", "content": f"{name} question {turn}"})
+            memory.save(crew, current_crew=name)
+
+    threads = [clemmui.threading.Thread(target=answer_and_save, args=(name,)) for name in crew]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert "Error saving session" not in capsys.readouterr().out
+    assert [path.name for path in tmp_path.iterdir()] == [os.path.basename(memory.path)]
+    saved = clemmui.json.loads(open(memory.path, encoding="utf-8").read())
+    assert len(saved["crew"]["pilot"]["history"]) == 41
+
+
+class FakeRoot:
+    def after(self, ms, func=None, *args):
+        return "after#0"
+
+
+def make_typewriter(module, ui, transcript=None):
+    """A TypewriterText whose Tk text is a plain string"""
+    widget = module.TypewriterText(None, dispatcher=ui, transcript=transcript)
+    widget.shown = ""
+
+    def insert(index, text):
+        widget.shown += text
+
+    def delete(start, end=None):
+        # Only the garbled tail is ever deleted, as "end-<n+1>c" .. "end-1c"
+        widget.shown = widget.shown[:-(int(start[4:-1]) - 1)]
+
+    widget.insert = insert
+    widget.delete = delete
+    return widget
+
+
+def test_appends_during_typing_keep_their_order(fake_tk_clemmui, tmp_path):
+    transcript = fake_tk_clemmui.Transcript(str(tmp_path / "session.log"))
+    ui = fake_tk_clemmui.UIDispatcher(FakeRoot())
+    text = make_typewriter(fake_tk_clemmui, ui, transcript)
+    text.typewrite("HELP", delay=1)
+    ui._drain()
+    assert text.is_typing
+    ui.append(text, "> STATUS\n")
+    text.typewrite("STATUS-BOX", delay=1)
+    ui._drain()
+    for _ in range(1000):
+        if not text._jobs:
+            break
+        text._tick()
+    assert text.shown == "HELP\n> STATUS\nSTATUS-BOX\n"
+    transcript.close()
+    assert (tmp_path / "session.log").read_text() == "HELP\n> STATUS\nSTATUS-BOX\n"
+
+
+class CollectingSink(clemmui.OutputSink):
+    """Sink keeping every line written, with a backlog the test controls"""
+    def __init__(self):
+        self.lines = []
+        self.busy = clemmui.threading.Event()
+
+    def write(self, text):
+        self.lines.extend(text.split("\n"))
+
+    def backlog(self):
+        return 1 if self.busy.is_set() else 0
+
+
+def quiet_engine(sink, tmp_path, crew=None, **config):
+    engine = clemmui.CommandEngine(sink, crew_instance=crew, max_tokens=1024,
+                                   config=offline_config(tmp_path, transcript_dir=None, **config),
+                                   backend=clemmui.Backend(list_tools=lambda: [], run_tool=lambda *a, **k: None))
+    return engine
+
+
+def test_big_results_stream_in_background_and_stay_expandable(tmp_path):
+    sink = CollectingSink()
+    engine = quiet_engine(sink, tmp_path, tool_preview_lines=5, tool_preview_chars=10000)
+    try:
+        sink.busy.set()
+        first = engine.show_result("scan", "\n".join(f"scan {i}" for i in range(100)))
+        # The caller (the tool batch's coordinator) is not held up by a busy frontend
+        assert not first.done()
+        sink.busy.clear()
+        assert first.result(timeout=5)
+        assert engine.show_result("probe", "\n".join(f"probe {i}" for i in range(100))).result(timeout=5)
+        assert "[RESULT #2 TRUNCATED" in sink.lines[-1]
+        assert engine.expand_result(1).result(timeout=5)
+        assert "scan 99" in sink.lines and "probe 99" not in sink.lines
+        assert engine.expand_result().result(timeout=5)
+        assert "probe 99" in sink.lines
+        assert engine.expand_result().exception() is not None
+    finally:
+        engine.shutdown()
+
+
+def test_scheduler_alternates_sessions_on_a_shared_model():
+    scheduler = clemmui.CrewScheduler(max_inflight=1)
+    model = object()
+    member = types.SimpleNamespace(model=model)
+    gate = clemmui.threading.Event()
+    order = []
+
+    def job(label):
+        def run(cancel):
+            gate.wait(5)
+            order.append(label)
+        return run
+
+    jobs = [scheduler.submit("pilot", member, job(f"A{i}"), session="A") for i in range(3)]
+    jobs += [scheduler.submit("doc", member, job(f"B{i}"), session="B") for i in range(2)]
+    assert scheduler.counts("A") == (2, 1) and scheduler.counts("B") == (2, 0)
+    gate.set()
+    for submitted in jobs:
+        submitted.future.result(timeout=5)
+    assert order == ["A0", "B0", "A1", "B1", "A2"]
+    # Stats are recorded just after each future resolves
+    deadline = clemmui.time.monotonic() + 5
+    while scheduler.counts() != (0, 0) and clemmui.time.monotonic() < deadline:
+        clemmui.time.sleep(0.01)
+    stats = scheduler.session_stats()
+    assert stats["A"]["done"] == 3 and stats["B"]["done"] == 2
+
+
+def test_script_steps_are_echoed_before_their_output(tmp_path):
+    script = tmp_path / "steps.clemm"
+    script.write_text("destination\n# comment\nwait\nhelp\n")
+    sink = CollectingSink()
+    engine = quiet_engine(sink, tmp_path)
+    try:
+        summary = engine.source(str(script)).result(timeout=5)
+    finally:
+        engine.shutdown()
+    assert summary["steps"] == 2
+    assert sink.lines.index("> destination") < sink.lines.index("TARGET: EUROPA (JUPITER II)")
+    assert sink.lines.index("TARGET: EUROPA (JUPITER II)") < sink.lines.index("> help")
+    assert "> wait" not in sink.lines and "> # comment" not in sink.lines
+
+
+def test_server_health_and_slots_survive_a_garbled_reply():
+    import socket
+
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(4)
+
+    def serve():
+        for _ in range(2):
+            conn, _ = listener.accept()
+            conn.recv(65536)
+            conn.sendall(b"garbage\r\n\r\n")
+            conn.close()
+
+    server = clemmui.threading.Thread(target=serve, daemon=True)
+    server.start()
+    client = clemmui.LlamaServerClient(f"http://127.0.0.1:{listener.getsockname()[1]}")
+    try:
+        state, _ = client.health()
+        assert state == "down"
+        assert client._pool.empty()
+        assert client.fetch_slots() is None
+        assert client._pool.empty()
+    finally:
+        listener.close()
+
+
+def test_ask_header_comes_first_and_sequential_asks_do_not_queue(tmp_path):
+    sink = CollectingSink()
+    engine = quiet_engine(sink, tmp_path, crew={"pilot": Member()}, stream_responses=False,
+                          response_cache=True, response_cache_path=None)
+    try:
+        for _ in range(20):
+            # The repeats are answered from the cache, as fast as a reply can be
+            engine.execute("ask status report").result(timeout=5)
+    finally:
+        engine.shutdown()
+    headers = [n for n, line in enumerate(sink.lines) if line.startswith("PROCESSING QUERY THROUGH PILOT")]
+    answers = [n for n, line in enumerate(sink.lines) if line.startswith("[PILOT RESPONSE]")]
+    assert not [line for line in sink.lines if line.startswith("QUERY QUEUED")]
+    assert len(headers) == len(answers) == 20
+    assert all(header < answer for header, answer in zip(headers, answers))
+
+
+class StreamingCoder(Member):
+    """Streams its answer, pausing after the first chunk until released"""
+    def __init__(self):
+        super().__init__()
+        self.started = clemmui.threading.Event()
+        self.release = clemmui.threading.Event()
+
+    def stream_chat(self, query):
+        self.history.append({"role": "user", "content": query})
+        self.history.append({"role": "assistant", "content": ""})
+        yield "print('half"
+        self.started.set()
+        self.release.wait(5)
+        yield " done')"
+
+
+def test_cancelled_stream_is_forgotten_and_fails_the_ask(tmp_path):
+    sink = CollectingSink()
+    coder = StreamingCoder()
+    engine = quiet_engine(sink, tmp_path, crew={"code_expert": coder})
+    try:
+        job = engine.execute("ask code_expert write a script")
+        assert coder.started.wait(5)
+        engine.execute("cancel")
+        coder.release.set()
+        with pytest.raises(clemmui.CommandFailed):
+            job.result(timeout=5)
+    finally:
+        engine.shutdown()
+    assert engine.last_code_response == ""
+    assert coder.history == [{"role": "system", "content": "You are a pilot."}]
+    assert "[GENERATION CANCELLED]" in sink.lines
+
+
+class SharedModelMember(Member):
+    """Crew member on a shared model whose prefill blocks until released"""
+    def __init__(self, name, model, events, release):
+        super().__init__()
+        self.name, self.model, self.events, self.release = name, model, events, release
+
+    def prefill(self):
+        self.events.append("prefill " + self.name)
+        self.release.wait(5)
+
+    def chat(self, query):
+        self.events.append("chat " + self.name)
+        return super().chat(query)
+
+
+def test_first_ask_goes_ahead_of_crew_prefill(tmp_path):
+    sink = CollectingSink()
+    model, events, release = object(), [], clemmui.threading.Event()
+    crew = {name: SharedModelMember(name, model, events, release)
+            for name in ("navigator", "engineer", "medic", "pilot")}
+    engine = quiet_engine(sink, tmp_path, crew=crew, stream_responses=False, prefill_crew=True)
+    try:
+        engine.current_crew = "pilot"
+        engine._prefill_crew()
+        job = engine.execute("ask status report")
+        release.set()
+        assert job.result(timeout=5) == "answer to status report"
+        while engine.scheduler.counts() != (0, 0):
+            clemmui.time.sleep(0.01)
+    finally:
+        engine.shutdown()
+    assert events[:2] == ["prefill pilot", "chat pilot"]
+    assert sorted(events[2:]) == ["prefill engineer", "prefill medic", "prefill navigator"]
+
+
+def test_response_cache_saves_atomically(tmp_path):
+    path = tmp_path / "cache" / "responses.json"
+    cache = clemmui.ResponseCache("TEST", path=str(path))
+    cache.put("pilot", "status report", "all green")
+    cache.save()
+    assert os.listdir(path.parent) == ["responses.json"]
+    assert clemmui.ResponseCache("TEST", path=str(path)).get("pilot", "status report") == "all green"
+
+
+def test_metrics_exporter_stops_with_one_whole_file(tmp_path):
+    import json
+
+    path = tmp_path / "metrics.json"
+    exporter = clemmui.MetricsExporter(lambda: {"series": {}, "gauges": {"queued": 0}}, path=str(path),
+                                       interval=0.001)
+    exporter.start()
+    clemmui.time.sleep(0.05)
+    exporter.stop()
+    assert not exporter._writer.is_alive()
+    assert os.listdir(tmp_path) == ["metrics.json"]
+    assert json.loads(path.read_text())["gauges"] == {"queued": 0}